@@ -0,0 +1,218 @@
+"""
+Trainer-wide adherence: planned vs. completed sets per client per week.
+
+Two set-based queries fetch everything for one trainer:
+- plans: every client with the sets prescribed by each of their programs
+  (a program's sets count once per week from the week it was created until
+  the week the client's next program was created, so programs a client has
+  moved on from stop counting)
+- completed: completed sets per client and week, from the
+  workout_log_weekly rollups that log_workout maintains
+
+NumPy turns those rows into client x week matrices. Results are cached per
+trainer. New logs only ever land in the current week, so a refresh re-reads
+completed sets from the cached watermark week onwards and shifts the window
+when a new week starts. The matrix is rebuilt from scratch when the client
+list changes or after rebuild_after seconds.
+"""
+
+import re
+import threading
+import time
+from datetime import datetime, date, timedelta, timezone
+
+import numpy as np
+
+PLANS_SQL = '''
+    SELECT u.id as client_id, u.full_name, p.id as program_id, p.created_at, e.sets
+    FROM clients c
+    JOIN users u ON u.id = c.client_id
+    LEFT JOIN programs p ON p.client_id = c.client_id AND NOT COALESCE(p.is_template, FALSE)
+    LEFT JOIN exercises e ON e.program_id = p.id
+    WHERE c.trainer_id = ?
+    ORDER BY u.full_name, u.id, p.created_at, p.id
+'''
+
+COMPLETED_SQL = '''
+    SELECT w.client_id, w.week_start, SUM(w.total_sets) as total_sets
+    FROM workout_log_weekly w
+    JOIN clients c ON c.client_id = w.client_id
+    WHERE c.trainer_id = ? AND w.week_start >= ?
+    GROUP BY w.client_id, w.week_start
+'''
+
+_FIRST_NUMBER = re.compile(r'\d+')
+
+
+def parse_sets(value):
+    """Prescribed set count from free text such as '3', '3-4' or '4 sets'; 0 if none"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _FIRST_NUMBER.search(value)
+    return int(match.group()) if match else 0
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+class AdherenceMatrix:
+    """Planned and completed sets for clients (rows) over consecutive weeks (columns)"""
+
+    def __init__(self, client_ids, client_names, weeks, planned, completed):
+        self.client_ids = client_ids
+        self.client_names = client_names
+        self.weeks = weeks
+        self.planned = planned
+        self.completed = completed
+        self.built_at = time.monotonic()
+
+    @property
+    def watermark(self):
+        """First week whose completed sets may still change"""
+        return self.weeks[-1]
+
+    @property
+    def ratio(self):
+        """completed / planned per cell; NaN where nothing was planned"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.planned > 0, self.completed / self.planned, np.nan)
+
+    def client_rates(self):
+        """Overall adherence per client across the window (NaN if nothing planned)"""
+        planned = self.planned.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(planned > 0, self.completed.sum(axis=1) / planned, np.nan)
+
+    def week_rates(self):
+        """Adherence per week across all clients with a plan"""
+        planned = self.planned.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(planned > 0, self.completed.sum(axis=0) / planned, np.nan)
+
+    def week_totals(self):
+        """week_rates() as a list with None for weeks without a plan, for templates"""
+        return [None if np.isnan(rate) else float(rate) for rate in self.week_rates()]
+
+    def rows(self):
+        """(client_id, name, overall rate, [(planned, completed, rate), ...]) for templates"""
+        ratio = self.ratio
+        overall = self.client_rates()
+        for i, client_id in enumerate(self.client_ids):
+            cells = [(int(self.planned[i, j]), int(self.completed[i, j]),
+                      None if np.isnan(ratio[i, j]) else float(ratio[i, j]))
+                     for j in range(len(self.weeks))]
+            yield client_id, self.client_names[i], None if np.isnan(overall[i]) else float(overall[i]), cells
+
+
+class AdherenceEngine:
+    """Builds and incrementally refreshes one AdherenceMatrix per trainer"""
+
+    def __init__(self, weeks=12, rebuild_after=3600):
+        self.weeks = weeks
+        self.rebuild_after = rebuild_after
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, trainer_id=None):
+        with self._lock:
+            if trainer_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(trainer_id, None)
+
+    def matrix(self, db, trainer_id, today=None):
+        """Current matrix for a trainer, refreshing or rebuilding the cached one as needed"""
+        # Logs are dated in UTC (see log_workout), so weeks are too
+        today = today or datetime.now(timezone.utc).date()
+        current_week = _week_start(today)
+        weeks = [current_week - timedelta(weeks=n) for n in range(self.weeks - 1, -1, -1)]
+
+        client_ids, client_names, planned = self._plans(db, trainer_id, weeks)
+        with self._lock:
+            cached = self._cache.get(trainer_id)
+
+        if (cached is None or cached.client_ids != client_ids
+                or time.monotonic() - cached.built_at > self.rebuild_after
+                or len(cached.weeks) != len(weeks) or cached.weeks[0] > weeks[0]):
+            completed = self._completed(db, trainer_id, client_ids, weeks, weeks[0])
+            result = AdherenceMatrix(client_ids, client_names, weeks, planned, completed)
+        else:
+            result = self._refresh(db, trainer_id, cached, client_names, weeks, planned)
+
+        with self._lock:
+            self._cache[trainer_id] = result
+        return result
+
+    def _refresh(self, db, trainer_id, cached, client_names, weeks, planned):
+        """Shift the cached window forward and re-read weeks from the old watermark on"""
+        shift = (weeks[-1] - cached.weeks[-1]).days // 7
+        completed = np.zeros_like(cached.completed)
+        if shift < len(weeks):
+            completed[:, :len(weeks) - shift] = cached.completed[:, shift:]
+
+        since = max(cached.watermark, weeks[0])
+        completed[:, weeks.index(since):] = 0
+        completed += self._completed(db, trainer_id, cached.client_ids, weeks, since)
+
+        result = AdherenceMatrix(cached.client_ids, client_names, weeks, planned, completed)
+        result.built_at = cached.built_at
+        return result
+
+    def _plans(self, db, trainer_id, weeks):
+        rows = db.execute(PLANS_SQL, (trainer_id,)).fetchall()
+
+        client_ids, client_names, index = [], [], {}
+        # program ID -> [client row, first week, sets per week], in each client's program order
+        programs = {}
+        for row in rows:
+            if row['client_id'] not in index:
+                index[row['client_id']] = len(client_ids)
+                client_ids.append(row['client_id'])
+                client_names.append(row['full_name'])
+            if row['created_at'] is None:
+                continue
+            program = programs.setdefault(row['program_id'], [
+                index[row['client_id']], (_week_start(_to_date(row['created_at'])) - weeks[0]).days // 7, 0])
+            program[2] += parse_sets(row['sets'])
+
+        # A program's sets count from its first week until the client's next program starts:
+        # scatter +sets at the start and -sets at the end, then cumulative sum.
+        # Column len(weeks) collects starts and ends after the window.
+        program_rows, start_weeks, end_weeks, sets = [], [], [], []
+        programs = list(programs.values())
+        for (client_row, start_week, program_sets), following in zip(programs, programs[1:] + [None]):
+            program_rows.append(client_row)
+            start_weeks.append(start_week)
+            end_weeks.append(following[1] if following and following[0] == client_row else len(weeks))
+            sets.append(program_sets)
+
+        increments = np.zeros((len(client_ids), len(weeks) + 1))
+        if program_rows:
+            program_rows, sets = np.array(program_rows), np.array(sets, dtype=float)
+            np.add.at(increments, (program_rows, np.clip(np.array(start_weeks), 0, len(weeks))), sets)
+            np.add.at(increments, (program_rows, np.clip(np.array(end_weeks), 0, len(weeks))), -sets)
+        planned = np.cumsum(increments, axis=1)[:, :len(weeks)]
+        return client_ids, client_names, planned
+
+    def _completed(self, db, trainer_id, client_ids, weeks, since):
+        completed = np.zeros((len(client_ids), len(weeks)))
+        rows = db.execute(COMPLETED_SQL, (trainer_id, since.isoformat())).fetchall()
+        index = {client_id: i for i, client_id in enumerate(client_ids)}
+        cells = [(index[row['client_id']], (_to_date(row['week_start']) - weeks[0]).days // 7, row['total_sets'] or 0)
+                 for row in rows if row['client_id'] in index]
+        cells = [cell for cell in cells if 0 <= cell[1] < len(weeks)]
+        if cells:
+            client_index, week_index, totals = zip(*cells)
+            np.add.at(completed, (np.array(client_index), np.array(week_index)), np.array(totals, dtype=float))
+        return completed
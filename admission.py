@@ -0,0 +1,170 @@
+"""
+In-process admission control for expensive endpoints.
+
+Routes are tagged with a cost class (see admission_class). Each class has
+- a token bucket (rate per second, burst) limiting how often it may start,
+- a concurrency limit on how many of its requests run at once per worker,
+- a latency budget (max_wait): how long a request may queue for a slot.
+
+A request that cannot get a slot within its budget, or then finds the
+bucket empty, is shed immediately with 503 and Retry-After instead of tying
+up a worker thread. Tokens are only spent on admitted requests. Untagged
+routes (the client logging API) are never limited, so expensive traffic
+cannot starve them of workers.
+
+Routes tagged conditional=True admit conditional GETs (If-None-Match or
+If-Modified-Since) themselves, via admit_view() after their 304 check, so
+cheap revalidations are never charged to the class.
+
+Limits can be overridden with ADMISSION_CLASSES, e.g.
+"auth=2:5:10:0.5,admin=1:0.2:2:0" (concurrency:rate:burst:max_wait).
+"""
+
+import math
+import threading
+import time
+
+
+class TokenBucket:
+    """Classic token bucket; take() never blocks"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Consume a token; returns 0 on success, else seconds until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class CostClass:
+    """Limits for one class of endpoints"""
+
+    def __init__(self, name, concurrency, rate, burst, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self.shed = 0
+
+    def admit(self):
+        """Take a slot, then a token; returns None if admitted, else a Retry-After in seconds"""
+        if not self._slots.acquire(timeout=self.max_wait):
+            self.shed += 1
+            return 1
+        wait = self.bucket.take()
+        if wait:
+            self._slots.release()
+            self.shed += 1
+            return max(1, math.ceil(min(wait, 60)))
+        return None
+
+    def release(self):
+        self._slots.release()
+
+
+def parse_classes(spec):
+    """Parse ADMISSION_CLASSES ("name=concurrency:rate:burst:max_wait,...") into a dict of tuples"""
+    limits = {}
+    for part in (spec or '').split(','):
+        name, sep, values = part.partition('=')
+        if not sep or not name.strip():
+            continue
+        concurrency, rate, burst, max_wait = values.split(':')
+        limits[name.strip()] = (int(concurrency), float(rate), float(burst), float(max_wait))
+    return limits
+
+
+def admission_class(name, methods=None, conditional=False):
+    """Tag a route with a cost class, optionally only for some HTTP methods.
+
+    With conditional=True, conditional requests are left for the view to admit
+    with AdmissionController.admit_view() once it knows it will not answer 304.
+    """
+    def decorator(f):
+        f.admission_class = name
+        f.admission_methods = methods
+        f.admission_conditional = conditional
+        return f
+    return decorator
+
+
+def is_conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+class AdmissionController:
+    """Admits or sheds requests per cost class; wire up with init_app()"""
+
+    def __init__(self, limits):
+        self.classes = {name: CostClass(name, *values) for name, values in limits.items()}
+        self._reject = None
+
+    def init_app(self, app, reject):
+        """reject(cost_class, retry_after) builds the 503 response"""
+        from flask import g, request
+
+        self._reject = reject
+
+        @app.before_request
+        def admit_request():
+            view = app.view_functions.get(request.endpoint)
+            if getattr(view, 'admission_conditional', False) and is_conditional(request):
+                return None
+            return self._admit_view(view)
+
+        @app.teardown_request
+        def release_slot(exc):
+            cost_class = g.pop('admission_slot', None)
+            if cost_class is not None:
+                cost_class.release()
+
+    def admit(self, name):
+        """Admit part of a request (e.g. only a cache miss) under class name from inside a view.
+
+        Returns None when admitted (release the class's slot when done), else the 503 response.
+        """
+        cost_class = self.classes[name]
+        retry_after = cost_class.admit()
+        return None if retry_after is None else self.rejection(cost_class, retry_after)
+
+    def admit_view(self):
+        """Admit a conditional request its route deferred (see admission_class), past its 304 check.
+
+        Returns None when admitted (the slot is released at teardown) or not limited, else the 503 response.
+        """
+        from flask import current_app, g, request
+
+        if 'admission_slot' in g:
+            return None
+        return self._admit_view(current_app.view_functions.get(request.endpoint))
+
+    def _admit_view(self, view):
+        from flask import g, request
+
+        cost_class = self.classes.get(getattr(view, 'admission_class', None))
+        methods = getattr(view, 'admission_methods', None)
+        if cost_class is None or (methods and request.method not in methods):
+            return None
+        retry_after = cost_class.admit()
+        if retry_after is not None:
+            return self.rejection(cost_class, retry_after)
+        g.admission_slot = cost_class
+        return None
+
+    def rejection(self, cost_class, retry_after):
+        response = self._reject(cost_class, retry_after)
+        response.status_code = 503
+        response.headers['Retry-After'] = str(retry_after)
+        return response
@@ -1,48 +1,197 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import time
+IMPORT_STARTED = time.perf_counter()  # for the startup report in create_app()
+
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, g,
+                   has_request_context, stream_with_context)
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import sqlite3
-from datetime import datetime
+import asyncio
+from datetime import datetime, date, timedelta, timezone
+from itertools import islice
+import base64
+import binascii
+import hashlib
+import importlib.util
+import json
+import logging
 import os
+import re
+import uuid
+
+import async_db
+from admission import AdmissionController, admission_class, parse_classes
+from archive import (ARCHIVE_COLUMNS, DAILY_UPSERT_SQL, WEEKLY_UPSERT_SQL, archived_logs_query, attach_sqlite_archive,
+                     backfill_rollups, delete_archived_logs, log_metrics, rollup_params, sqlite_archive_path)
+from assets import init_assets
+from records import CURRENT_RECORDS_SQL, PR_UPSERT_SQL, REP_RECORD_UPSERT_SQL, backfill_records, new_records, record_params
+from cache import FragmentCache, TTLCache
+from compression import CompressionMiddleware
+import events
+from events import EventBus
+from facets import FACETS, LibraryFacets, parse_muscle_groups
+from invalidation import InvalidationBus
+from recurrence import expand_sessions, describe_rule, occurs_on, parse_weekdays
+from replicas import ReplicaSet, split_targets, postgres_lag, sqlite_file_lag
+from shards import ShardRouter, mirror_accounts, mirror_library, owning_trainer_id
+from startup import StartupTimer, enable_bytecode_cache, precompile_templates
+import sync
+from sync import program_audiences, record_changes, record_feed, record_program
+import structured_logging
+from structured_logging import configure_logging, init_request_logging
+from substitutes import SubstitutionEngine
+
+logger = logging.getLogger('app')
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
 
-# Check if running on Render with PostgreSQL
+def normalize_database_url(url):
+    """psycopg only accepts the postgresql:// scheme"""
+    return url.replace('postgres://', 'postgresql://', 1) if url.startswith('postgres://') else url
+
+def pg_connect(url, **kwargs):
+    """Open a psycopg connection that returns dict rows"""
+    import psycopg
+    from psycopg.rows import dict_row
+    return psycopg.connect(url, row_factory=dict_row, **kwargs)
+
+# Check if running on Render with PostgreSQL; fall back to SQLite if psycopg is not installed.
+# Decided without importing anything, so importing this module has no side effects (see create_app).
 DATABASE_URL = os.environ.get('DATABASE_URL')
-USE_POSTGRES = DATABASE_URL is not None
+PSYCOPG_AVAILABLE = importlib.util.find_spec('psycopg') is not None
+USE_POSTGRES = DATABASE_URL is not None and PSYCOPG_AVAILABLE
 
-# Try importing psycopg, gracefully fall back to SQLite if not available
 if USE_POSTGRES:
-    try:
-        import psycopg
-        from psycopg.rows import dict_row
-        app.config['DATABASE_URL'] = DATABASE_URL.replace('postgres://', 'postgresql://', 1) if DATABASE_URL.startswith('postgres://') else DATABASE_URL
-        print("Using PostgreSQL database with psycopg3")
-    except ImportError as e:
-        print("=" * 60)
-        print("WARNING: PostgreSQL configured but psycopg not available")
-        print(f"Error: {e}")
-        print("FALLING BACK TO SQLITE - Data will NOT persist across restarts!")
-        print("=" * 60)
-        USE_POSTGRES = False
-        app.config['DATABASE'] = 'trainer_dashboard.db'
+    app.config['DATABASE_URL'] = normalize_database_url(DATABASE_URL)
 else:
     app.config['DATABASE'] = 'trainer_dashboard.db'
-    print("Using SQLite database (data will not persist on Render)")
+
+# Optional read replicas: PostgreSQL standbys, or SQLite file copies for local testing
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 2))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+# After a user writes, their reads stay on the primary for this long
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
+
+if USE_POSTGRES:
+    replica_set = ReplicaSet(
+        [normalize_database_url(url) for url in split_targets(os.environ.get('DATABASE_REPLICA_URLS'))],
+        postgres_lag(pg_connect, REPLICA_CONNECT_TIMEOUT),
+        max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL)
+else:
+    replica_set = ReplicaSet(
+        split_targets(os.environ.get('SQLITE_REPLICAS')),
+        sqlite_file_lag(app.config['DATABASE']),
+        max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL)
+
+# Horizontal shards by trainer (see shards.py); shard 0 is the database above
+if USE_POSTGRES:
+    SHARD_TARGETS = [app.config['DATABASE_URL']] + [
+        normalize_database_url(url) for url in split_targets(os.environ.get('SHARD_URLS'))]
+else:
+    SHARD_TARGETS = [app.config['DATABASE']] + split_targets(os.environ.get('SQLITE_SHARDS'))
+shard_router = ShardRouter(SHARD_TARGETS, cache_ttl=int(os.environ.get('SHARD_DIRECTORY_TTL', 5)))
+
+# Async read pool for handlers that run independent queries concurrently (see async_db.py)
+async_db.configure(
+    conninfo=app.config['DATABASE_URL'] if USE_POSTGRES else None,
+    sqlite_path=None if USE_POSTGRES else app.config['DATABASE'],
+    min_size=int(os.environ.get('ASYNC_POOL_MIN_SIZE', 1)),
+    max_size=int(os.environ.get('ASYNC_POOL_MAX_SIZE', 10)))
+
+def request_shard():
+    """Shard holding the logged-in user's data (their trainer's shard); 0 outside requests or when unsharded"""
+    if len(shard_router) == 1 or not has_request_context() or 'user_id' not in session:
+        return 0
+    if 'shard' not in g:
+        if 'shard_trainer_id' not in session:
+            # Sessions from before sharding was enabled
+            directory = get_db(readonly=False, shard=0)
+            session['shard_trainer_id'] = owning_trainer_id(directory, session['user_id'], session.get('role'))
+            directory.close()
+        g.shard, g.shard_moving = shard_router.lookup(
+            session['shard_trainer_id'], lambda: get_db(readonly=False, shard=0))
+    return g.shard
+
+def read_target():
+    """Replica or shard for async reads in this request, or None for the primary"""
+    shard = request_shard()
+    if shard:
+        return SHARD_TARGETS[shard]
+    return replica_set.pick() if has_request_context() and g.get('use_replica', False) else None
+
+def database_path(shard=None):
+    """SQLite file of a shard (default: this request's), or None on PostgreSQL"""
+    if USE_POSTGRES:
+        return None
+    return SHARD_TARGETS[request_shard() if shard is None else shard]
+
+def note_write():
+    """Record that this request committed, for read-your-writes routing"""
+    if has_request_context():
+        g.db_wrote = True
 
 # Database helper functions
-def get_db():
+def get_db(readonly=None, shard=None):
+    """Open a connection to this request's shard; read-only routes may be served by a replica"""
+    if shard is None:
+        shard = request_shard()
+    if readonly is None:
+        readonly = has_request_context() and g.get('use_replica', False)
+    # Replicas follow the primary (shard 0) only
+    replica = replica_set.pick() if readonly and shard == 0 else None
+
     if USE_POSTGRES:
-        import psycopg
-        from psycopg.rows import dict_row
-        conn = psycopg.connect(app.config['DATABASE_URL'], row_factory=dict_row)
+        conn = pg_connect(replica or SHARD_TARGETS[shard])
+        if replica:
+            conn.read_only = True
         return PostgresDB(conn)
     else:
-        db = sqlite3.connect(app.config['DATABASE'])
+        if replica:
+            db = sqlite3.connect(f'file:{replica}?mode=ro', uri=True, factory=SQLiteDB)
+        else:
+            db = sqlite3.connect(SHARD_TARGETS[shard], factory=SQLiteDB)
         db.row_factory = sqlite3.Row
         return db
 
+def directory_db(db):
+    """Connection to shard 0, which owns users, clients, the shard directory and the exercise library; db itself if
+    that is shard 0"""
+    return db if request_shard() == 0 else get_db(readonly=False, shard=0)
+
+def sync_accounts(db, directory, user_ids):
+    """Refresh this shard's mirror of users/clients rows after changing them on shard 0, then release directory"""
+    if directory is db:
+        return
+    mirror_accounts(directory, db, user_ids)
+    db.commit()
+    directory.close()
+
+def sync_library(db, directory, library_id):
+    """Copy a library entry committed on shard 0 into every other shard's mirror, then release directory.
+
+    The IDs are shard 0's, so one invalidation (broadcast on shard 0) reaches every shard's facet index.
+    """
+    for shard in range(1, len(SHARD_TARGETS)):
+        target = db if shard == request_shard() else get_db(readonly=False, shard=shard)
+        mirror_library(directory, target, [library_id])
+        bump_version(target, 'exercise_library')
+        record_feed(target, 'exercise_library', [library_id], [0], utc_now())
+        target.commit()
+        if target is not db:
+            target.close()
+    if directory is not db:
+        directory.close()
+
+class SQLiteDB(sqlite3.Connection):
+    """sqlite3 connection that records commits for read-your-writes routing"""
+
+    def commit(self):
+        super().commit()
+        note_write()
+
 # Simple wrapper to make PostgreSQL work like SQLite
 class PostgresDB:
     def __init__(self, conn):
@@ -59,27 +208,44 @@ class PostgresDB:
 
     def commit(self):
         self.conn.commit()
+        note_write()
 
     def close(self):
         if self._cursor:
             self._cursor.close()
         self.conn.close()
 
+# Migration files applied in order by /migrate
+MIGRATIONS = ['migrate_phase1.sql', 'migrate_phase2.sql']
+
+def adapt_schema_for_postgres(schema):
+    """Rewrite SQLite DDL into its PostgreSQL equivalent"""
+    schema = schema.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+    schema = schema.replace('AUTOINCREMENT', '')
+    schema = schema.replace('BOOLEAN DEFAULT 0', 'BOOLEAN DEFAULT FALSE')
+    schema = schema.replace('DATETIME', 'TIMESTAMP')
+    return schema
+
+def without_seed_accounts(schema):
+    """Schema minus its demo users/clients inserts; accounts are created on shard 0 and mirrored"""
+    statements = [stmt for stmt in schema.split(';')
+                  if not re.match(r'(\s*--[^\n]*\n)*\s*INSERT INTO (users|clients)\b', stmt)]
+    return ';'.join(statements)
+
 def init_db():
-    """Initialize database schema"""
+    """Initialize database schema on every shard"""
     with app.open_resource('schema.sql', mode='r') as f:
         schema = f.read()
 
+    for shard in range(len(SHARD_TARGETS)):
+        init_shard_schema(schema if shard == 0 else without_seed_accounts(schema), shard)
+
+def init_shard_schema(schema, shard):
     if USE_POSTGRES:
         # Adapt schema for PostgreSQL
-        schema = schema.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
-        schema = schema.replace('AUTOINCREMENT', '')
-        schema = schema.replace('BOOLEAN DEFAULT 0', 'BOOLEAN DEFAULT FALSE')
-        schema = schema.replace('DATETIME', 'TIMESTAMP')
-
-        import psycopg
-        from psycopg.rows import dict_row
-        conn = psycopg.connect(app.config['DATABASE_URL'], row_factory=dict_row)
+        schema = adapt_schema_for_postgres(schema)
+
+        conn = pg_connect(SHARD_TARGETS[shard])
         cursor = conn.cursor()
 
         # Execute statements individually
@@ -111,8 +277,7 @@ def init_db():
                 error_msg = str(e).lower()
                 if 'duplicate' not in error_msg and 'unique' not in error_msg and 'already exists' not in error_msg:
                     error_detail = f"Statement {i+1}: {str(e)}"
-                    print(f"Error executing statement {i+1}: {e}")
-                    print(f"Statement was: {stmt[:200]}")
+                    logger.error("Error executing statement %d: %s", i + 1, e, extra={'statement': stmt[:200]})
                     errors.append(error_detail)
 
         # If there were critical errors, raise them
@@ -125,18 +290,301 @@ def init_db():
         cursor.close()
         conn.close()
     else:
-        db = get_db()
+        db = get_db(readonly=False, shard=shard)
         try:
             db.cursor().executescript(schema)
             db.commit()
         except Exception as e:
             # Ignore duplicate errors in SQLite
             if 'UNIQUE constraint' not in str(e):
-                print(f"Error: {e}")
+                logger.error("Error initializing SQLite schema: %s", e)
                 raise
         finally:
             db.close()
 
+# Version stamps and conditional GET
+# Changes whenever a new build is deployed so cached pages never outlive their templates
+DEPLOY_VERSION = os.environ.get('RENDER_GIT_COMMIT') or str(time.time())
+
+def utc_now():
+    """Current UTC time as a string both SQLite and PostgreSQL accept for TIMESTAMP"""
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(' ')
+
+BUMP_VERSION_SQL = '''
+    INSERT INTO data_versions (name, version, updated_at)
+    VALUES (?, 1, ?)
+    ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, updated_at = excluded.updated_at
+'''
+GET_VERSION_SQL = 'SELECT version, updated_at FROM data_versions WHERE name = ?'
+
+def bump_version(db, name):
+    """Advance a named data version stamp (e.g. 'exercise_library') inside the caller's transaction"""
+    db.execute(BUMP_VERSION_SQL, (name, utc_now()))
+
+def get_version(db, name):
+    """Return (version, updated_at) for a named data version stamp"""
+    row = db.execute(GET_VERSION_SQL, (name,)).fetchone()
+    return _version_tuple(row)
+
+def bump_versions(db, kind, user_ids):
+    """Advance the '<kind>:<user ID>' stamps (clients, programs or sessions) that key cached page fragments"""
+    for user_id in sorted(set(user_ids)):
+        bump_version(db, f'{kind}:{user_id}')
+
+def _versions_sql(names):
+    return f"SELECT name, version FROM data_versions WHERE name IN ({', '.join('?' for _ in names)})"
+
+def _versions(names, rows):
+    versions = dict.fromkeys(names, 0)
+    versions.update((row['name'], row['version']) for row in rows)
+    return versions
+
+def get_versions(db, names):
+    """{name: version} for named data version stamps, 0 for ones never bumped"""
+    return _versions(names, db.execute(_versions_sql(names), list(names)).fetchall())
+
+async def fetch_versions(names, target=None):
+    """get_versions() on the async pool"""
+    return _versions(names, await async_db.fetchall(_versions_sql(names), list(names), target))
+
+def record_library_change(db, name):
+    """Stamp a library entry (looked up by its unique name) and add it to every user's sync feed; returns its ID"""
+    row = db.execute('SELECT id FROM exercise_library WHERE name = ?', (name,)).fetchone()
+    record_changes(db, 'exercise_library', [row['id']], [0], utc_now())
+    return row['id']
+
+def _version_tuple(row):
+    if not row:
+        return 0, None
+    return row['version'], row['updated_at']
+
+def make_etag(*parts):
+    """Build a strong ETag from version stamps plus who is looking at the page"""
+    key = '|'.join(str(part) for part in parts + (
+        DEPLOY_VERSION, session.get('user_id'), session.get('role'), session.get('full_name')))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def _http_datetime(value):
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace(' ', 'T'))
+    return value.replace(microsecond=0, tzinfo=value.tzinfo or timezone.utc)
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the client's cached copy is still current, else None.
+
+    Call this before running expensive queries or rendering templates.
+    """
+    # Pending flash messages have to be rendered, so never short-circuit them
+    if session.get('_flashes'):
+        return None
+
+    last_modified = _http_datetime(last_modified)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif last_modified and request.if_modified_since:
+        fresh = last_modified <= request.if_modified_since
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+    return add_validators(app.response_class(status=304), etag, last_modified)
+
+def add_validators(response, etag, last_modified=None):
+    """Attach ETag/Last-Modified and require revalidation on every use"""
+    response = app.make_response(response)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_datetime(last_modified)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Rendered template fragments keyed by the version stamps of what they show, so repeat views skip queries and rendering
+fragment_cache = FragmentCache(int(float(os.environ.get('FRAGMENT_CACHE_MB', 16)) * 1024 * 1024))
+
+def fragment_key(name, *stamps):
+    """Cache key for a fragment of this request's shard; stamps must cover everything the fragment shows"""
+    return (name, request_shard()) + stamps
+
+def render_fragments(fragments, load):
+    """Render {name: (template, key)} through fragment_cache.
+
+    load(missing names) returns the template context for the fragments not
+    cached, so a full hit runs no queries. Each template also gets its own
+    name as `fragment`.
+    """
+    html = {name: fragment_cache.get(key) for name, (template, key) in fragments.items()}
+    missing = [name for name, value in html.items() if value is None]
+    if missing:
+        context = load(missing)
+        for name in missing:
+            template, key = fragments[name]
+            html[name] = render_template(template, fragment=name, **context)
+            fragment_cache.set(key, html[name])
+    return {name: Markup(value) for name, value in html.items()}
+
+# Trainer -> owned client IDs, so ownership checks are a set lookup instead of a query
+OWNERSHIP_CACHE_TTL = int(os.environ.get('OWNERSHIP_CACHE_TTL', 300))
+owned_clients_cache = TTLCache(OWNERSHIP_CACHE_TTL)
+
+def owned_client_ids(db, trainer_id, refresh=False):
+    """Return the frozenset of client IDs belonging to a trainer"""
+    client_ids = None if refresh else owned_clients_cache.get(trainer_id)
+    if client_ids is None:
+        rows = db.execute('SELECT client_id FROM clients WHERE trainer_id = ?', (trainer_id,)).fetchall()
+        client_ids = frozenset(row['client_id'] for row in rows)
+        owned_clients_cache.set(trainer_id, client_ids)
+    return client_ids
+
+def trainer_owns_client(db, client_id):
+    """Check that client_id belongs to the logged-in trainer"""
+    if client_id in owned_client_ids(db, session['user_id']):
+        return True
+    # Negative answers are never trusted from cache: a client may have just been added
+    return client_id in owned_client_ids(db, session['user_id'], refresh=True)
+
+# Trainer-wide client x week adherence matrices, refreshed incrementally per trainer.
+# Built on first use: adherence pulls in numpy, which most processes (and CLI scripts) never need.
+_adherence_engine = None
+
+def adherence_engine():
+    """The process-wide AdherenceEngine"""
+    global _adherence_engine
+    if _adherence_engine is None:
+        from adherence import AdherenceEngine
+        _adherence_engine = AdherenceEngine(weeks=int(os.environ.get('ADHERENCE_WEEKS', 12)),
+                                            rebuild_after=int(os.environ.get('ADHERENCE_REBUILD_SECONDS', 3600)))
+    return _adherence_engine
+
+def invalidate_adherence(trainer_id):
+    if _adherence_engine is not None:
+        _adherence_engine.invalidate(trainer_id)
+
+# Read/write routing annotations
+def db_access(mode):
+    """Annotate a route as 'read' (GET/HEAD may use a replica) or 'write' (primary only).
+
+    Any route that accepts a POST is 'write', even if its GET is read-only.
+    """
+    def decorator(f):
+        f.db_access = mode
+        return f
+    return decorator
+
+@app.before_request
+def route_database():
+    view = app.view_functions.get(request.endpoint)
+    g.use_replica = (getattr(view, 'db_access', 'write') == 'read'
+                     and request.method in ('GET', 'HEAD')
+                     and session.get('read_your_writes_until', 0) < time.time())
+
+    # A trainer being moved between shards is read-only for a few seconds (see shards.py)
+    if request.method not in ('GET', 'HEAD'):
+        request_shard()
+        if g.get('shard_moving'):
+            message = 'Your data is being moved, please try again in a few seconds.'
+            response = jsonify({'success': False, 'message': message}) if request.path.startswith('/api/') \
+                else app.make_response(message)
+            response.status_code = 503
+            response.headers['Retry-After'] = str(max(shard_router.cache_ttl, 1))
+            return response
+
+@app.after_request
+def remember_writes(response):
+    if g.get('db_wrote'):
+        session['read_your_writes_until'] = time.time() + READ_YOUR_WRITES_SECONDS
+    return response
+
+def after_commit(callback):
+    """Run callback after this request's response if the request committed a write"""
+    g.setdefault('after_commit', []).append(callback)
+
+@app.after_request
+def run_after_commit(response):
+    callbacks = g.pop('after_commit', [])
+    if g.get('db_wrote'):
+        for callback in callbacks:
+            callback()
+    return response
+
+# Server-sent events (see events.py); PostgreSQL carries them between workers with LISTEN/NOTIFY
+event_bus = EventBus(SHARD_TARGETS if USE_POSTGRES else (), max_queue=int(os.environ.get('SSE_MAX_QUEUE', 100)))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+# Streams end after this long and the browser reconnects, so a worker thread is never held indefinitely
+SSE_MAX_SECONDS = float(os.environ.get('SSE_MAX_SECONDS', 300))
+# Open streams per worker; gunicorn.conf.py adds this many threads on top of GUNICORN_THREADS for them
+SSE_STREAMS = int(os.environ.get('SSE_STREAMS', 16))
+
+def publish_event(db, user_ids, event, data):
+    """Push an event to these users' /events streams once db's transaction commits"""
+    payload = events.encode(user_ids, event, data)
+    if USE_POSTGRES:
+        db.execute('SELECT pg_notify(?, ?)', (events.CHANNEL, payload))
+    else:
+        after_commit(lambda: event_bus.dispatch(payload))
+
+# Cross-worker cache invalidation (see invalidation.py)
+invalidation_bus = InvalidationBus(USE_POSTGRES, SHARD_TARGETS,
+                                   poll_interval=float(os.environ.get('CACHE_POLL_INTERVAL', 0.5)))
+
+def _invalidate(cache):
+    return lambda key: cache.clear() if key is None else cache.invalidate(key)
+
+invalidation_bus.on('owned_clients', _invalidate(owned_clients_cache))
+invalidation_bus.on('owned_clients', invalidate_adherence)
+invalidation_bus.on('adherence', invalidate_adherence)
+invalidation_bus.on('shard_directory', lambda key: shard_router.reset() if key is None else shard_router.invalidate(key))
+
+# Exercise library facet index (see facets.py), refreshed per changed exercise
+library_facets = LibraryFacets()
+invalidation_bus.on('exercise_library', library_facets.invalidate)
+app.add_template_filter(parse_muscle_groups, 'muscle_groups')
+
+def library_facet_index(db, version):
+    """This request's shard's FacetIndex at the given exercise_library version"""
+    return library_facets.get(request_shard(), version, lambda query, params: db.execute(query, params).fetchall())
+
+# Precomputed top-k substitutes per exercise (see substitutes.py), following the facet index
+substitution_engine = SubstitutionEngine(k=int(os.environ.get('SUBSTITUTES_K', 10)),
+                                         refresh_after=int(os.environ.get('SUBSTITUTES_REFRESH_SECONDS', 60)),
+                                         rebuild_after=int(os.environ.get('SUBSTITUTES_REBUILD_SECONDS', 3600)))
+
+def facet_filters(args):
+    """{facet: value} from query parameters (category, equipment, muscle)"""
+    return {facet: args.get(facet, '').strip() for facet in FACETS}
+
+def broadcast_invalidation(db, topic, key=None):
+    """Invalidate topic/key in every worker's caches once db's transaction commits (this worker's right after)"""
+    invalidation_bus.broadcast(db, topic, key)
+    after_commit(lambda: invalidation_bus.apply(topic, key))
+
+@app.before_request
+def poll_invalidations():
+    invalidation_bus.poll()
+
+# Load shedding: per-worker limits for expensive endpoints, as (concurrency, rate/s, burst, max queue wait s).
+# Untagged routes, including the client logging API, are never limited.
+ADMISSION_LIMITS = {
+    'auth': (2, 5, 10, 0.5),    # password hashing (login, password changes)
+    'admin': (1, 0.2, 2, 0),    # setup, migrations
+    'diagnostic': (1, 1, 5, 5), # /diagnostic cache rebuilds (concurrent misses wait for the first, then hit)
+    'heavy': (4, 20, 40, 1.0),  # exercise library pages and adherence matrix
+    'events': (SSE_STREAMS, 20, 40, 0),  # open /events streams (each holds one of the worker's stream threads)
+}
+ADMISSION_LIMITS.update(parse_classes(os.environ.get('ADMISSION_CLASSES')))
+admission = AdmissionController(ADMISSION_LIMITS)
+
+def shed_response(cost_class, retry_after):
+    """503 body for a request rejected by admission control"""
+    logger.warning("Shedding request", extra={'cost_class': cost_class.name, 'retry_after': retry_after})
+    message = 'Server is busy, please try again shortly.'
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'message': message})
+    return app.make_response(message)
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
@@ -156,6 +604,105 @@ def trainer_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# How far ahead recurring sessions are expanded for "upcoming" lists
+RECURRENCE_HORIZON_DAYS = 365
+
+# owner_column is always 'trainer_id' or 'client_id', never user input
+RECURRENCE_RULES_SQL = '''
+    SELECT sr.*, t.full_name as trainer_name, c.full_name as client_name
+    FROM session_recurrences sr
+    JOIN users t ON sr.trainer_id = t.id
+    JOIN users c ON sr.client_id = c.id
+    WHERE sr.{owner_column} = ? AND sr.start_date <= ?
+      AND (sr.end_date IS NULL OR sr.end_date >= ?)
+'''
+RECURRENCE_EXCEPTIONS_SQL = '''
+    SELECT se.recurrence_id, se.occurrence_date, se.status
+    FROM session_exceptions se
+    JOIN session_recurrences sr ON se.recurrence_id = sr.id
+    WHERE sr.{owner_column} = ? AND se.occurrence_date >= ?
+'''
+
+def upcoming_window(horizon_days=RECURRENCE_HORIZON_DAYS):
+    start = date.today()
+    return start, start + timedelta(days=horizon_days)
+
+def merge_upcoming(one_offs, rules, exceptions, start, end, limit=10):
+    """Merge one-off sessions with the expanded occurrences of recurring rules"""
+    if not rules:
+        return list(one_offs)[:limit]
+    return list(islice(expand_sessions(one_offs, rules, exceptions, start, end), limit))
+
+def upcoming_sessions(db, owner_column, owner_id, one_offs, limit=10, horizon_days=RECURRENCE_HORIZON_DAYS):
+    """Merge upcoming one-off sessions with lazily expanded recurring sessions"""
+    start, end = upcoming_window(horizon_days)
+
+    rules = db.execute(RECURRENCE_RULES_SQL.format(owner_column=owner_column),
+                       (owner_id, end.isoformat(), start.isoformat())).fetchall()
+    if not rules:
+        return list(one_offs)[:limit]
+
+    exceptions = db.execute(RECURRENCE_EXCEPTIONS_SQL.format(owner_column=owner_column),
+                            (owner_id, start.isoformat())).fetchall()
+    return merge_upcoming(one_offs, rules, exceptions, start, end, limit)
+
+# Keyset-paginated client history: (table alias, sort column, query) per kind.
+# {after} becomes a row-value comparison against the cursor, matching the
+# (client_id, <sort column> DESC, id DESC) indexes in migrate_phase2.sql.
+HISTORY_PAGE_SIZE = 20
+CLIENT_HISTORY_QUERIES = {
+    'programs': ('p', 'created_at', '''
+        SELECT p.* FROM programs p
+        WHERE p.client_id = ? {after}
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT ?
+    '''),
+    'sessions': ('ts', 'session_date', '''
+        SELECT ts.* FROM training_sessions ts
+        WHERE ts.client_id = ? {after}
+        ORDER BY ts.session_date DESC, ts.id DESC
+        LIMIT ?
+    '''),
+    'logs': ('wl', 'log_date', '''
+        SELECT wl.*, e.name as exercise_name
+        FROM workout_logs wl
+        LEFT JOIN exercises e ON wl.exercise_id = e.id
+        WHERE wl.client_id = ? {after}
+        ORDER BY wl.log_date DESC, wl.id DESC
+        LIMIT ?
+    '''),
+}
+
+def encode_cursor(sort_value, row_id):
+    """Opaque cursor pointing just past (sort_value, row_id)"""
+    payload = json.dumps([str(sort_value), row_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return (sort_value, row_id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(payload)
+        return str(sort_value), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+def client_history_page(db, kind, client_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a client's history, newest first; returns (rows, next_cursor)"""
+    alias, sort_column, query = CLIENT_HISTORY_QUERIES[kind]
+    params = [client_id]
+    after = ''
+    if cursor:
+        after = f'AND ({alias}.{sort_column}, {alias}.id) < (?, ?)'
+        params.extend(decode_cursor(cursor))
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.execute(query.format(after=after), params + [limit + 1]).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][sort_column], rows[-1]['id'])
+
 # Routes
 @app.route('/')
 def index():
@@ -164,17 +711,16 @@ def index():
     return redirect(url_for('login'))
 
 @app.route('/login', methods=['GET', 'POST'])
+@admission_class('auth', methods=('POST',))
+@db_access('write')
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
         try:
-            print(f"Login attempt for username: {username}")
             db = get_db()
-            print(f"Database connection established, USE_POSTGRES={USE_POSTGRES}")
             user = db.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-            print(f"User query result: {user}")
             db.close()
 
             if user and check_password_hash(user['password_hash'], password):
@@ -182,18 +728,17 @@ def login():
                 session['username'] = user['username']
                 session['role'] = user['role']
                 session['full_name'] = user['full_name']
+                # Resolved again on the next request (see request_shard)
+                session.pop('shard_trainer_id', None)
+                logger.info("Login succeeded", extra={'username': username})
                 flash('Login successful!', 'success')
                 return redirect(url_for('dashboard'))
             else:
-                print(f"Login failed - user exists: {user is not None}")
+                logger.info("Login failed", extra={'username': username, 'user_exists': user is not None})
                 flash('Invalid username or password.', 'error')
         except Exception as e:
             # Database not initialized or connection error
-            import traceback
-            print("=" * 60)
-            print(f"LOGIN ERROR: {e}")
-            print(traceback.format_exc())
-            print("=" * 60)
+            logger.exception("Login error", extra={'username': username})
             error_msg = str(e).lower()
             if 'no such table' in error_msg or 'does not exist' in error_msg:
                 flash('Database not initialized. Please contact administrator.', 'error')
@@ -209,6 +754,8 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/change-password', methods=['GET', 'POST'])
+@admission_class('auth', methods=('POST',))
+@db_access('write')
 @login_required
 def change_password():
     """Allow users to change their own password"""
@@ -239,10 +786,12 @@ def change_password():
             db.close()
             return render_template('change_password.html')
 
-        # Update password
+        # Update password (accounts live on shard 0, mirrored to the user's shard)
         new_password_hash = generate_password_hash(new_password)
-        db.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, session['user_id']))
-        db.commit()
+        directory = directory_db(db)
+        directory.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, session['user_id']))
+        directory.commit()
+        sync_accounts(db, directory, [session['user_id']])
         db.close()
 
         flash('Password changed successfully!', 'success')
@@ -251,27 +800,21 @@ def change_password():
     return render_template('change_password.html')
 
 @app.route('/setup', methods=['GET', 'POST'])
+@admission_class('admin', methods=('POST',))
+@db_access('write')
 def setup():
     """Initialize database - one-time setup"""
     if request.method == 'POST':
         try:
-            print("=" * 60)
-            print("Starting database initialization...")
-            print(f"USE_POSTGRES: {USE_POSTGRES}")
-            if USE_POSTGRES:
-                print(f"DATABASE_URL configured: {app.config.get('DATABASE_URL', 'NOT SET')[:50]}...")
+            logger.info("Starting database initialization", extra={'use_postgres': USE_POSTGRES})
             init_db()
-            print("Database initialization completed successfully!")
-            print("=" * 60)
+            logger.info("Database initialization completed")
             flash('Database initialized successfully! You can now log in with username: trainer1, password: password123', 'success')
             return redirect(url_for('login'))
         except Exception as e:
             import traceback
             error_detail = traceback.format_exc()
-            print("=" * 60)
-            print("ERROR during database initialization:")
-            print(error_detail)
-            print("=" * 60)
+            logger.exception("Database initialization failed")
             flash(f'Error initializing database: {str(e)}', 'error')
             return f'''
             <!DOCTYPE html>
@@ -325,57 +868,102 @@ def setup():
     </html>
     '''
 
+def migrate_shard(migration, shard):
+    """Apply the migration SQL to one shard and backfill derived tables; returns warnings"""
+    errors = []
+    if USE_POSTGRES:
+        migration = adapt_schema_for_postgres(migration)
+        conn = pg_connect(SHARD_TARGETS[shard])
+        cursor = conn.cursor()
+
+        # Split by semicolon and execute each statement
+        statements = [s.strip() for s in migration.split(';') if s.strip()]
+
+        for i, stmt in enumerate(statements):
+            try:
+                cursor.execute(stmt)
+            except Exception as e:
+                error_msg = str(e).lower()
+                # Ignore "column already exists" errors
+                if 'already exists' not in error_msg and 'duplicate column' not in error_msg:
+                    errors.append(f"Statement {i+1}: {str(e)}")
+
+        try:
+            cursor.execute(sync.POSTGRES_FEED_TX_SQL)
+        except Exception as e:
+            errors.append(f"Change feed: {str(e)}")
+
+        conn.commit()
+        cursor.close()
+
+        # Seed rollups and personal records from existing logs (no-op once they have data)
+        db = PostgresDB(conn)
+        backfill_rollups(db)
+        backfill_records(db, True)
+        db.commit()
+        db.close()
+    else:
+        db = get_db(readonly=False, shard=shard)
+        # SQLite has no ADD COLUMN IF NOT EXISTS; duplicate columns are ignored below
+        migration = migration.replace('ADD COLUMN IF NOT EXISTS', 'ADD COLUMN')
+        statements = [s.strip() for s in migration.split(';') if s.strip()]
+        for stmt in statements:
+            try:
+                db.execute(stmt, ())
+            except Exception as e:
+                if 'duplicate column' not in str(e).lower():
+                    pass  # Ignore duplicate column errors
+        db.commit()
+        backfill_records(db, False, database_path(shard))
+        backfill_rollups(db)
+        db.commit()
+        db.close()
+    return errors
+
+def mirror_libraries():
+    """Refresh every shard's copy of the exercise library from shard 0 (e.g. a newly added shard); returns warnings"""
+    errors = []
+    directory = get_db(readonly=False, shard=0)
+    try:
+        for shard in range(1, len(SHARD_TARGETS)):
+            target = get_db(readonly=False, shard=shard)
+            try:
+                mirror_library(directory, target)
+                bump_version(target, 'exercise_library')
+                target.commit()
+            except Exception as e:
+                errors.append(f"Shard {shard}: mirroring the exercise library failed: {e}")
+            finally:
+                target.close()
+    finally:
+        directory.close()
+    return errors
+
 @app.route('/migrate', methods=['GET', 'POST'])
+@admission_class('admin', methods=('POST',))
+@db_access('write')
 def migrate():
-    """Run database migrations for Phase 1 enhancements"""
+    """Run database migrations for Phase 1 and Phase 2 enhancements"""
     if request.method == 'POST':
         try:
-            with app.open_resource('migrate_phase1.sql', mode='r') as f:
-                migration = f.read()
-
-            if USE_POSTGRES:
-                import psycopg
-                from psycopg.rows import dict_row
-                conn = psycopg.connect(app.config['DATABASE_URL'], row_factory=dict_row)
-                cursor = conn.cursor()
-
-                # Split by semicolon and execute each statement
-                statements = [s.strip() for s in migration.split(';') if s.strip()]
-                errors = []
-
-                for i, stmt in enumerate(statements):
-                    try:
-                        cursor.execute(stmt)
-                    except Exception as e:
-                        error_msg = str(e).lower()
-                        # Ignore "column already exists" errors
-                        if 'already exists' not in error_msg and 'duplicate column' not in error_msg:
-                            errors.append(f"Statement {i+1}: {str(e)}")
-
-                conn.commit()
-                cursor.close()
-                conn.close()
-
-                if errors:
-                    return f"<h1>Migration completed with warnings</h1><pre>{chr(10).join(errors)}</pre><p><a href='/'>Back to Home</a></p>"
-                else:
-                    return "<h1>Migration successful!</h1><p>All database changes applied successfully.</p><p><a href='/'>Back to Home</a></p>"
+            migration = ''
+            for filename in MIGRATIONS:
+                with app.open_resource(filename, mode='r') as f:
+                    migration += f.read() + ';\n'
+
+            errors = []
+            for shard in range(len(SHARD_TARGETS)):
+                errors += migrate_shard(migration, shard)
+            errors += mirror_libraries()
+
+            if errors:
+                return f"<h1>Migration completed with warnings</h1><pre>{chr(10).join(errors)}</pre><p><a href='/'>Back to Home</a></p>"
             else:
-                # SQLite
-                db = get_db()
-                statements = [s.strip() for s in migration.split(';') if s.strip()]
-                for stmt in statements:
-                    try:
-                        db.execute(stmt, ())
-                    except Exception as e:
-                        if 'duplicate column' not in str(e).lower():
-                            pass  # Ignore duplicate column errors
-                db.commit()
-                db.close()
                 return "<h1>Migration successful!</h1><p>All database changes applied successfully.</p><p><a href='/'>Back to Home</a></p>"
 
         except Exception as e:
             import traceback
+            logger.exception("Migration failed")
             return f"<h1>Migration failed</h1><pre>{traceback.format_exc()}</pre><p><a href='/migrate'>Try Again</a></p>"
 
     return '''
@@ -392,13 +980,16 @@ def migrate():
         </style>
     </head>
     <body>
-        <h1>Database Migration - Phase 1</h1>
+        <h1>Database Migration</h1>
         <p>This will add new fields to support enhanced features:</p>
         <ul>
             <li>Extended client profiles (phone, goals, fitness level, medical notes)</li>
             <li>Exercise library enhancements (demo videos, instructions, muscle groups)</li>
             <li>Workout template fields (tempo, rest periods)</li>
             <li>Program templates for cloning</li>
+            <li>Recurring training sessions</li>
+            <li>Daily and weekly workout rollups</li>
+            <li>Personal records</li>
         </ul>
         <div class="warning">
             <strong>Note:</strong> This migration is safe to run multiple times. Existing data will not be affected.
@@ -411,81 +1002,106 @@ def migrate():
     </html>
     '''
 
-@app.route('/diagnostic')
-def diagnostic():
-    """Diagnostic page to check database status"""
-    info = []
-    info.append(f"USE_POSTGRES: {USE_POSTGRES}")
+# Probes and diagnostics: cheap enough for load balancers and uptime checks to hit often
+READY_TIMEOUT = float(os.environ.get('READY_TIMEOUT', 2))
+DIAGNOSTIC_CACHE_TTL = int(os.environ.get('DIAGNOSTIC_CACHE_TTL', 60))
+diagnostic_cache = TTLCache(DIAGNOSTIC_CACHE_TTL)
+
+# Planner row estimates (maintained by autovacuum/ANALYZE) instead of COUNT(*) scans
+POSTGRES_TABLE_STATS_SQL = '''
+    SELECT c.relname as name, c.reltuples::bigint as estimate
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+    ORDER BY c.relname
+'''
+
+def table_stats(db):
+    """[(table, estimated rows or None)]; estimates come from the last ANALYZE"""
+    if USE_POSTGRES:
+        return [(row['name'], row['estimate'] if row['estimate'] >= 0 else None)
+                for row in db.execute(POSTGRES_TABLE_STATS_SQL).fetchall()]
 
+    tables = [row['name'] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()]
+    estimates = {}
+    try:
+        # sqlite_stat1 only exists after ANALYZE; its first number is the row count
+        for row in db.execute('SELECT tbl, stat FROM sqlite_stat1').fetchall():
+            estimates[row['tbl']] = max(estimates.get(row['tbl'], 0), int(row['stat'].split()[0]))
+    except sqlite3.OperationalError:
+        pass
+    return [(name, estimates.get(name)) for name in tables]
+
+@app.route('/healthz')
+def healthz():
+    """Liveness probe: the process is up and serving requests"""
+    response = jsonify({'status': 'ok'})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: check out a pooled connection and run a trivial query"""
+    try:
+        async_db.run(asyncio.wait_for(async_db.fetchone('SELECT 1 as ok'), READY_TIMEOUT))
+        response = jsonify({'status': 'ok'})
+    except Exception as e:
+        logger.warning("Readiness check failed: %s", e)
+        response = jsonify({'status': 'unavailable'})
+        response.status_code = 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def diagnostic_info():
+    """(lines, checked_at) for the diagnostic page"""
+    info = [f"USE_POSTGRES: {USE_POSTGRES}"]
     if USE_POSTGRES:
-        info.append(f"DATABASE_URL set: Yes (first 50 chars: {app.config.get('DATABASE_URL', 'NOT SET')[:50]}...)")
+        info.append("DATABASE_URL set: Yes")
     else:
         info.append(f"Using SQLite: {app.config.get('DATABASE', 'NOT SET')}")
 
-    # Try to check if tables exist
     try:
-        info.append("Attempting to connect to database...")
-
-        if USE_POSTGRES:
-            # Direct connection without wrapper for diagnostic
-            import psycopg
-            from psycopg.rows import dict_row
-            info.append("Creating PostgreSQL connection...")
-            conn = psycopg.connect(app.config['DATABASE_URL'], row_factory=dict_row)
-            cursor = conn.cursor()
-            info.append("Connection successful!")
-
-            # Check PostgreSQL tables
-            cursor.execute("""
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_schema = 'public'
-                ORDER BY table_name
-            """)
-            result = cursor.fetchall()
-            tables = [row['table_name'] for row in result] if result else []
-
-            if tables:
-                info.append(f"Tables found ({len(tables)}): {', '.join(tables)}")
-
-                # Try to count users
-                try:
-                    cursor.execute("SELECT COUNT(*) as count FROM users")
-                    user_count = cursor.fetchone()
-                    info.append(f"Users in database: {user_count['count'] if user_count else 0}")
-
-                    # List usernames
-                    cursor.execute("SELECT username, role FROM users")
-                    users = cursor.fetchall()
-                    if users:
-                        user_list = ', '.join([f"{u['username']} ({u['role']})" for u in users])
-                        info.append(f"User list: {user_list}")
-                except Exception as e:
-                    info.append(f"Error counting users: {str(e)}")
-            else:
-                info.append("NO TABLES FOUND - Database not initialized!")
-
-            cursor.close()
-            conn.close()
-        else:
-            # SQLite
-            db = get_db()
-            result = db.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name", ()).fetchall()
-            tables = [row['name'] for row in result] if result else []
-
-            if tables:
-                info.append(f"Tables found: {', '.join(tables)}")
-                user_count = db.execute("SELECT COUNT(*) as count FROM users", ()).fetchone()
-                info.append(f"Users in database: {user_count['count'] if user_count else 0}")
-            else:
-                info.append("NO TABLES FOUND - Database not initialized!")
-
+        db = get_db(readonly=False)
+        try:
+            stats = table_stats(db)
+        finally:
             db.close()
 
+        if stats:
+            info.append(f"Tables found ({len(stats)}): {', '.join(name for name, _ in stats)}")
+            info.append("Estimated rows (from the last ANALYZE):\n" + "\n".join(
+                f"  {name}: {'unknown' if estimate is None else f'~{estimate}'}" for name, estimate in stats))
+        else:
+            info.append("NO TABLES FOUND - Database not initialized!")
     except Exception as e:
-        info.append(f"ERROR: {str(e)}")
         import traceback
+        info.append(f"ERROR: {str(e)}")
         info.append(f"Full traceback:\n{traceback.format_exc()}")
+        logger.exception("Diagnostic check failed")
+
+    return info, datetime.now(timezone.utc)
+
+@app.route('/diagnostic')
+@db_access('write')
+def diagnostic():
+    """Diagnostic page to check database status (cached for DIAGNOSTIC_CACHE_TTL seconds)"""
+    cached = diagnostic_cache.get('info')
+    if cached is None:
+        # Only the rebuild is limited; cached views are never shed
+        rejected = admission.admit('diagnostic')
+        if rejected is not None:
+            return rejected
+        try:
+            cached = diagnostic_cache.get('info')
+            if cached is None:
+                cached = diagnostic_info()
+                diagnostic_cache.set('info', cached)
+        finally:
+            admission.classes['diagnostic'].release()
+
+    info, checked_at = cached
+    info = info + [f"Checked at {checked_at:%Y-%m-%d %H:%M:%S} UTC (cached for {DIAGNOSTIC_CACHE_TTL}s)"]
 
     return f'''
     <!DOCTYPE html>
@@ -516,45 +1132,76 @@ def dashboard():
         return redirect(url_for('client_dashboard'))
 
 @app.route('/trainer/dashboard')
+@db_access('read')
 @login_required
 @trainer_required
 def trainer_dashboard():
-    db = get_db()
-
-    # Get all clients for this trainer with extended profile info
-    clients = db.execute('''
-        SELECT u.id, u.username, u.full_name, u.email, u.phone, u.fitness_level, u.goals, u.medical_notes, c.created_at
-        FROM users u
-        JOIN clients c ON u.id = c.client_id
-        WHERE c.trainer_id = ?
-        ORDER BY u.full_name
-    ''', (session['user_id'],)).fetchall()
-
-    # Get upcoming sessions
-    sessions_list = db.execute('''
-        SELECT ts.id, ts.session_date, ts.duration, ts.status, u.full_name as client_name
-        FROM training_sessions ts
-        JOIN users u ON ts.client_id = u.id
-        WHERE ts.trainer_id = ? AND ts.session_date >= date('now')
-        ORDER BY ts.session_date
-        LIMIT 10
-    ''', (session['user_id'],)).fetchall()
-
-    # Get total programs count
-    total_programs = db.execute('''
-        SELECT COUNT(*) as count
-        FROM programs p
-        WHERE p.created_by = ?
-    ''', (session['user_id'],)).fetchone()['count']
-
-    db.close()
-
-    return render_template('trainer_dashboard.html',
-                         clients=clients,
-                         sessions=sessions_list,
-                         total_programs=total_programs)
+    trainer_id = session['user_id']
+    target = read_target()
+
+    stamps = async_db.run(fetch_versions([f'{kind}:{trainer_id}' for kind in ('clients', 'sessions', 'programs')],
+                                         target))
+    clients_version, sessions_version, programs_version = stamps.values()
+    # Upcoming sessions also move with the date
+    today = date.today().isoformat()
+    fragments = render_fragments({
+        'stats': ('trainer_dashboard_stats.html', fragment_key(
+            'trainer_stats', trainer_id, clients_version, sessions_version, programs_version, today)),
+        'clients': ('trainer_dashboard_clients.html', fragment_key('trainer_clients', trainer_id, clients_version)),
+        # Sessions show client names, so renaming a client (a clients stamp bump) re-renders them
+        'sessions': ('trainer_dashboard_sessions.html',
+                     fragment_key('trainer_sessions', trainer_id, sessions_version, clients_version, today)),
+    }, lambda missing: async_db.run(trainer_dashboard_data(trainer_id, set(missing), target)))
+
+    return render_template('trainer_dashboard.html', fragments=fragments)
+
+async def trainer_dashboard_data(trainer_id, parts, target=None):
+    """Run the queries behind the dashboard fragments in parts ('stats', 'clients', 'sessions') concurrently"""
+    start, end = upcoming_window()
+    queries = {}
+    if parts & {'stats', 'clients'}:
+        # Get all clients for this trainer with extended profile info
+        queries['clients'] = async_db.fetchall('''
+            SELECT u.id, u.username, u.full_name, u.email, u.phone, u.fitness_level, u.goals, u.medical_notes, c.created_at
+            FROM users u
+            JOIN clients c ON u.id = c.client_id
+            WHERE c.trainer_id = ?
+            ORDER BY u.full_name
+        ''', (trainer_id,), target)
+    if parts & {'stats', 'sessions'}:
+        # Get upcoming sessions
+        queries['one_offs'] = async_db.fetchall('''
+            SELECT ts.id, ts.session_date, ts.duration, ts.status, u.full_name as client_name
+            FROM training_sessions ts
+            JOIN users u ON ts.client_id = u.id
+            WHERE ts.trainer_id = ? AND ts.session_date >= date('now')
+            ORDER BY ts.session_date
+            LIMIT 10
+        ''', (trainer_id,), target)
+        queries['rules'] = async_db.fetchall(RECURRENCE_RULES_SQL.format(owner_column='trainer_id'),
+                                             (trainer_id, end.isoformat(), start.isoformat()), target)
+        queries['exceptions'] = async_db.fetchall(RECURRENCE_EXCEPTIONS_SQL.format(owner_column='trainer_id'),
+                                                  (trainer_id, start.isoformat()), target)
+    if 'stats' in parts:
+        # Get total programs count (templates are not assigned to anyone)
+        queries['total_programs'] = async_db.fetchone('''
+            SELECT COUNT(*) as count
+            FROM programs p
+            WHERE p.created_by = ? AND NOT COALESCE(p.is_template, FALSE)
+        ''', (trainer_id,), target)
+    results = dict(zip(queries, await asyncio.gather(*queries.values())))
+
+    context = {}
+    if 'clients' in results:
+        context['clients'] = results['clients']
+    if 'one_offs' in results:
+        context['sessions'] = merge_upcoming(results['one_offs'], results['rules'], results['exceptions'], start, end)
+    if 'total_programs' in results:
+        context['total_programs'] = results['total_programs']['count']
+    return context
 
 @app.route('/client/dashboard')
+@db_access('read')
 @login_required
 def client_dashboard():
     db = get_db()
@@ -570,7 +1217,7 @@ def client_dashboard():
     ''', (session['user_id'],)).fetchall()
 
     # Get upcoming sessions
-    sessions_list = db.execute('''
+    one_offs = db.execute('''
         SELECT ts.id, ts.session_date, ts.duration, ts.status, ts.notes, u.full_name as trainer_name
         FROM training_sessions ts
         JOIN users u ON ts.trainer_id = u.id
@@ -578,10 +1225,13 @@ def client_dashboard():
         ORDER BY ts.session_date
         LIMIT 10
     ''', (session['user_id'],)).fetchall()
+    sessions_list = upcoming_sessions(db, 'client_id', session['user_id'], one_offs)
 
     return render_template('client_dashboard.html', programs=programs, sessions=sessions_list)
 
 @app.route('/trainer/clients/add', methods=['GET', 'POST'])
+@admission_class('auth', methods=('POST',))
+@db_access('write')
 @login_required
 @trainer_required
 def add_client():
@@ -592,9 +1242,11 @@ def add_client():
         email = request.form['email']
 
         db = get_db()
+        # Accounts are created on shard 0 (global usernames and IDs), then mirrored to the trainer's shard
+        directory = directory_db(db)
 
         # Check if username exists
-        existing = db.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+        existing = directory.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
         if existing:
             flash('Username already exists.', 'error')
             return render_template('add_client.html')
@@ -602,32 +1254,37 @@ def add_client():
         # Create client user
         password_hash = generate_password_hash(password)
         if USE_POSTGRES:
-            cursor = db.execute('''
-                INSERT INTO users (username, password_hash, role, full_name, email)
-                VALUES (?, ?, 'client', ?, ?)
+            cursor = directory.execute('''
+                INSERT INTO users (username, password_hash, role, full_name, email, owner_trainer_id)
+                VALUES (?, ?, 'client', ?, ?, ?)
                 RETURNING id
-            ''', (username, password_hash, full_name, email))
+            ''', (username, password_hash, full_name, email, session['user_id']))
             client_id = cursor.fetchone()['id']
         else:
-            cursor = db.execute('''
-                INSERT INTO users (username, password_hash, role, full_name, email)
-                VALUES (?, ?, 'client', ?, ?)
-            ''', (username, password_hash, full_name, email))
+            cursor = directory.execute('''
+                INSERT INTO users (username, password_hash, role, full_name, email, owner_trainer_id)
+                VALUES (?, ?, 'client', ?, ?, ?)
+            ''', (username, password_hash, full_name, email, session['user_id']))
             client_id = cursor.lastrowid
 
         # Link client to trainer
-        db.execute('''
+        directory.execute('''
             INSERT INTO clients (trainer_id, client_id)
             VALUES (?, ?)
         ''', (session['user_id'], client_id))
+        broadcast_invalidation(directory, 'owned_clients', session['user_id'])
+        # On this trainer's shard: sync_accounts commits it, or it is the directory itself
+        bump_versions(db, 'clients', [session['user_id']])
 
-        db.commit()
+        directory.commit()
+        sync_accounts(db, directory, [client_id])
         flash(f'Client {full_name} added successfully!', 'success')
         return redirect(url_for('trainer_dashboard'))
 
     return render_template('add_client.html')
 
 @app.route('/trainer/client/<int:client_id>/edit', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def edit_client(client_id):
@@ -635,12 +1292,9 @@ def edit_client(client_id):
     db = get_db()
 
     # Verify client belongs to this trainer
-    client = db.execute('''
-        SELECT u.*
-        FROM users u
-        JOIN clients c ON u.id = c.client_id
-        WHERE c.trainer_id = ? AND u.id = ?
-    ''', (session['user_id'], client_id)).fetchone()
+    client = None
+    if trainer_owns_client(db, client_id):
+        client = db.execute('SELECT * FROM users WHERE id = ?', (client_id,)).fetchone()
 
     if not client:
         flash('Client not found.', 'error')
@@ -654,12 +1308,15 @@ def edit_client(client_id):
         fitness_level = request.form.get('fitness_level', '')
         medical_notes = request.form.get('medical_notes', '')
 
-        db.execute('''
+        directory = directory_db(db)
+        directory.execute('''
             UPDATE users
             SET full_name = ?, email = ?, phone = ?, goals = ?, fitness_level = ?, medical_notes = ?
             WHERE id = ?
         ''', (full_name, email, phone, goals, fitness_level, medical_notes, client_id))
-        db.commit()
+        bump_versions(db, 'clients', [session['user_id']])
+        directory.commit()
+        sync_accounts(db, directory, [client_id])
         db.close()
 
         flash(f'Profile updated successfully for {full_name}!', 'success')
@@ -668,12 +1325,25 @@ def edit_client(client_id):
     return render_template('edit_client.html', client=client)
 
 @app.route('/trainer/exercises', methods=['GET'])
+@admission_class('heavy', conditional=True)
+@db_access('read')
 @login_required
 @trainer_required
 def exercise_library():
     """View and manage exercise library"""
     db = get_db()
 
+    version, updated_at = get_version(db, 'exercise_library')
+    etag = make_etag('exercise_library', version)
+    cached = not_modified(etag, updated_at)
+    if cached:
+        db.close()
+        return cached
+    rejected = admission.admit_view()
+    if rejected:
+        db.close()
+        return rejected
+
     # Get all exercises
     exercises = db.execute('''
         SELECT e.*, u.full_name as created_by_name
@@ -682,19 +1352,16 @@ def exercise_library():
         ORDER BY e.category, e.name
     ''').fetchall()
 
-    # Get unique categories
-    categories = db.execute('''
-        SELECT DISTINCT category
-        FROM exercise_library
-        WHERE category IS NOT NULL
-        ORDER BY category
-    ''').fetchall()
+    # Filter options with their counts
+    facets = library_facet_index(db, version).counts({})
 
     db.close()
 
-    return render_template('exercise_library.html', exercises=exercises, categories=categories)
+    return add_validators(render_template('exercise_library.html', exercises=exercises, facets=facets),
+                          etag, updated_at)
 
 @app.route('/trainer/exercises/add', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def add_exercise():
@@ -709,20 +1376,28 @@ def add_exercise():
         muscle_groups = request.form.get('muscle_groups', '')
 
         db = get_db()
+        # The library lives on shard 0 (global names and IDs) and is mirrored to every shard
+        library = directory_db(db)
 
         # Check if exercise name already exists
-        existing = db.execute('SELECT id FROM exercise_library WHERE name = ?', (name,)).fetchone()
+        existing = library.execute('SELECT id FROM exercise_library WHERE name = ?', (name,)).fetchone()
         if existing:
+            if library is not db:
+                library.close()
             flash('An exercise with this name already exists.', 'error')
             return render_template('add_exercise.html')
 
-        db.execute('''
+        library.execute('''
             INSERT INTO exercise_library
             (name, category, equipment, description, instructions, demo_url, muscle_groups, is_custom, created_by)
             VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
         ''', (name, category, equipment, description, instructions, demo_url, muscle_groups, session['user_id']))
+        bump_version(library, 'exercise_library')
+        exercise_id = record_library_change(library, name)
+        broadcast_invalidation(library, 'exercise_library', exercise_id)
 
-        db.commit()
+        library.commit()
+        sync_library(db, library, exercise_id)
         db.close()
 
         flash(f'Exercise "{name}" added successfully!', 'success')
@@ -731,6 +1406,7 @@ def add_exercise():
     return render_template('add_exercise.html')
 
 @app.route('/trainer/exercises/<int:exercise_id>/edit', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def edit_exercise(exercise_id):
@@ -757,14 +1433,18 @@ def edit_exercise(exercise_id):
         demo_url = request.form.get('demo_url', '')
         muscle_groups = request.form.get('muscle_groups', '')
 
-        db.execute('''
+        library = directory_db(db)
+        library.execute('''
             UPDATE exercise_library
             SET name = ?, category = ?, equipment = ?, description = ?,
                 instructions = ?, demo_url = ?, muscle_groups = ?
             WHERE id = ?
         ''', (name, category, equipment, description, instructions, demo_url, muscle_groups, exercise_id))
+        bump_version(library, 'exercise_library')
+        broadcast_invalidation(library, 'exercise_library', record_library_change(library, name))
 
-        db.commit()
+        library.commit()
+        sync_library(db, library, exercise_id)
         db.close()
 
         flash(f'Exercise "{name}" updated successfully!', 'success')
@@ -773,20 +1453,14 @@ def edit_exercise(exercise_id):
     return render_template('edit_exercise.html', exercise=exercise)
 
 @app.route('/trainer/programs/create/<int:client_id>', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def create_program(client_id):
     db = get_db()
 
     # Verify client belongs to this trainer
-    client = db.execute('''
-        SELECT u.id, u.full_name
-        FROM users u
-        JOIN clients c ON u.id = c.client_id
-        WHERE c.trainer_id = ? AND u.id = ?
-    ''', (session['user_id'], client_id)).fetchone()
-
-    if not client:
+    if not trainer_owns_client(db, client_id):
         flash('Client not found.', 'error')
         return redirect(url_for('trainer_dashboard'))
 
@@ -796,16 +1470,16 @@ def create_program(client_id):
 
         if USE_POSTGRES:
             cursor = db.execute('''
-                INSERT INTO programs (client_id, created_by, name, description)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO programs (client_id, created_by, name, description, updated_at)
+                VALUES (?, ?, ?, ?, ?)
                 RETURNING id
-            ''', (client_id, session['user_id'], name, description))
+            ''', (client_id, session['user_id'], name, description, utc_now()))
             program_id = cursor.fetchone()['id']
         else:
             cursor = db.execute('''
-                INSERT INTO programs (client_id, created_by, name, description)
-                VALUES (?, ?, ?, ?)
-            ''', (client_id, session['user_id'], name, description))
+                INSERT INTO programs (client_id, created_by, name, description, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (client_id, session['user_id'], name, description, utc_now()))
             program_id = cursor.lastrowid
 
         # Add exercises with all new fields
@@ -832,10 +1506,18 @@ def create_program(client_id):
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (program_id, library_id, name, exercise_sets[i], exercise_reps[i], weight, exercise_notes[i], i + 1, tempo, rest_period))
 
+        record_program(db, program_id, {client_id, session['user_id']}, utc_now())
+        bump_versions(db, 'programs', [client_id, session['user_id']])
+        publish_event(db, [client_id], 'program', {'program_id': program_id, 'name': request.form['name'], 'action': 'created'})
         db.commit()
         flash('Program created successfully!', 'success')
         return redirect(url_for('view_client', client_id=client_id))
 
+    client = db.execute('SELECT id, full_name FROM users WHERE id = ?', (client_id,)).fetchone()
+    if not client:
+        flash('Client not found.', 'error')
+        return redirect(url_for('trainer_dashboard'))
+
     # Get all exercises from library for dropdown
     exercises_library = db.execute('''
         SELECT id, name, category, equipment, description
@@ -846,6 +1528,7 @@ def create_program(client_id):
     return render_template('create_program.html', client=client, exercises_library=exercises_library)
 
 @app.route('/client/programs/create', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 def create_own_program():
     """Allow clients to create their own workout programs"""
@@ -861,16 +1544,16 @@ def create_own_program():
 
         if USE_POSTGRES:
             cursor = db.execute('''
-                INSERT INTO programs (client_id, created_by, name, description)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO programs (client_id, created_by, name, description, updated_at)
+                VALUES (?, ?, ?, ?, ?)
                 RETURNING id
-            ''', (session['user_id'], session['user_id'], name, description))
+            ''', (session['user_id'], session['user_id'], name, description, utc_now()))
             program_id = cursor.fetchone()['id']
         else:
             cursor = db.execute('''
-                INSERT INTO programs (client_id, created_by, name, description)
-                VALUES (?, ?, ?, ?)
-            ''', (session['user_id'], session['user_id'], name, description))
+                INSERT INTO programs (client_id, created_by, name, description, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (session['user_id'], session['user_id'], name, description, utc_now()))
             program_id = cursor.lastrowid
 
         # Add exercises with all new fields
@@ -897,6 +1580,9 @@ def create_own_program():
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (program_id, library_id, name, exercise_sets[i], exercise_reps[i], weight, exercise_notes[i], i + 1, tempo, rest_period))
 
+        audiences = program_audiences(db, session['user_id'])
+        record_program(db, program_id, audiences, utc_now())
+        bump_versions(db, 'programs', audiences)
         db.commit()
         db.close()
         flash('Program created successfully!', 'success')
@@ -915,6 +1601,8 @@ def create_own_program():
 
 
 @app.route('/client/exercises', methods=['GET'])
+@admission_class('heavy', conditional=True)
+@db_access('read')
 @login_required
 def client_exercise_library():
     """View exercise library (client version)"""
@@ -924,6 +1612,17 @@ def client_exercise_library():
 
     db = get_db()
 
+    version, updated_at = get_version(db, 'exercise_library')
+    etag = make_etag('client_exercise_library', version)
+    cached = not_modified(etag, updated_at)
+    if cached:
+        db.close()
+        return cached
+    rejected = admission.admit_view()
+    if rejected:
+        db.close()
+        return rejected
+
     # Get all exercises
     exercises = db.execute('''
         SELECT e.*, u.full_name as created_by_name
@@ -932,20 +1631,17 @@ def client_exercise_library():
         ORDER BY e.category, e.name
     ''').fetchall()
 
-    # Get unique categories
-    categories = db.execute('''
-        SELECT DISTINCT category
-        FROM exercise_library
-        WHERE category IS NOT NULL
-        ORDER BY category
-    ''').fetchall()
+    # Filter options with their counts
+    facets = library_facet_index(db, version).counts({})
 
     db.close()
 
-    return render_template('client_exercise_library.html', exercises=exercises, categories=categories)
+    return add_validators(render_template('client_exercise_library.html', exercises=exercises, facets=facets),
+                          etag, updated_at)
 
 
 @app.route('/client/exercises/add', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 def client_add_exercise():
     """Add custom exercise to library (client version)"""
@@ -963,20 +1659,28 @@ def client_add_exercise():
         muscle_groups = request.form.get('muscle_groups', '')
 
         db = get_db()
+        # The library lives on shard 0 (global names and IDs) and is mirrored to every shard
+        library = directory_db(db)
 
         # Check if exercise name already exists
-        existing = db.execute('SELECT id FROM exercise_library WHERE name = ?', (name,)).fetchone()
+        existing = library.execute('SELECT id FROM exercise_library WHERE name = ?', (name,)).fetchone()
         if existing:
+            if library is not db:
+                library.close()
             flash('An exercise with this name already exists.', 'error')
             return render_template('client_add_exercise.html')
 
-        db.execute('''
+        library.execute('''
             INSERT INTO exercise_library
             (name, category, equipment, description, instructions, demo_url, muscle_groups, is_custom, created_by)
             VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
         ''', (name, category, equipment, description, instructions, demo_url, muscle_groups, session['user_id']))
+        bump_version(library, 'exercise_library')
+        exercise_id = record_library_change(library, name)
+        broadcast_invalidation(library, 'exercise_library', exercise_id)
 
-        db.commit()
+        library.commit()
+        sync_library(db, library, exercise_id)
         db.close()
 
         flash(f'Exercise "{name}" added successfully!', 'success')
@@ -986,6 +1690,7 @@ def client_add_exercise():
 
 
 @app.route('/client/exercises/<int:exercise_id>/edit', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 def client_edit_exercise(exercise_id):
     """Edit exercise in library (client version)"""
@@ -1015,14 +1720,18 @@ def client_edit_exercise(exercise_id):
         demo_url = request.form.get('demo_url', '')
         muscle_groups = request.form.get('muscle_groups', '')
 
-        db.execute('''
+        library = directory_db(db)
+        library.execute('''
             UPDATE exercise_library
             SET name = ?, category = ?, equipment = ?, description = ?,
                 instructions = ?, demo_url = ?, muscle_groups = ?
             WHERE id = ?
         ''', (name, category, equipment, description, instructions, demo_url, muscle_groups, exercise_id))
+        bump_version(library, 'exercise_library')
+        broadcast_invalidation(library, 'exercise_library', record_library_change(library, name))
 
-        db.commit()
+        library.commit()
+        sync_library(db, library, exercise_id)
         db.close()
 
         flash(f'Exercise "{name}" updated successfully!', 'success')
@@ -1033,11 +1742,16 @@ def client_edit_exercise(exercise_id):
 
 
 @app.route('/trainer/client/<int:client_id>')
+@db_access('read')
 @login_required
 @trainer_required
 def view_client(client_id):
     db = get_db()
 
+    if not trainer_owns_client(db, client_id):
+        flash('Client not found.', 'error')
+        return redirect(url_for('trainer_dashboard'))
+
     # Get client info
     client = db.execute('''
         SELECT u.id, u.username, u.full_name, u.email, c.created_at
@@ -1050,29 +1764,97 @@ def view_client(client_id):
         flash('Client not found.', 'error')
         return redirect(url_for('trainer_dashboard'))
 
-    # Get programs
-    programs = db.execute('''
-        SELECT * FROM programs
-        WHERE client_id = ?
-        ORDER BY created_at DESC
-    ''', (client_id,)).fetchall()
+    def load(missing):
+        # First page of each history list; the rest loads from client_history
+        context = {'client': client,
+                   'history': {kind: client_history_page(db, kind, client_id) for kind in missing if kind != 'recurrences'}}
+        if 'recurrences' in missing:
+            context['recurrences'] = client_recurrences(db, client_id)
+        return context
+
+    stamps = get_versions(db, [f'{kind}:{client_id}' for kind in ('programs', 'sessions', 'logs')])
+    programs_version, sessions_version, logs_version = stamps.values()
+    today = date.today().isoformat()
+    fragments = render_fragments({
+        'programs': ('view_client_history.html', fragment_key('client_programs', client_id, programs_version)),
+        'sessions': ('view_client_history.html', fragment_key('client_sessions', client_id, sessions_version)),
+        # Logs show exercise names, which change with program edits
+        'logs': ('view_client_history.html', fragment_key('client_logs', client_id, logs_version, programs_version)),
+        'recurrences': ('view_client_recurrences.html',
+                        fragment_key('client_recurrences', client_id, sessions_version, today)),
+    }, load)
+    db.close()
+
+    return render_template('view_client.html', client=client, fragments=fragments)
+
+def client_recurrences(db, client_id):
+    """Active recurring schedules of a client with their next few occurrences"""
+    recurrences = []
+    rules = db.execute('''
+        SELECT * FROM session_recurrences
+        WHERE client_id = ? AND trainer_id = ?
+          AND (end_date IS NULL OR end_date >= ?)
+        ORDER BY start_date
+    ''', (client_id, session['user_id'], date.today().isoformat())).fetchall()
+    if rules:
+        start = date.today()
+        end = start + timedelta(days=28)
+        exceptions = db.execute('''
+            SELECT se.recurrence_id, se.occurrence_date, se.status
+            FROM session_exceptions se
+            JOIN session_recurrences sr ON se.recurrence_id = sr.id
+            WHERE sr.client_id = ? AND se.occurrence_date >= ?
+        ''', (client_id, start.isoformat())).fetchall()
+        for rule in rules:
+            upcoming = list(islice(expand_sessions([], [rule], exceptions, start, end), 6))
+            recurrences.append({'rule': rule, 'summary': describe_rule(rule), 'upcoming': upcoming})
+    return recurrences
+
+@app.route('/trainer/client/<int:client_id>/history/<kind>')
+@db_access('read')
+@login_required
+@trainer_required
+def client_history(client_id, kind):
+    """Next page of a client's programs, sessions or workout logs"""
+    if kind not in CLIENT_HISTORY_QUERIES:
+        return jsonify({'success': False, 'message': 'Unknown history type'}), 404
+
+    db = get_db()
+
+    # Verify client belongs to this trainer
+    if not trainer_owns_client(db, client_id):
+        db.close()
+        return jsonify({'success': False, 'message': 'Client not found'}), 404
 
-    # Get sessions
-    sessions_list = db.execute('''
-        SELECT * FROM training_sessions
-        WHERE client_id = ?
-        ORDER BY session_date DESC
-    ''', (client_id,)).fetchall()
+    try:
+        rows, next_cursor = client_history_page(db, kind, client_id, request.args.get('cursor'))
+    except ValueError:
+        db.close()
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    db.close()
 
-    return render_template('view_client.html', client=client, programs=programs, sessions=sessions_list)
+    return jsonify({
+        'success': True,
+        'items': [dict(row) for row in rows],
+        'html': render_template(f'client_history_{kind}.html', items=rows),
+        'next_cursor': next_cursor
+    })
 
 @app.route('/program/<int:program_id>')
+@db_access('read')
 @login_required
 def view_program(program_id):
     db = get_db()
 
-    # Get program
-    program = db.execute('SELECT * FROM programs WHERE id = ?', (program_id,)).fetchone()
+    # Get program, plus the version stamps of its owner's programs and workout logs
+    program = db.execute('''
+        SELECT p.*, dv.version as logs_version, dv.updated_at as logs_updated_at,
+               pv.version as programs_version
+        FROM programs p
+        LEFT JOIN data_versions dv ON dv.name = 'logs:' || p.client_id
+        LEFT JOIN data_versions pv ON pv.name = 'programs:' || p.client_id
+        WHERE p.id = ?
+    ''', (program_id,)).fetchone()
 
     if not program:
         flash('Program not found.', 'error')
@@ -1083,16 +1865,80 @@ def view_program(program_id):
         flash('Access denied.', 'error')
         return redirect(url_for('dashboard'))
 
-    # Get exercises
-    exercises = db.execute('''
-        SELECT * FROM exercises
-        WHERE program_id = ?
-        ORDER BY exercise_order
-    ''', (program_id,)).fetchall()
+    # Every program or exercise write bumps the row version and the owner's programs stamp, and logging
+    # a workout bumps the logs stamp. Last-Modified is only whole seconds, so it never keys the ETag.
+    updated_at = max(filter(None, (_http_datetime(program['updated_at'] or program['created_at']),
+                                   _http_datetime(program['logs_updated_at']))), default=None)
+    etag = make_etag('program', program_id, program['version'], program['programs_version'], program['logs_version'])
+    cached = not_modified(etag, updated_at)
+    if cached:
+        db.close()
+        return cached
+
+    # Get exercises with the client's most recent performance and PRs for each
+    def load_exercises(missing):
+        return {'exercises': db.execute('''
+            SELECT e.*, ll.log_date as last_log_date, ll.sets_completed as last_sets,
+                   ll.reps_completed as last_reps, ll.weight_used as last_weight,
+                   pr.max_weight as pr_weight, pr.best_e1rm as pr_e1rm, rr.best_reps as pr_reps_at_max
+            FROM exercises e
+            LEFT JOIN latest_logs ll ON ll.exercise_id = e.id AND ll.client_id = ?
+            LEFT JOIN personal_records pr ON pr.exercise_id = e.id AND pr.client_id = ?
+            LEFT JOIN rep_records rr ON rr.exercise_id = e.id AND rr.client_id = ? AND rr.weight = pr.max_weight
+            WHERE e.program_id = ?
+            ORDER BY e.exercise_order
+        ''', (program['client_id'], program['client_id'], program['client_id'], program_id)).fetchall()}
+
+    # Clients get a log button on each exercise, so the role is part of the key
+    fragments = render_fragments({'exercises': ('view_program_exercises.html', fragment_key(
+        'program_exercises', program_id, program['version'], updated_at, program['logs_version'], session['role']))},
+        load_exercises)
+    db.close()
+
+    return add_validators(render_template('view_program.html', program=program, fragments=fragments),
+                          etag, updated_at)
+
+@app.route('/api/program/<int:program_id>/recent_logs', methods=['GET'])
+@db_access('read')
+@login_required
+def program_recent_logs(program_id):
+    """Last N logged performances of every exercise in a program, in one windowed query"""
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 20)
 
-    return render_template('view_program.html', program=program, exercises=exercises)
+    db = get_db()
+    program = db.execute('SELECT id, client_id FROM programs WHERE id = ?', (program_id,)).fetchone()
+
+    # Same access rules as view_program
+    if not program or (session['role'] == 'client' and program['client_id'] != session['user_id']):
+        db.close()
+        return jsonify({'success': False, 'message': 'Program not found'}), 404
+
+    rows = db.execute('''
+        SELECT exercise_id, log_date, sets_completed, reps_completed, weight_used
+        FROM (
+            SELECT wl.exercise_id, wl.log_date, wl.sets_completed, wl.reps_completed, wl.weight_used,
+                   ROW_NUMBER() OVER (PARTITION BY wl.exercise_id ORDER BY wl.log_date DESC, wl.id DESC) as rn
+            FROM workout_logs wl
+            WHERE wl.client_id = ?
+              AND wl.exercise_id IN (SELECT id FROM exercises WHERE program_id = ?)
+        ) ranked
+        WHERE rn <= ?
+        ORDER BY exercise_id, rn
+    ''', (program['client_id'], program_id, limit)).fetchall()
+    db.close()
+
+    recent = {}
+    for row in rows:
+        recent.setdefault(str(row['exercise_id']), []).append({
+            'log_date': str(row['log_date'])[:10],
+            'sets_completed': row['sets_completed'],
+            'reps_completed': row['reps_completed'],
+            'weight_used': row['weight_used']
+        })
+    return jsonify({'success': True, 'recent': recent})
 
 @app.route('/trainer/program/edit/<int:program_id>', methods=['GET', 'POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def edit_program(program_id):
@@ -1110,13 +1956,8 @@ def edit_program(program_id):
         flash('Program not found.', 'error')
         return redirect(url_for('trainer_dashboard'))
 
-    # Verify the client belongs to this trainer
-    client_check = db.execute('''
-        SELECT 1 FROM clients
-        WHERE trainer_id = ? AND client_id = ?
-    ''', (session['user_id'], program['client_id'])).fetchone()
-
-    if not client_check:
+    # Verify the client belongs to this trainer (templates are owned by the trainer directly)
+    if program['client_id'] != session['user_id'] and not trainer_owns_client(db, program['client_id']):
         flash('Access denied.', 'error')
         return redirect(url_for('trainer_dashboard'))
 
@@ -1127,11 +1968,12 @@ def edit_program(program_id):
         # Update program
         db.execute('''
             UPDATE programs
-            SET name = ?, description = ?
+            SET name = ?, description = ?, updated_at = ?
             WHERE id = ?
-        ''', (name, description, program_id))
+        ''', (name, description, utc_now(), program_id))
 
         # Delete existing exercises
+        removed = [row['id'] for row in db.execute('SELECT id FROM exercises WHERE program_id = ?', (program_id,)).fetchall()]
         db.execute('DELETE FROM exercises WHERE program_id = ?', (program_id,))
 
         # Add updated exercises
@@ -1149,6 +1991,12 @@ def edit_program(program_id):
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''', (program_id, library_id, name, exercise_sets[i], exercise_reps[i], exercise_notes[i], i + 1))
 
+        audiences = program_audiences(db, program['client_id'])
+        record_program(db, program_id, audiences, utc_now(), removed)
+        bump_versions(db, 'programs', audiences)
+        publish_event(db, audiences - {session['user_id']}, 'program',
+                      {'program_id': program_id, 'name': request.form['name'], 'action': 'updated'})
+        broadcast_invalidation(db, 'adherence', session['user_id'])
         db.commit()
         flash('Program updated successfully!', 'success')
         return redirect(url_for('view_program', program_id=program_id))
@@ -1169,20 +2017,183 @@ def edit_program(program_id):
 
     return render_template('edit_program.html', program=program, exercises=exercises, exercises_library=exercises_library)
 
-@app.route('/trainer/session/schedule/<int:client_id>', methods=['GET', 'POST'])
+def clone_program(db, program_id, target_ids, as_template=False, template_name=None):
+    """Copy a program and its exercises to every target user in two set-based statements.
+
+    The caller is responsible for authorization and for committing. Returns the batch token
+    that tags the new program rows.
+    """
+    batch = uuid.uuid4().hex
+    placeholders = ','.join('?' for _ in target_ids)
+
+    # One new program per target, tagged with the batch so exercises can follow in one go
+    db.execute(f'''
+        INSERT INTO programs
+        (client_id, created_by, name, description, is_template, template_name,
+         source_program_id, assignment_batch, updated_at)
+        SELECT u.id, ?, p.name, p.description, ?, ?, p.id, ?, ?
+        FROM programs p
+        CROSS JOIN users u
+        WHERE p.id = ? AND u.id IN ({placeholders})
+    ''', [session['user_id'], as_template, template_name, batch, utc_now(), program_id] + list(target_ids))
+
+    db.execute('''
+        INSERT INTO exercises
+        (program_id, exercise_library_id, name, sets, reps, weight, notes, exercise_order, tempo, rest_period)
+        SELECT np.id, e.exercise_library_id, e.name, e.sets, e.reps, e.weight, e.notes,
+               e.exercise_order, e.tempo, e.rest_period
+        FROM programs np
+        JOIN exercises e ON e.program_id = np.source_program_id
+        WHERE np.assignment_batch = ?
+    ''', (batch,))
+
+    now = utc_now()
+    for row in db.execute('SELECT id, client_id FROM programs WHERE assignment_batch = ?', (batch,)).fetchall():
+        record_program(db, row['id'], {row['client_id'], session['user_id']}, now)
+    bump_versions(db, 'programs', list(target_ids) + [session['user_id']])
+
+    return batch
+
+@app.route('/trainer/templates')
+@db_access('read')
 @login_required
 @trainer_required
-def schedule_session(client_id):
+def program_templates():
+    """List program templates and assign them to clients"""
     db = get_db()
 
-    client = db.execute('''
+    templates = db.execute('''
+        SELECT p.id, p.name, p.description, p.template_name, p.created_at, COUNT(e.id) as exercise_count
+        FROM programs p
+        LEFT JOIN exercises e ON e.program_id = p.id
+        WHERE p.created_by = ? AND p.is_template
+        GROUP BY p.id, p.name, p.description, p.template_name, p.created_at
+        ORDER BY p.template_name
+    ''', (session['user_id'],)).fetchall()
+
+    clients = db.execute('''
         SELECT u.id, u.full_name
         FROM users u
         JOIN clients c ON u.id = c.client_id
-        WHERE c.trainer_id = ? AND u.id = ?
-    ''', (session['user_id'], client_id)).fetchone()
+        WHERE c.trainer_id = ?
+        ORDER BY u.full_name
+    ''', (session['user_id'],)).fetchall()
 
-    if not client:
+    db.close()
+
+    return render_template('program_templates.html', templates=templates, clients=clients)
+
+@app.route('/trainer/adherence')
+@admission_class('heavy')
+@db_access('read')
+@login_required
+@trainer_required
+def adherence():
+    """Planned vs. completed sets for every client over recent weeks"""
+    db = get_db()
+    matrix = adherence_engine().matrix(db, session['user_id'])
+    db.close()
+
+    return render_template('adherence.html', matrix=matrix)
+
+@app.route('/trainer/program/<int:program_id>/save-template', methods=['POST'])
+@db_access('write')
+@login_required
+@trainer_required
+def save_program_template(program_id):
+    """Copy an existing program into a reusable template"""
+    db = get_db()
+
+    program = db.execute('SELECT id, client_id, name FROM programs WHERE id = ?', (program_id,)).fetchone()
+    if not program or (program['client_id'] != session['user_id']
+                       and not trainer_owns_client(db, program['client_id'])):
+        flash('Program not found.', 'error')
+        return redirect(url_for('trainer_dashboard'))
+
+    template_name = request.form.get('template_name', '').strip() or program['name']
+    clone_program(db, program_id, [session['user_id']], as_template=True, template_name=template_name)
+    db.commit()
+    db.close()
+
+    flash(f'Template "{template_name}" saved.', 'success')
+    return redirect(url_for('program_templates'))
+
+@app.route('/trainer/templates/<int:template_id>/assign', methods=['POST'])
+@db_access('write')
+@login_required
+@trainer_required
+def assign_program_template(template_id):
+    """Assign a template to one or many clients in a single transaction"""
+    db = get_db()
+
+    template = db.execute('''
+        SELECT id, template_name FROM programs
+        WHERE id = ? AND created_by = ? AND is_template
+    ''', (template_id, session['user_id'])).fetchone()
+
+    if not template:
+        flash('Template not found.', 'error')
+        return redirect(url_for('program_templates'))
+
+    client_ids = {int(cid) for cid in request.form.getlist('client_ids[]') if cid.isdigit()}
+    if not client_ids:
+        flash('Select at least one client.', 'error')
+        return redirect(url_for('program_templates'))
+
+    if not all(trainer_owns_client(db, cid) for cid in client_ids):
+        flash('Access denied.', 'error')
+        return redirect(url_for('program_templates'))
+
+    try:
+        clone_program(db, template_id, sorted(client_ids))
+        db.commit()
+    except Exception as e:
+        db.close()
+        flash(f'Error assigning template: {str(e)}', 'error')
+        return redirect(url_for('program_templates'))
+
+    db.close()
+
+    flash(f'Template "{template["template_name"]}" assigned to {len(client_ids)} client(s).', 'success')
+    return redirect(url_for('program_templates'))
+
+@app.route('/trainer/templates/<int:template_id>/delete', methods=['POST'])
+@db_access('write')
+@login_required
+@trainer_required
+def delete_program_template(template_id):
+    """Delete a template; programs already assigned from it are kept"""
+    db = get_db()
+
+    template = db.execute('''
+        SELECT id, template_name FROM programs
+        WHERE id = ? AND created_by = ? AND is_template
+    ''', (template_id, session['user_id'])).fetchone()
+
+    if not template:
+        flash('Template not found.', 'error')
+        return redirect(url_for('program_templates'))
+
+    now = utc_now()
+    removed = [row['id'] for row in db.execute('SELECT id FROM exercises WHERE program_id = ?', (template_id,)).fetchall()]
+    record_changes(db, 'exercises', removed, [session['user_id']], now, deleted=True)
+    record_changes(db, 'programs', [template_id], [session['user_id']], now, deleted=True)
+    db.execute('DELETE FROM exercises WHERE program_id = ?', (template_id,))
+    db.execute('DELETE FROM programs WHERE id = ?', (template_id,))
+    db.commit()
+    db.close()
+
+    flash(f'Template "{template["template_name"]}" deleted.', 'success')
+    return redirect(url_for('program_templates'))
+
+@app.route('/trainer/session/schedule/<int:client_id>', methods=['GET', 'POST'])
+@db_access('write')
+@login_required
+@trainer_required
+def schedule_session(client_id):
+    db = get_db()
+
+    if not trainer_owns_client(db, client_id):
         flash('Client not found.', 'error')
         return redirect(url_for('trainer_dashboard'))
 
@@ -1190,31 +2201,150 @@ def schedule_session(client_id):
         session_date = request.form['session_date']
         duration = request.form['duration']
         notes = request.form['notes']
+        repeat_days = request.form.getlist('repeat_days')
 
-        db.execute('''
-            INSERT INTO training_sessions (trainer_id, client_id, session_date, duration, notes, status)
-            VALUES (?, ?, ?, ?, ?, 'scheduled')
-        ''', (session['user_id'], client_id, session_date, duration, notes))
+        if repeat_days:
+            # Store the rule once; occurrences are expanded lazily when viewed, so it must parse
+            try:
+                start = datetime.fromisoformat(session_date)
+                interval_weeks = int(request.form.get('repeat_interval') or 1)
+                repeat_until = request.form.get('repeat_until') or None
+                until = date.fromisoformat(repeat_until) if repeat_until else None
+            except ValueError:
+                start = None
+            if (start is None or interval_weeks < 1 or not parse_weekdays(','.join(repeat_days))
+                    or (until and until < start.date())):
+                db.close()
+                flash('Enter a valid start date, weekdays, interval of at least 1 week and an end date after the start.', 'error')
+                return redirect(url_for('schedule_session', client_id=client_id))
+
+            db.execute('''
+                INSERT INTO session_recurrences
+                (trainer_id, client_id, weekdays, interval_weeks, start_date, end_date, start_time, duration, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (session['user_id'], client_id, ','.join(repeat_days), interval_weeks,
+                  start.date().isoformat(), repeat_until, start.strftime('%H:%M'), duration, notes))
+            bump_versions(db, 'sessions', [client_id, session['user_id']])
+            publish_event(db, [client_id], 'session', {'session_date': session_date, 'repeat_days': repeat_days})
+            db.commit()
+            db.close()
+
+            flash('Recurring session scheduled successfully!', 'success')
+            return redirect(url_for('view_client', client_id=client_id))
+
+        params = (session['user_id'], client_id, session_date, duration, notes)
+        if USE_POSTGRES:
+            session_id = db.execute('''
+                INSERT INTO training_sessions (trainer_id, client_id, session_date, duration, notes, status)
+                VALUES (?, ?, ?, ?, ?, 'scheduled')
+                RETURNING id
+            ''', params).fetchone()['id']
+        else:
+            session_id = db.execute('''
+                INSERT INTO training_sessions (trainer_id, client_id, session_date, duration, notes, status)
+                VALUES (?, ?, ?, ?, ?, 'scheduled')
+            ''', params).lastrowid
+        record_changes(db, 'training_sessions', [session_id], {client_id, session['user_id']}, utc_now())
+        bump_versions(db, 'sessions', [client_id, session['user_id']])
+        publish_event(db, [client_id], 'session', {'session_id': session_id, 'session_date': session_date})
         db.commit()
 
         flash('Session scheduled successfully!', 'success')
         return redirect(url_for('view_client', client_id=client_id))
 
+    client = db.execute('SELECT id, full_name FROM users WHERE id = ?', (client_id,)).fetchone()
+    db.close()
+
+    if not client:
+        flash('Client not found.', 'error')
+        return redirect(url_for('trainer_dashboard'))
+
     return render_template('schedule_session.html', client=client)
 
+@app.route('/trainer/session/recurrence/<int:recurrence_id>/skip', methods=['POST'])
+@db_access('write')
+@login_required
+@trainer_required
+def skip_recurring_session(recurrence_id):
+    """Cancel a single occurrence of a recurring session"""
+    db = get_db()
+
+    rule = db.execute('''
+        SELECT * FROM session_recurrences
+        WHERE id = ? AND trainer_id = ?
+    ''', (recurrence_id, session['user_id'])).fetchone()
+
+    if not rule:
+        flash('Recurring session not found.', 'error')
+        return redirect(url_for('trainer_dashboard'))
+
+    try:
+        day = date.fromisoformat(request.form.get('occurrence_date', ''))
+    except ValueError:
+        day = None
+    if day is None or not occurs_on(rule, day):
+        db.close()
+        flash('That date is not an occurrence of this recurring session.', 'error')
+        return redirect(url_for('view_client', client_id=rule['client_id']))
+    occurrence_date = day.isoformat()
+
+    existing = db.execute('''
+        SELECT id FROM session_exceptions
+        WHERE recurrence_id = ? AND occurrence_date = ?
+    ''', (recurrence_id, occurrence_date)).fetchone()
+
+    if existing:
+        db.execute("UPDATE session_exceptions SET status = 'cancelled' WHERE id = ?", (existing['id'],))
+    else:
+        db.execute('''
+            INSERT INTO session_exceptions (recurrence_id, occurrence_date, status)
+            VALUES (?, ?, 'cancelled')
+        ''', (recurrence_id, occurrence_date))
+    bump_versions(db, 'sessions', [rule['client_id'], session['user_id']])
+    db.commit()
+    db.close()
+
+    flash(f'Session on {occurrence_date} cancelled.', 'success')
+    return redirect(url_for('view_client', client_id=rule['client_id']))
+
+@app.route('/trainer/session/recurrence/<int:recurrence_id>/end', methods=['POST'])
+@db_access('write')
+@login_required
+@trainer_required
+def end_recurring_session(recurrence_id):
+    """Stop a recurring session series from today onwards, keeping its history"""
+    db = get_db()
+
+    rule = db.execute('''
+        SELECT * FROM session_recurrences
+        WHERE id = ? AND trainer_id = ?
+    ''', (recurrence_id, session['user_id'])).fetchone()
+
+    if not rule:
+        flash('Recurring session not found.', 'error')
+        return redirect(url_for('trainer_dashboard'))
+
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    db.execute('UPDATE session_recurrences SET end_date = ? WHERE id = ?', (yesterday, recurrence_id))
+    bump_versions(db, 'sessions', [rule['client_id'], session['user_id']])
+    db.commit()
+    db.close()
+
+    flash('Recurring session ended.', 'success')
+    return redirect(url_for('view_client', client_id=rule['client_id']))
+
 @app.route('/trainer/client/<int:client_id>/reset-password', methods=['POST'])
+@admission_class('auth')
+@db_access('write')
 @login_required
 @trainer_required
 def reset_client_password(client_id):
     db = get_db()
 
     # Verify client belongs to this trainer
-    client = db.execute('''
-        SELECT u.id, u.full_name
-        FROM users u
-        JOIN clients c ON u.id = c.client_id
-        WHERE c.trainer_id = ? AND u.id = ?
-    ''', (session['user_id'], client_id)).fetchone()
+    client = None
+    if trainer_owns_client(db, client_id):
+        client = db.execute('SELECT id, full_name FROM users WHERE id = ?', (client_id,)).fetchone()
 
     if not client:
         flash('Client not found.', 'error')
@@ -1223,17 +2353,20 @@ def reset_client_password(client_id):
     new_password = request.form['new_password']
     password_hash = generate_password_hash(new_password)
 
-    db.execute('''
+    directory = directory_db(db)
+    directory.execute('''
         UPDATE users
         SET password_hash = ?
         WHERE id = ?
     ''', (password_hash, client_id))
-    db.commit()
+    directory.commit()
+    sync_accounts(db, directory, [client_id])
 
     flash(f'Password reset successfully for {client["full_name"]}. New password: {new_password}', 'success')
     return redirect(url_for('view_client', client_id=client_id))
 
 @app.route('/trainer/client/<int:client_id>/delete', methods=['POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def delete_client(client_id):
@@ -1241,12 +2374,9 @@ def delete_client(client_id):
     db = get_db()
 
     # Verify client belongs to this trainer
-    client = db.execute('''
-        SELECT u.id, u.full_name
-        FROM users u
-        JOIN clients c ON u.id = c.client_id
-        WHERE c.trainer_id = ? AND u.id = ?
-    ''', (session['user_id'], client_id)).fetchone()
+    client = None
+    if trainer_owns_client(db, client_id):
+        client = db.execute('SELECT id, full_name FROM users WHERE id = ?', (client_id,)).fetchone()
 
     if not client:
         flash('Client not found.', 'error')
@@ -1255,12 +2385,25 @@ def delete_client(client_id):
     client_name = client['full_name']
 
     try:
+        # Archived logs first: attaching the SQLite archive is not allowed mid-transaction
+        delete_archived_logs(db, USE_POSTGRES, client_id, database_path())
+
         # Delete all related data in correct order (respecting foreign key constraints)
 
         # 1. Get all program IDs for this client
         programs = db.execute('SELECT id FROM programs WHERE client_id = ?', (client_id,)).fetchall()
         program_ids = [p['id'] for p in programs]
 
+        # Tell the trainer's synced devices what is about to disappear
+        now = utc_now()
+        for table, query in (
+                ('exercises', 'SELECT e.id FROM exercises e JOIN programs p ON e.program_id = p.id WHERE p.client_id = ?'),
+                ('programs', 'SELECT id FROM programs WHERE client_id = ?'),
+                ('training_sessions', 'SELECT id FROM training_sessions WHERE client_id = ?')):
+            row_ids = [row['id'] for row in db.execute(query, (client_id,)).fetchall()]
+            record_changes(db, table, row_ids, [session['user_id']], now, deleted=True)
+        db.execute('DELETE FROM change_feed WHERE audience = ?', (client_id,))
+
         if program_ids:
             # 2. Delete workout logs (references exercises)
             placeholders = ','.join(['?' for _ in program_ids])
@@ -1274,19 +2417,41 @@ def delete_client(client_id):
             # 3. Delete exercises (references programs)
             db.execute(f'DELETE FROM exercises WHERE program_id IN ({placeholders})', program_ids)
 
+        # Workout rollups and the latest-log cache
+        db.execute('DELETE FROM workout_log_daily WHERE client_id = ?', (client_id,))
+        db.execute('DELETE FROM workout_log_weekly WHERE client_id = ?', (client_id,))
+        db.execute('DELETE FROM latest_logs WHERE client_id = ?', (client_id,))
+        db.execute('DELETE FROM personal_records WHERE client_id = ?', (client_id,))
+        db.execute('DELETE FROM rep_records WHERE client_id = ?', (client_id,))
+
         # 4. Delete programs
         db.execute('DELETE FROM programs WHERE client_id = ?', (client_id,))
 
-        # 5. Delete training sessions
+        # 5. Delete training sessions, including recurring ones and their exceptions
         db.execute('DELETE FROM training_sessions WHERE client_id = ?', (client_id,))
+        db.execute('''
+            DELETE FROM session_exceptions
+            WHERE recurrence_id IN (SELECT id FROM session_recurrences WHERE client_id = ?)
+        ''', (client_id,))
+        db.execute('DELETE FROM session_recurrences WHERE client_id = ?', (client_id,))
 
         # 6. Delete client-trainer relationship
         db.execute('DELETE FROM clients WHERE client_id = ?', (client_id,))
 
         # 7. Delete user account
         db.execute('DELETE FROM users WHERE id = ?', (client_id,))
+        broadcast_invalidation(db, 'owned_clients', session['user_id'])
+        for kind in ('clients', 'programs', 'sessions'):
+            bump_versions(db, kind, [session['user_id']])
 
         db.commit()
+        # The authoritative account rows on shard 0
+        directory = directory_db(db)
+        if directory is not db:
+            directory.execute('DELETE FROM clients WHERE client_id = ?', (client_id,))
+            directory.execute('DELETE FROM users WHERE id = ?', (client_id,))
+            directory.commit()
+            directory.close()
         db.close()
 
         flash(f'Client {client_name} and all associated data have been permanently deleted.', 'success')
@@ -1297,58 +2462,151 @@ def delete_client(client_id):
         flash(f'Error deleting client: {str(e)}', 'error')
         return redirect(url_for('view_client', client_id=client_id))
 
+# JSON API
 @app.route('/api/log_workout', methods=['POST'])
+@db_access('write')
 @login_required
 def log_workout():
     data = request.json
+    client_id = session['user_id']
     exercise_id = data.get('exercise_id')
-    sets_completed = data.get('sets_completed')
-    reps_completed = data.get('reps_completed')
-    weight_used = data.get('weight_used')
-    notes = data.get('notes', '')
+    sets, reps, weight = log_metrics(data.get('sets_completed'), data.get('reps_completed'), data.get('weight_used'))
+    log_date = datetime.now(timezone.utc).date()
+    daily, weekly = rollup_params(client_id, exercise_id, log_date, sets, reps, weight)
+    pr, reps_at_weight = record_params(client_id, exercise_id, log_date, weight, reps)
 
+    # Raw log, its rollups and the latest-log cache commit together
     db = get_db()
-    db.execute('''
-        INSERT INTO workout_logs (client_id, exercise_id, log_date, sets_completed, reps_completed, weight_used, notes)
-        VALUES (?, ?, date('now'), ?, ?, ?, ?)
-    ''', (session['user_id'], exercise_id, sets_completed, reps_completed, weight_used, notes))
-    db.commit()
+    try:
+        params = (client_id, exercise_id, log_date.isoformat(), sets, reps, weight, data.get('notes', ''))
+        if USE_POSTGRES:
+            log_id = db.execute('''
+                INSERT INTO workout_logs (client_id, exercise_id, log_date, sets_completed, reps_completed, weight_used, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            ''', params).fetchone()['id']
+        else:
+            log_id = db.execute('''
+                INSERT INTO workout_logs (client_id, exercise_id, log_date, sets_completed, reps_completed, weight_used, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', params).lastrowid
+        db.execute(DAILY_UPSERT_SQL, daily)
+        db.execute(WEEKLY_UPSERT_SQL, weekly)
+        db.execute('''
+            INSERT INTO latest_logs (client_id, exercise_id, log_id, log_date, sets_completed, reps_completed, weight_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (client_id, exercise_id) DO UPDATE SET
+                log_id = excluded.log_id, log_date = excluded.log_date, sets_completed = excluded.sets_completed,
+                reps_completed = excluded.reps_completed, weight_used = excluded.weight_used
+        ''', (client_id, exercise_id, log_id, log_date.isoformat(), sets, reps, weight))
+        # Personal records: report which ones this log beats, then fold it in
+        current = db.execute(CURRENT_RECORDS_SQL, (client_id, exercise_id, client_id, exercise_id, weight)).fetchone()
+        records = new_records(current, weight, reps)
+        if weight:
+            db.execute(PR_UPSERT_SQL, pr)
+        if reps_at_weight:
+            db.execute(REP_RECORD_UPSERT_SQL, reps_at_weight)
+        # Pages showing this client's logs (view_program) are versioned by this stamp
+        bump_version(db, f'logs:{client_id}')
+        db.commit()
+    finally:
+        db.close()
 
-    return jsonify({'success': True, 'message': 'Workout logged successfully!'})
+    message = 'Workout logged successfully!'
+    if records:
+        message += ' New personal record!'
+    return jsonify({'success': True, 'message': message, 'records': records})
 
 @app.route('/api/exercises', methods=['GET'])
+@db_access('read')
 @login_required
 @trainer_required
 def get_exercises():
-    """Get exercises from library with optional filtering"""
-    category = request.args.get('category', '')
+    """Get exercises from library, filtered by category, equipment, muscle group and name search"""
+    filters = facet_filters(request.args)
     search = request.args.get('search', '')
+    version, updated_at, index = api_facet_index()
 
-    db = get_db()
-    query = 'SELECT id, name, category, equipment, description FROM exercise_library WHERE 1=1'
-    params = []
-
-    if category:
-        query += ' AND category = ?'
-        params.append(category)
+    etag = make_etag('api_exercises', version, *filters.values(), search)
+    cached = not_modified(etag, updated_at)
+    if cached:
+        return cached
 
-    if search:
-        query += ' AND name LIKE ?'
-        params.append(f'%{search}%')
-
-    query += ' ORDER BY category, name'
-
-    exercises = db.execute(query, params).fetchall()
-
-    return jsonify([{
+    return add_validators(jsonify([{
         'id': ex['id'],
         'name': ex['name'],
         'category': ex['category'],
         'equipment': ex['equipment'],
         'description': ex['description']
-    } for ex in exercises])
+    } for ex in index.matching(filters, search)]), etag, updated_at)
+
+@app.route('/api/exercises/facets', methods=['GET'])
+@db_access('read')
+@login_required
+@trainer_required
+def get_exercise_facets():
+    """Match count for every category, equipment and muscle group value under the same filters as /api/exercises"""
+    filters = facet_filters(request.args)
+    search = request.args.get('search', '')
+    version, updated_at, index = api_facet_index()
+
+    etag = make_etag('api_exercise_facets', version, *filters.values(), search)
+    cached = not_modified(etag, updated_at)
+    if cached:
+        return cached
+
+    return add_validators(jsonify({
+        'total': index.select(filters, search).bit_count(),
+        'facets': index.counts(filters, search)
+    }), etag, updated_at)
+
+@app.route('/api/exercises/<int:exercise_id>/substitutes', methods=['GET'])
+@db_access('read')
+@login_required
+@trainer_required
+def get_exercise_substitutes(exercise_id):
+    """Most similar library exercises, optionally skipping unavailable equipment (?without=Barbell,Cable)"""
+    limit = min(max(request.args.get('limit', 5, type=int), 1), substitution_engine.k)
+    without = {value.strip() for value in request.args.get('without', '').split(',') if value.strip()}
+    _, _, index = api_facet_index()
+
+    exercise = index.rows.get(exercise_id)
+    if exercise is None:
+        return jsonify({'success': False, 'message': 'Exercise not found'}), 404
+
+    db = get_db()
+    try:
+        table = substitution_engine.table(request_shard(), index,
+                                          lambda query, params: db.execute(query, params).fetchall())
+    finally:
+        db.close()
+    # Another request may have moved the table to a newer index meanwhile, so check each ID against ours
+    substitutes = [(score, index.rows[other]) for score, other in table.lookup(exercise_id)
+                   if other in index.rows and index.rows[other]['equipment'] not in without][:limit]
+
+    return jsonify({
+        'exercise': {'id': exercise_id, 'name': exercise['name']},
+        'substitutes': [{
+            'id': sub['id'],
+            'name': sub['name'],
+            'category': sub['category'],
+            'equipment': sub['equipment'],
+            'score': round(score, 3)
+        } for score, sub in substitutes]
+    })
+
+def api_facet_index():
+    """(version, updated_at, FacetIndex) of the library this request reads; only the version is queried when current"""
+    db = get_db()
+    try:
+        version, updated_at = get_version(db, 'exercise_library')
+        index = library_facets.get(request_shard(), version, lambda query, params: db.execute(query, params).fetchall())
+    finally:
+        db.close()
+    return version, updated_at, index
 
 @app.route('/api/exercises/custom', methods=['POST'])
+@db_access('write')
 @login_required
 @trainer_required
 def add_custom_exercise():
@@ -1363,22 +2621,17 @@ def add_custom_exercise():
         return jsonify({'success': False, 'message': 'Exercise name is required'}), 400
 
     db = get_db()
+    library = directory_db(db)
     try:
-        if USE_POSTGRES:
-            cursor = db.execute('''
-                INSERT INTO exercise_library (name, category, equipment, description, is_custom, created_by)
-                VALUES (?, ?, ?, ?, 1, ?)
-                RETURNING id
-            ''', (name, category, equipment, description, session['user_id']))
-            exercise_id = cursor.fetchone()['id']
-        else:
-            cursor = db.execute('''
-                INSERT INTO exercise_library (name, category, equipment, description, is_custom, created_by)
-                VALUES (?, ?, ?, ?, 1, ?)
-            ''', (name, category, equipment, description, session['user_id']))
-            exercise_id = cursor.lastrowid
-
-        db.commit()
+        library.execute('''
+            INSERT INTO exercise_library (name, category, equipment, description, is_custom, created_by)
+            VALUES (?, ?, ?, ?, 1, ?)
+        ''', (name, category, equipment, description, session['user_id']))
+        bump_version(library, 'exercise_library')
+        exercise_id = record_library_change(library, name)
+        broadcast_invalidation(library, 'exercise_library', exercise_id)
+        library.commit()
+        sync_library(db, library, exercise_id)
 
         return jsonify({
             'success': True,
@@ -1392,11 +2645,236 @@ def add_custom_exercise():
         })
     except Exception as e:
         error_msg = str(e).lower()
+        if library is not db:
+            library.close()
         if 'unique' in error_msg or 'duplicate' in error_msg:
             return jsonify({'success': False, 'message': 'Exercise already exists'}), 400
         return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        db.close()
+
+@app.route('/events')
+@admission_class('events')
+@login_required
+def event_stream():
+    """Server-sent events for the logged-in user: new or changed programs and scheduled sessions"""
+    subscription = event_bus.subscribe(session['user_id'])
+
+    # stream_with_context keeps the request (and its admission slot) open until the stream ends
+    @stream_with_context
+    def stream():
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < deadline:
+                message = subscription.get(timeout=min(SSE_HEARTBEAT_SECONDS, max(deadline - time.monotonic(), 0)))
+                if subscription.overflowed:
+                    # Events were dropped; tell the page to reload everything
+                    yield events.format_sse('resync', {})
+                    return
+                yield events.format_sse(*message) if message else ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    # text/event-stream is not in COMPRESSIBLE_TYPES, so CompressionMiddleware passes it through unbuffered
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+# Delta sync for mobile/offline clients (see sync.py)
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+
+@app.route('/api/sync', methods=['GET'])
+@db_access('read')
+@login_required
+def sync_changes():
+    """Rows changed since the caller's cursor, or a full snapshot without one"""
+    limit = min(max(request.args.get('limit', SYNC_PAGE_SIZE, type=int), 1), SYNC_PAGE_SIZE)
+    shard = request_shard()
+    since = None
+    if request.args.get('since'):
+        try:
+            cursor_shard, since = sync.parse_cursor(request.args['since'])
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        if cursor_shard != shard:
+            # The user's data moved to another shard; its feed starts over
+            since = None
+
+    db = get_db()
+    try:
+        # Only entries of transactions that have all finished: later commits sort after this horizon
+        horizon = sync.settled_tx(db, USE_POSTGRES)
+        if since is not None and since < sync.pruned_through(db):
+            since = None
+        if since is None:
+            cursor, changes, deleted = sync.snapshot(db, session['user_id'], horizon)
+            has_more = False
+        else:
+            cursor, changes, deleted, has_more = sync.changes_since(db, session['user_id'], since, horizon, limit)
+    finally:
+        db.close()
+
+    response = jsonify({
+        'success': True,
+        'cursor': sync.format_cursor(shard, cursor),
+        'reset': since is None,
+        'has_more': has_more,
+        'changes': changes,
+        'deleted': deleted,
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Progress analytics read rollups unless raw per-log detail is asked for
+PROGRESS_ROLLUPS = {'day': ('workout_log_daily', 'log_date'), 'week': ('workout_log_weekly', 'week_start')}
+
+@app.route('/api/client/<int:client_id>/progress', methods=['GET'])
+@db_access('read')
+@login_required
+def client_progress(client_id):
+    """Workout volume and top weight per exercise by day, week or individual log"""
+    granularity = request.args.get('granularity', 'week')
+    exercise_id = request.args.get('exercise_id', type=int)
+    since = request.args.get('since', '')
+    if granularity not in PROGRESS_ROLLUPS and granularity != 'log':
+        return jsonify({'success': False, 'message': 'granularity must be day, week or log'}), 400
+
+    db = get_db()
+
+    # Clients see their own progress; trainers see their clients'
+    if session['role'] != 'trainer' and client_id != session['user_id']:
+        db.close()
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    if session['role'] == 'trainer' and not trainer_owns_client(db, client_id):
+        db.close()
+        return jsonify({'success': False, 'message': 'Client not found'}), 404
+
+    filters = ''
+    params = [client_id]
+    if granularity == 'log':
+        source = 'workout_logs'
+        if not USE_POSTGRES and os.path.exists(sqlite_archive_path(database_path())):
+            attach_sqlite_archive(db, database_path())
+        archived = archived_logs_query(db, USE_POSTGRES)
+        if archived:
+            columns = ', '.join(ARCHIVE_COLUMNS)
+            source = f'(SELECT {columns} FROM workout_logs UNION ALL SELECT {columns} FROM {archived} a)'
+        if exercise_id:
+            filters += ' AND l.exercise_id = ?'
+            params.append(exercise_id)
+        if since:
+            filters += ' AND l.log_date >= ?'
+            params.append(since)
+        rows = db.execute(f'''
+            SELECT l.id, l.exercise_id, e.name as exercise_name, l.log_date, l.sets_completed,
+                   l.reps_completed, l.weight_used, l.notes
+            FROM {source} l
+            LEFT JOIN exercises e ON l.exercise_id = e.id
+            WHERE l.client_id = ?{filters}
+            ORDER BY l.log_date, l.id
+        ''', params).fetchall()
+    else:
+        table, period = PROGRESS_ROLLUPS[granularity]
+        if exercise_id:
+            filters += ' AND r.exercise_id = ?'
+            params.append(exercise_id)
+        if since:
+            filters += f' AND r.{period} >= ?'
+            params.append(since)
+        rows = db.execute(f'''
+            SELECT r.exercise_id, e.name as exercise_name, r.{period} as period, r.log_count,
+                   r.total_sets, r.total_reps, r.total_volume, r.max_weight
+            FROM {table} r
+            LEFT JOIN exercises e ON r.exercise_id = e.id
+            WHERE r.client_id = ?{filters}
+            ORDER BY r.{period}, r.exercise_id
+        ''', params).fetchall()
+    db.close()
+
+    return jsonify({'success': True, 'granularity': granularity, 'rows': [dict(row) for row in rows]})
+
+# Application factory and per-process setup
+_app_ready = False
+
+def create_app():
+    """Finish setting up the app: logging, request hooks, static assets and compression.
+
+    Safe to call more than once. Under gunicorn it runs once in the master
+    (preload_app) and forked workers share the result; see gunicorn.conf.py.
+    """
+    global _app_ready
+    if _app_ready:
+        return app
+    _app_ready = True
+    timer = StartupTimer(IMPORT_STARTED)
+    timer.mark('import')
+
+    # JSON logs via a background queue writer (LOG_LEVEL, LOG_LEVELS, LOG_SAMPLING)
+    configure_logging()
+    if USE_POSTGRES:
+        logger.info("Using PostgreSQL database with psycopg3")
+    elif DATABASE_URL:
+        logger.warning("PostgreSQL configured but psycopg not available; "
+                       "falling back to SQLite - data will NOT persist across restarts")
+    else:
+        logger.info("Using SQLite database (data will not persist on Render)")
+
+    # Request IDs first so every later hook (including load shedding) logs with one
+    init_request_logging(app)
+    admission.init_app(app, shed_response)
+
+    # Fingerprinted, precompressed static assets (static/dist), served with immutable caching
+    init_assets(app)
+
+    # Compress HTML/JSON responses (gzip, brotli or zstd, negotiated per request)
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=int(os.environ.get('COMPRESS_MIN_SIZE', 500)),
+        levels={
+            'gzip': int(os.environ.get('COMPRESS_LEVEL_GZIP', 6)),
+            'br': int(os.environ.get('COMPRESS_LEVEL_BR', 4)),
+            'zstd': int(os.environ.get('COMPRESS_LEVEL_ZSTD', 3)),
+        })
+
+    # Compiled templates persist on disk across restarts (fill it at build time: python3 startup.py precompile)
+    enable_bytecode_cache(app)
+    timer.mark('configure')
+
+    templates = 0
+    if os.environ.get('WARMUP', '1') != '0':
+        templates = warmup()
+        timer.mark('warmup')
+
+    logger.info("Startup complete in %.1f ms", timer.total_ms,
+                extra={'phases_ms': timer.phases, 'templates': templates})
+    return app
+
+def warmup():
+    """Prime caches before serving (in the gunicorn master, so workers inherit them); returns templates loaded"""
+    templates = precompile_templates(app)
+    adherence_engine()
+    return templates
+
+def init_worker():
+    """Reset per-process state in a freshly forked worker (gunicorn post_fork)"""
+    # Threads, event loops and connections do not survive fork
+    structured_logging.restart_after_fork()
+    async_db.reset()
+    replica_set.reset()
+    shard_router.reset()
+    event_bus.reset()
+    invalidation_bus.reset()
+    # Start each worker with empty caches rather than the master's snapshot
+    owned_clients_cache.clear()
+    diagnostic_cache.clear()
+    fragment_cache.clear()
+    library_facets.reset()
+    substitution_engine.reset()
+    if _adherence_engine is not None:
+        _adherence_engine.invalidate()
 
 if __name__ == '__main__':
+    create_app()
     # Only auto-initialize SQLite database if it doesn't exist
     # PostgreSQL should be initialized manually via Shell
     if not USE_POSTGRES and not os.path.exists(app.config['DATABASE']):
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Workout log rollups and archival.
+
+Every logged workout also updates per-client, per-exercise daily and weekly
+rollups (workout_log_daily / workout_log_weekly) in the same transaction, so
+progress charts never have to scan raw logs.
+
+Raw logs older than ARCHIVE_AFTER_DAYS move out of workout_logs, a whole
+month at a time:
+- PostgreSQL: into workout_logs_archive, natively range-partitioned by month
+- SQLite: into monthly tables (workout_logs_YYYY_MM) in an attached archive
+  database next to the main one
+
+Run from a cron job:     python3 archive.py run [--days N]
+Rebuild empty rollups:   python3 archive.py backfill
+"""
+
+import os
+from datetime import date, timedelta
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_ALIAS = 'archive'
+ARCHIVE_COLUMNS = ('id', 'client_id', 'exercise_id', 'log_date', 'sets_completed', 'reps_completed',
+                   'weight_used', 'notes', 'created_at')
+ARCHIVE_TABLE_DDL = '''(
+    id INTEGER NOT NULL,
+    client_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    log_date DATE NOT NULL,
+    sets_completed INTEGER,
+    reps_completed INTEGER,
+    weight_used REAL,
+    notes TEXT,
+    created_at TIMESTAMP
+)'''
+
+# Rollup upserts; params: (client_id, exercise_id, day_or_week, sets, reps, volume, max_weight)
+_ROLLUP_UPSERT_SQL = '''
+    INSERT INTO {table} (client_id, exercise_id, {period}, log_count, total_sets, total_reps, total_volume, max_weight)
+    VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+    ON CONFLICT (client_id, exercise_id, {period}) DO UPDATE SET
+        log_count = {table}.log_count + 1,
+        total_sets = {table}.total_sets + excluded.total_sets,
+        total_reps = {table}.total_reps + excluded.total_reps,
+        total_volume = {table}.total_volume + excluded.total_volume,
+        max_weight = CASE WHEN {table}.max_weight IS NULL OR excluded.max_weight > {table}.max_weight
+                          THEN excluded.max_weight ELSE {table}.max_weight END
+'''
+DAILY_UPSERT_SQL = _ROLLUP_UPSERT_SQL.format(table='workout_log_daily', period='log_date')
+WEEKLY_UPSERT_SQL = _ROLLUP_UPSERT_SQL.format(table='workout_log_weekly', period='week_start')
+
+
+def _number(value, cast):
+    if value is None or value == '':
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def log_metrics(sets_completed, reps_completed, weight_used):
+    """Normalise form/JSON values to (sets, reps, weight) numbers, None when blank"""
+    return _number(sets_completed, int), _number(reps_completed, int), _number(weight_used, float)
+
+
+def week_start(day):
+    """Monday of the ISO week containing day"""
+    return day - timedelta(days=day.weekday())
+
+
+def rollup_params(client_id, exercise_id, log_date, sets, reps, weight):
+    """Parameters for DAILY_UPSERT_SQL and WEEKLY_UPSERT_SQL for one new log"""
+    total_reps = (sets or 1) * reps if reps is not None else 0
+    volume = total_reps * weight if weight is not None else 0
+    values = (sets or 0, total_reps, volume, weight)
+    return ((client_id, exercise_id, log_date.isoformat()) + values,
+            (client_id, exercise_id, week_start(log_date).isoformat()) + values)
+
+
+def backfill_rollups(db):
+    """Build rollups from raw logs when the rollup tables are still empty; returns rows written"""
+    if db.execute('SELECT 1 FROM workout_log_daily LIMIT 1').fetchone():
+        return 0
+
+    daily = db.execute('''
+        SELECT client_id, exercise_id, log_date, COUNT(*) as log_count,
+               COALESCE(SUM(COALESCE(sets_completed, 0)), 0) as total_sets,
+               COALESCE(SUM(COALESCE(sets_completed, 1) * reps_completed), 0) as total_reps,
+               COALESCE(SUM(COALESCE(sets_completed, 1) * reps_completed * weight_used), 0) as total_volume,
+               MAX(weight_used) as max_weight
+        FROM workout_logs
+        GROUP BY client_id, exercise_id, log_date
+    ''').fetchall()
+
+    weekly = {}
+    for row in daily:
+        day = row['log_date'] if isinstance(row['log_date'], date) else date.fromisoformat(str(row['log_date'])[:10])
+        db.execute('''
+            INSERT INTO workout_log_daily
+            (client_id, exercise_id, log_date, log_count, total_sets, total_reps, total_volume, max_weight)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (row['client_id'], row['exercise_id'], day.isoformat(), row['log_count'], row['total_sets'],
+              row['total_reps'], row['total_volume'], row['max_weight']))
+
+        key = (row['client_id'], row['exercise_id'], week_start(day))
+        count, sets, reps, volume, max_weight = weekly.get(key, (0, 0, 0, 0, None))
+        if row['max_weight'] is not None and (max_weight is None or row['max_weight'] > max_weight):
+            max_weight = row['max_weight']
+        weekly[key] = (count + row['log_count'], sets + row['total_sets'], reps + row['total_reps'],
+                       volume + row['total_volume'], max_weight)
+
+    for (client_id, exercise_id, week), values in weekly.items():
+        db.execute('''
+            INSERT INTO workout_log_weekly
+            (client_id, exercise_id, week_start, log_count, total_sets, total_reps, total_volume, max_weight)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (client_id, exercise_id, week.isoformat()) + values)
+
+    return len(daily) + len(weekly)
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def archive_cutoff(days=ARCHIVE_AFTER_DAYS, today=None):
+    """Logs before this date get archived; always a month boundary"""
+    return _month_start((today or date.today()) - timedelta(days=days))
+
+
+def _months(first, cutoff):
+    month = _month_start(first)
+    while month < cutoff:
+        yield month
+        month = _next_month(month)
+
+
+def _oldest_log(db, cutoff):
+    row = db.execute('SELECT MIN(log_date) as oldest FROM workout_logs WHERE log_date < ?',
+                     (cutoff.isoformat(),)).fetchone()
+    oldest = row['oldest'] if row else None
+    if oldest is None:
+        return None
+    return oldest if isinstance(oldest, date) else date.fromisoformat(str(oldest)[:10])
+
+
+def sqlite_archive_path(database_path):
+    root, ext = os.path.splitext(database_path)
+    return f'{root}_archive{ext or ".db"}'
+
+
+def _attached(db):
+    return ARCHIVE_ALIAS in [row[1] for row in db.execute('PRAGMA database_list').fetchall()]
+
+
+def attach_sqlite_archive(db, database_path):
+    """ATTACH the SQLite archive database (created on first use) as 'archive'"""
+    if not _attached(db):
+        db.execute(f'ATTACH DATABASE ? AS {ARCHIVE_ALIAS}', (sqlite_archive_path(database_path),))
+
+
+def sqlite_archive_tables(db):
+    """Monthly archive tables present in the attached archive database, oldest first"""
+    if not _attached(db):
+        return []
+    rows = db.execute(f'''
+        SELECT name FROM {ARCHIVE_ALIAS}.sqlite_master
+        WHERE type = 'table' AND name LIKE 'workout_logs_%'
+        ORDER BY name
+    ''').fetchall()
+    return [row[0] for row in rows]
+
+
+def ensure_postgres_archive(db):
+    """Create the partitioned archive table (idempotent)"""
+    db.execute(f'CREATE TABLE IF NOT EXISTS workout_logs_archive {ARCHIVE_TABLE_DDL} PARTITION BY RANGE (log_date)')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_workout_logs_archive_client
+        ON workout_logs_archive (client_id, log_date DESC, id DESC)
+    ''')
+
+
+def _archive_month(db, postgres, month):
+    """Create the archive partition (PostgreSQL) or table (SQLite) for month; returns the table to insert into"""
+    if postgres:
+        db.execute(f'''
+            CREATE TABLE IF NOT EXISTS workout_logs_archive_{month:%Y_%m}
+            PARTITION OF workout_logs_archive FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')
+        ''')
+        return 'workout_logs_archive'
+    table = f'{ARCHIVE_ALIAS}.workout_logs_{month:%Y_%m}'
+    db.execute(f'CREATE TABLE IF NOT EXISTS {table} {ARCHIVE_TABLE_DDL}')
+    db.execute(f'CREATE INDEX IF NOT EXISTS {ARCHIVE_ALIAS}.idx_workout_logs_{month:%Y_%m}_client '
+               f'ON workout_logs_{month:%Y_%m} (client_id, log_date DESC, id DESC)')
+    return table
+
+
+def archive_logs(db, postgres, database_path=None, days=ARCHIVE_AFTER_DAYS, today=None):
+    """Move whole months of old raw logs into the archive; returns the number of rows moved.
+
+    Rollups are untouched, so progress history stays complete. The caller commits.
+    """
+    cutoff = archive_cutoff(days, today)
+    oldest = _oldest_log(db, cutoff)
+    if oldest is None:
+        return 0
+
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    moved = 0
+    if postgres:
+        ensure_postgres_archive(db)
+        for month in _months(oldest, cutoff):
+            _archive_month(db, postgres, month)
+        cursor = db.execute(f'''
+            WITH moved AS (
+                DELETE FROM workout_logs WHERE log_date < ? RETURNING {columns}
+            )
+            INSERT INTO workout_logs_archive ({columns}) SELECT {columns} FROM moved
+        ''', (cutoff.isoformat(),))
+        return cursor.rowcount
+
+    attach_sqlite_archive(db, database_path)
+    for month in _months(oldest, cutoff):
+        table = _archive_month(db, postgres, month)
+        cursor = db.execute(f'''
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM workout_logs WHERE log_date >= ? AND log_date < ?
+        ''', (month.isoformat(), _next_month(month).isoformat()))
+        moved += cursor.rowcount
+    db.execute('DELETE FROM workout_logs WHERE log_date < ?', (cutoff.isoformat(),))
+    return moved
+
+
+def archived_logs_query(db, postgres):
+    """A FROM-clause source covering every archived log, or None if nothing is archived.
+
+    SQLite callers must have attached the archive first (attach_sqlite_archive).
+    """
+    if postgres:
+        exists = db.execute("SELECT to_regclass('workout_logs_archive') IS NOT NULL as present").fetchone()
+        return 'workout_logs_archive' if exists['present'] else None
+    tables = sqlite_archive_tables(db)
+    if not tables:
+        return None
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    return '(' + ' UNION ALL '.join(f'SELECT {columns} FROM {ARCHIVE_ALIAS}.{table}' for table in tables) + ')'
+
+
+def archive_tables(db, postgres):
+    """Tables holding archived logs: the partitioned parent, or each attached SQLite month table"""
+    if postgres:
+        return ['workout_logs_archive'] if archived_logs_query(db, postgres) else []
+    return [f'{ARCHIVE_ALIAS}.{table}' for table in sqlite_archive_tables(db)]
+
+
+def insert_archived_logs(db, postgres, rows):
+    """Add archived log rows (dicts of ARCHIVE_COLUMNS) to db's archive, creating months as needed.
+
+    SQLite callers must have attached the archive first (attach_sqlite_archive).
+    """
+    if postgres and rows:
+        ensure_postgres_archive(db)
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    placeholders = ', '.join('?' for _ in ARCHIVE_COLUMNS)
+    for row in rows:
+        day = row['log_date'] if isinstance(row['log_date'], date) else date.fromisoformat(str(row['log_date'])[:10])
+        table = _archive_month(db, postgres, _month_start(day))
+        db.execute(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                   tuple(row[column] for column in ARCHIVE_COLUMNS))
+
+
+def delete_archived_logs(db, postgres, client_id, database_path=None):
+    """Remove a client's archived raw logs (used when deleting the client)"""
+    if not postgres:
+        if not os.path.exists(sqlite_archive_path(database_path)):
+            return
+        attach_sqlite_archive(db, database_path)
+    for table in archive_tables(db, postgres):
+        db.execute(f'DELETE FROM {table} WHERE client_id = ?', (client_id,))
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ('run', 'backfill'):
+        print("Usage: python3 archive.py run [--days N] | backfill")
+        sys.exit(1)
+    days = int(args[args.index('--days') + 1]) if '--days' in args else ARCHIVE_AFTER_DAYS
+
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        from app import PostgresDB, normalize_database_url, pg_connect
+        db = PostgresDB(pg_connect(normalize_database_url(database_url)))
+        database_path = None
+    else:
+        database_path = os.environ.get('SQLITE_DATABASE', 'trainer_dashboard.db')
+        db = sqlite3.connect(database_path)
+        db.row_factory = sqlite3.Row
+
+    try:
+        if args[0] == 'backfill':
+            print(f"Wrote {backfill_rollups(db)} rollup rows")
+        else:
+            moved = archive_logs(db, bool(database_url), database_path, days)
+            print(f"Archived {moved} workout logs older than {archive_cutoff(days)}")
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Static asset pipeline: content hashing, precompression and image variants.
+
+Run at build time (python3 assets.py) or let the app build on startup.
+Every file under static/ is copied to static/dist/ with a content hash in
+its name, text assets get .gz and .br siblings, and raster images get
+resized PNG/WebP variants. Hashed files never change, so they are served
+with immutable far-future caching.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory, url_for
+
+# Optional dependencies: fall back gracefully when not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map'}
+RASTER_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+# Nav logo display height and its 2x/3x densities
+IMAGE_HEIGHTS = (40, 80, 120)
+SKIP_FILES = {'README.md'}
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def _hashed_name(rel_path, digest, suffix=''):
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{digest}{suffix}{ext}"
+
+
+def _write_atomic(path, data):
+    """Write via a temp file so concurrent workers never see partial files"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _precompress(path, data):
+    _write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(path + '.br', brotli.compress(data, quality=11))
+
+
+def _image_variants(source_path, rel_path, digest, dist_root):
+    """Write downscaled PNG and WebP copies; returns {format: {height: rel_path}}"""
+    variants = {}
+    if Image is None:
+        return variants
+
+    with Image.open(source_path) as img:
+        img.load()
+        for height in IMAGE_HEIGHTS:
+            if height >= img.height:
+                continue
+            width = max(1, round(img.width * height / img.height))
+            resized = img.resize((width, height), Image.LANCZOS)
+            for fmt, ext, options in (('png', '.png', {'optimize': True}),
+                                      ('webp', '.webp', {'quality': 85, 'method': 6})):
+                variant_rel = _hashed_name(os.path.splitext(rel_path)[0] + ext, digest, f".h{height}")
+                variant_path = os.path.join(dist_root, variant_rel)
+                tmp_path = f"{variant_path}.{os.getpid()}.tmp"
+                os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+                resized.save(tmp_path, format=fmt.upper(), **options)
+                os.replace(tmp_path, variant_path)
+                variants.setdefault(fmt, {})[str(height)] = variant_rel.replace(os.sep, '/')
+    return variants
+
+
+def build_assets(static_folder):
+    """Hash, precompress and generate variants for every static file; returns the manifest"""
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        # Never re-process our own output
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != dist_root]
+        for filename in filenames:
+            if filename in SKIP_FILES or filename.startswith('.'):
+                continue
+            source_path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+            with open(source_path, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed_rel = _hashed_name(rel_path, digest)
+            hashed_path = os.path.join(dist_root, hashed_rel)
+            if not os.path.exists(hashed_path):
+                _write_atomic(hashed_path, data)
+
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in COMPRESSIBLE_EXTENSIONS and not os.path.exists(hashed_path + '.gz'):
+                _precompress(hashed_path, data)
+
+            entry = {'path': hashed_rel}
+            if ext in RASTER_EXTENSIONS:
+                entry['variants'] = _image_variants(source_path, rel_path, digest, dist_root)
+            manifest[rel_path] = entry
+
+    _write_atomic(os.path.join(dist_root, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Load the manifest, rebuilding it if any source file is newer"""
+    manifest_path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        manifest_mtime = os.path.getmtime(manifest_path)
+    except OSError:
+        return build_assets(static_folder)
+
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != dist_root]
+        if any(os.path.getmtime(os.path.join(dirpath, name)) > manifest_mtime for name in filenames):
+            return build_assets(static_folder)
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def init_assets(app):
+    """Build/load the manifest and install fingerprinted url_for plus the asset route"""
+    manifest = load_manifest(app.static_folder)
+    app.extensions['asset_manifest'] = manifest
+    dist_root = os.path.join(app.static_folder, DIST_DIR)
+
+    def asset_url_for(endpoint, **values):
+        """url_for that rewrites static files to their fingerprinted URL"""
+        if endpoint == 'static':
+            entry = manifest.get(values.get('filename', ''))
+            if entry:
+                values['filename'] = entry['path']
+                endpoint = 'hashed_asset'
+        return url_for(endpoint, **values)
+
+    def asset_srcset(filename, fmt):
+        """srcset string (1x/2x/3x) for an image variant format, or '' if none were built"""
+        entry = manifest.get(filename, {})
+        heights = entry.get('variants', {}).get(fmt, {})
+        if not heights:
+            return ''
+        base = min(int(h) for h in heights)
+        return ', '.join(
+            f"{url_for('hashed_asset', filename=path)} {int(h) // base}x"
+            for h, path in sorted(heights.items(), key=lambda item: int(item[0])))
+
+    app.jinja_env.globals['url_for'] = asset_url_for
+    app.jinja_env.globals['asset_srcset'] = asset_srcset
+
+    @app.route('/assets/<path:filename>')
+    def hashed_asset(filename):
+        """Serve fingerprinted assets, preferring precompressed copies"""
+        accept = request.accept_encodings
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accept[encoding] and os.path.exists(os.path.join(dist_root, filename + suffix)):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(dist_root, filename + suffix,
+                                               mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(dist_root, filename, max_age=IMMUTABLE_MAX_AGE)
+
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    return manifest
+
+
+if __name__ == '__main__':
+    static_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_root):
+        shutil.rmtree(dist_root)
+    built = build_assets(static_folder)
+    print(f"Built {len(built)} static assets into {dist_root}")
+    print(f"Brotli: {'yes' if brotli else 'not installed'}, image variants: {'yes' if Image else 'Pillow not installed'}")
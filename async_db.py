@@ -0,0 +1,165 @@
+"""
+Async read-only database access for handlers that run independent queries at once.
+
+Flask stays a WSGI app, so each worker process runs one background event
+loop that owns psycopg AsyncConnectionPools (one per database URL, so read
+replicas get their own pool). Handlers submit coroutines with run();
+independent queries inside a coroutine run concurrently with
+asyncio.gather while the pool bounds the number of open connections.
+
+run() blocks the calling request thread until the coroutine is done, so
+this only pays off where a handler gathers several queries (the trainer
+dashboard). Single-query handlers and all writes use the plain get_db().
+
+In SQLite mode the same coroutines run their sqlite3 calls in threads.
+"""
+
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+
+_config = {'conninfo': None, 'sqlite_path': None, 'min_size': 1, 'max_size': 10, 'timeout': 30}
+_state = {'loop': None, 'thread': None, 'pools': {}}
+_state_lock = threading.Lock()
+_pg = {}
+
+
+def _postgres():
+    """psycopg, dict_row and AsyncConnectionPool (None if psycopg_pool is missing), imported on first use.
+
+    Only PostgreSQL mode needs them, so SQLite mode never pays for the import.
+    """
+    if not _pg:
+        import psycopg
+        from psycopg.rows import dict_row
+        try:
+            from psycopg_pool import AsyncConnectionPool
+        except ImportError:
+            AsyncConnectionPool = None
+        _pg.update(psycopg=psycopg, dict_row=dict_row, AsyncConnectionPool=AsyncConnectionPool)
+    return _pg
+
+
+def configure(conninfo=None, sqlite_path=None, min_size=1, max_size=10, timeout=30):
+    """Point the async layer at PostgreSQL (conninfo) or a SQLite file (sqlite_path)"""
+    _config.update(conninfo=conninfo, sqlite_path=sqlite_path, min_size=min_size, max_size=max_size, timeout=timeout)
+
+
+def _loop():
+    with _state_lock:
+        if _state['loop'] is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='async-db-loop', daemon=True)
+            thread.start()
+            _state['loop'], _state['thread'] = loop, thread
+        return _state['loop']
+
+
+def run(coro):
+    """Run a coroutine on the worker's event loop and wait for its result"""
+    future = asyncio.run_coroutine_threadsafe(coro, _loop())
+    return future.result(_config['timeout'])
+
+
+def reset():
+    """Forget the loop and pools inherited from a parent process (call after fork)"""
+    with _state_lock:
+        _state.update(loop=None, thread=None, pools={})
+
+
+def close():
+    """Close all pools and stop the loop"""
+    loop = _state['loop']
+    if loop is None:
+        return
+
+    async def _close_pools():
+        for pool in list(_state['pools'].values()):
+            await pool.close()
+
+    asyncio.run_coroutine_threadsafe(_close_pools(), loop).result(_config['timeout'])
+    loop.call_soon_threadsafe(loop.stop)
+    reset()
+
+
+async def _pool(conninfo):
+    pool = _state['pools'].get(conninfo)
+    if pool is None:
+        pg = _postgres()
+        pool = pg['AsyncConnectionPool'](conninfo, min_size=_config['min_size'], max_size=_config['max_size'],
+                                         kwargs={'row_factory': pg['dict_row']}, open=False)
+        _state['pools'][conninfo] = pool
+        await pool.open()
+    return pool
+
+
+class _PostgresReader:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def execute(self, query, params=()):
+        # Convert SQLite ? to PostgreSQL %s, as PostgresDB does
+        return await self.conn.execute(query.replace('?', '%s'), params)
+
+    async def fetchone(self, query, params=()):
+        cursor = await self.execute(query, params)
+        return await cursor.fetchone()
+
+    async def fetchall(self, query, params=()):
+        cursor = await self.execute(query, params)
+        return await cursor.fetchall()
+
+
+class _SQLiteReader:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def fetchone(self, query, params=()):
+        return await asyncio.to_thread(lambda: self.conn.execute(query, params).fetchone())
+
+    async def fetchall(self, query, params=()):
+        return await asyncio.to_thread(lambda: self.conn.execute(query, params).fetchall())
+
+
+def _sqlite_connect(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@asynccontextmanager
+async def connection(target=None):
+    """Yield a read-only connection wrapper.
+
+    target is a shard or replica URL/path, or None for the primary.
+    """
+    if _config['conninfo'] is None:
+        conn = await asyncio.to_thread(_sqlite_connect, target or _config['sqlite_path'])
+        try:
+            yield _SQLiteReader(conn)
+        finally:
+            await asyncio.to_thread(conn.close)
+        return
+
+    conninfo = target or _config['conninfo']
+    pg = _postgres()
+    if pg['AsyncConnectionPool'] is None:
+        # psycopg_pool not installed: one connection per transaction
+        async with await pg['psycopg'].AsyncConnection.connect(conninfo, row_factory=pg['dict_row']) as conn:
+            yield _PostgresReader(conn)
+        return
+
+    pool = await _pool(conninfo)
+    async with pool.connection() as conn:
+        yield _PostgresReader(conn)
+
+
+async def fetchone(query, params=(), target=None):
+    async with connection(target) as reader:
+        return await reader.fetchone(query, params)
+
+
+async def fetchall(query, params=(), target=None):
+    async with connection(target) as reader:
+        return await reader.fetchall(query, params)
@@ -0,0 +1,255 @@
+"""
+WSGI response compression with gzip, brotli and zstd.
+
+The encoding is negotiated from Accept-Encoding. Buffered responses are
+compressed in one go and get an exact Content-Length. Streamed responses
+(no Content-Length) are compressed chunk by chunk with a sync flush, so the
+client still receives data as it is produced. Every response that could be
+compressed carries Vary: Accept-Encoding, including identity ones, so shared
+caches keep the variants apart.
+"""
+
+import re
+import zlib
+
+# Optional dependencies: fall back gracefully when not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Server preference when the client weights encodings equally
+ENCODING_PREFERENCE = ('br', 'zstd', 'gzip')
+DEFAULT_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+DEFAULT_MIN_SIZE = 500
+# text/event-stream is left out: each event must reach the browser as soon as it is written
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+)
+_ETAG_SUFFIX = re.compile(r'-(?:br|zstd|gzip)(?="|$)')
+
+
+def available_encodings():
+    return [name for name in ENCODING_PREFERENCE
+            if name == 'gzip' or (name == 'br' and brotli) or (name == 'zstd' and zstandard)]
+
+
+def negotiate(accept_encoding, encodings=None):
+    """Pick the best encoding from an Accept-Encoding header, or None"""
+    encodings = encodings if encodings is not None else available_encodings()
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        weights[name] = quality
+
+    best, best_quality = None, 0.0
+    for name in encodings:
+        quality = weights.get(name, weights.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class _Encoder:
+    """Uniform compress/flush/finish interface over zlib, brotli and zstandard"""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=level)
+        elif encoding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._obj.flush()
+        if self.encoding == 'zstd':
+            return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+class CompressionMiddleware:
+    """Compress HTML/JSON/text responses according to the client's Accept-Encoding"""
+
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE, levels=None, compressible_types=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.min_size = min_size
+        self.levels = dict(DEFAULT_LEVELS, **(levels or {}))
+        self.compressible_types = compressible_types
+        self.encodings = available_encodings()
+
+    def _negotiable(self, status, headers):
+        """Whether the body's encoding depends on Accept-Encoding (its type and size qualify)"""
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code >= 300 or code in (204, 206):
+            return False
+        header_map = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in header_map:
+            # Already compressed, e.g. precompressed static assets
+            return False
+        if 'no-transform' in header_map.get('cache-control', ''):
+            return False
+        mimetype = header_map.get('content-type', '').split(';', 1)[0].strip().lower()
+        if mimetype not in self.compressible_types:
+            return False
+        length = header_map.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    @staticmethod
+    def _add_vary(headers):
+        rewritten = []
+        vary = None
+        for name, value in headers:
+            if name.lower() == 'vary':
+                vary = value
+                continue
+            rewritten.append((name, value))
+        if vary and vary.strip() != '*':
+            if 'accept-encoding' not in vary.lower():
+                vary = f'{vary}, Accept-Encoding'
+        rewritten.append(('Vary', vary or 'Accept-Encoding'))
+        return rewritten
+
+    @classmethod
+    def _rewrite_headers(cls, headers, encoding, content_length=None):
+        rewritten = []
+        for name, value in cls._add_vary(headers):
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag':
+                # Each representation needs its own strong validator
+                value = value[:-1] + f'-{encoding}"' if value.endswith('"') else f'{value}-{encoding}'
+            rewritten.append((name, value))
+        rewritten.append(('Content-Encoding', encoding))
+        if content_length is not None:
+            rewritten.append(('Content-Length', str(content_length)))
+        return rewritten
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+
+        # Validators we handed out carry an encoding suffix; the app only knows the bare ETag
+        stripped_suffix = False
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            bare = _ETAG_SUFFIX.sub('', if_none_match)
+            stripped_suffix = bare != if_none_match
+            environ['HTTP_IF_NONE_MATCH'] = bare
+
+        if not encoding:
+            # Sent as is, but a client that accepts an encoding would get a different body
+            def vary_start_response(status, headers, exc_info=None):
+                if self._negotiable(status, headers):
+                    headers = self._add_vary(headers)
+                return start_response(status, headers, exc_info)
+            return self.app(environ, vary_start_response)
+
+        captured = {}
+        legacy_body = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return legacy_body.append
+
+        app_iter = self.app(environ, capture_start_response)
+        iterator = iter(app_iter)
+        first_chunks = []
+        if not captured:
+            # The app starts the response lazily on first iteration
+            first_chunks = [next(iterator, b'')]
+
+        status, headers = captured['status'], captured['headers']
+        method = environ.get('REQUEST_METHOD', 'GET')
+
+        negotiable = self._negotiable(status, headers)
+        if not negotiable or method == 'HEAD':
+            if status.startswith('304') and stripped_suffix:
+                headers = [(n, v[:-1] + f'-{encoding}"' if n.lower() == 'etag' and v.endswith('"') else v)
+                           for n, v in headers]
+            if negotiable:
+                headers = self._add_vary(headers)
+            start_response(status, headers, captured['exc_info'])
+            if not legacy_body and not first_chunks:
+                # Hand back the original iterable so wsgi.file_wrapper still works
+                return app_iter
+            return _PassThrough(legacy_body + first_chunks, iterator, app_iter)
+
+        encoder = _Encoder(encoding, self.levels[encoding])
+        content_length = next((v for n, v in headers if n.lower() == 'content-length'), None)
+
+        if content_length is not None:
+            # Buffered response: compress it all and send an exact length
+            try:
+                body = b''.join(legacy_body + first_chunks + list(iterator))
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            data = encoder.compress(body) + encoder.finish()
+            start_response(status, self._rewrite_headers(headers, encoding, len(data)), captured['exc_info'])
+            return [data]
+
+        start_response(status, self._rewrite_headers(headers, encoding), captured['exc_info'])
+        return _stream(encoder, legacy_body + first_chunks, iterator, app_iter)
+
+
+def _stream(encoder, head, iterator, app_iter):
+    """Compress a streamed body, flushing after every chunk the app yields"""
+    try:
+        for chunk in head:
+            if chunk:
+                yield encoder.compress(chunk) + encoder.flush()
+        for chunk in iterator:
+            if chunk:
+                yield encoder.compress(chunk) + encoder.flush()
+        yield encoder.finish()
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+class _PassThrough:
+    """Re-emit already consumed chunks, then the rest, and forward close()"""
+
+    def __init__(self, head, iterator, app_iter):
+        self._head = head
+        self._iterator = iterator
+        self._app_iter = app_iter
+
+    def __iter__(self):
+        yield from self._head
+        yield from self._iterator
+
+    def close(self):
+        if hasattr(self._app_iter, 'close'):
+            self._app_iter.close()
@@ -0,0 +1,163 @@
+"""
+Server-sent events for program and session changes.
+
+Each worker has one EventBus that fans events out to the /events streams
+open in that worker. Routes publish inside their write transaction:
+- PostgreSQL: pg_notify() on CHANNEL. The notification is only sent if the
+  transaction commits, and every worker's listener thread (one LISTEN
+  connection per database, started with the first stream) receives it.
+- SQLite: the event is kept on the request and dispatched to this worker's
+  streams after the commit; streams held by other workers do not see it.
+
+Notifications sent while a listener is reconnecting are lost, so after a
+reconnect every open stream gets a 'resync' event and reloads.
+
+Events are JSON: {"users": [...], "event": "program", "data": {...}}.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+CHANNEL = 'app_events'
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+logger = logging.getLogger('app.events')
+
+
+def encode(user_ids, event, data):
+    payload = json.dumps({'users': sorted(set(user_ids)), 'event': event, 'data': data}, default=str)
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f'event payload too large ({len(payload)} bytes)')
+    return payload
+
+
+def format_sse(event, data):
+    """One SSE message"""
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+class Subscription:
+    """Events for one user's stream; a slow reader loses events instead of growing the queue"""
+
+    def __init__(self, bus, user_id, max_queue):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue = queue.Queue(max_queue)
+        self.overflowed = False
+
+    def put(self, event, data):
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """(event, data), or None after timeout seconds without one"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """In-process pub/sub keyed by user ID, fed locally or by PostgreSQL LISTEN"""
+
+    def __init__(self, listen_targets=(), max_queue=100):
+        self.listen_targets = list(listen_targets)
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stopped = threading.Event()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if self.listen_targets and not self._listeners:
+                self._start_listeners()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def resync(self):
+        """Tell every stream in this worker to reload (events may have been missed)"""
+        with self._lock:
+            targets = [s for subscribers in self._subscribers.values() for s in subscribers]
+        for subscription in targets:
+            subscription.put('resync', {})
+
+    def dispatch(self, payload):
+        """Deliver an encoded event to this worker's matching streams"""
+        message = json.loads(payload)
+        with self._lock:
+            targets = [s for user_id in message['users'] for s in self._subscribers.get(user_id, ())]
+        for subscription in targets:
+            subscription.put(message['event'], message['data'])
+
+    @property
+    def stream_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def reset(self):
+        """Forget streams and listener threads inherited from a parent process (call after fork)"""
+        self._stopped.set()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stopped = threading.Event()
+
+    def _start_listeners(self):
+        self._listeners = start_listeners(self.listen_targets, CHANNEL, self.dispatch, self._stopped, 'event-listener',
+                                          on_reconnect=self.resync)
+
+
+def start_listeners(targets, channel, handle, stopped, name, on_reconnect=None):
+    """One daemon thread per PostgreSQL database, passing each NOTIFY payload on channel to handle"""
+    threads = []
+    for target in targets:
+        thread = threading.Thread(target=pg_listen, args=(target, channel, handle, stopped, on_reconnect),
+                                  name=name, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def pg_listen(conninfo, channel, handle, stopped, on_reconnect=None):
+    """LISTEN on one database until stopped, reconnecting after errors.
+
+    Notifications sent while disconnected are lost: on_reconnect() runs once
+    LISTEN is back in place after every reconnect, so the caller can resync.
+    """
+    import psycopg
+
+    connected = False
+    while not stopped.is_set():
+        try:
+            with psycopg.connect(conninfo, autocommit=True) as conn:
+                conn.execute(f'LISTEN {channel}')
+                if connected and on_reconnect:
+                    logger.warning("Listener on %s reconnected; resyncing", channel)
+                    on_reconnect()
+                connected = True
+                while not stopped.is_set():
+                    # Wake up periodically to notice stop requests
+                    for notify in conn.notifies(timeout=5.0):
+                        handle(notify.payload)
+        except Exception:
+            logger.exception("Listener on %s lost its connection; reconnecting", channel)
+            time.sleep(1)
@@ -0,0 +1,182 @@
+"""
+Faceted filtering for the exercise library.
+
+FacetIndex is an inverted index from each facet value (category, equipment,
+muscle group) to the exercises that have it, stored as a Python int used as
+a bitset: bit n is set when exercise n has the value. Filtering is a few
+ANDs over those ints and counting is int.bit_count(), so every value's count
+under the current filters comes from memory instead of a GROUP BY.
+
+LibraryFacets keeps one index per shard (each shard holds a mirror of the
+library, with shard 0's IDs). Library writes broadcast the changed
+exercise's ID on the 'exercise_library' invalidation topic; the next reader
+that sees a newer library version reloads only those rows. Each write bumps
+every shard's version once, so when the version did not move by exactly the
+number of IDs received (an invalidation is late or was missed, or a script
+wrote to the library) the index is rebuilt from one query.
+"""
+
+import threading
+
+FACETS = ('category', 'equipment', 'muscle')
+# Kept per exercise so /api/exercises is answered without a query
+ROWS_SQL = 'SELECT id, name, category, equipment, description, muscle_groups FROM exercise_library'
+
+
+def parse_muscle_groups(text):
+    """'quads, glutes ,lower back' -> ['Quads', 'Glutes', 'Lower Back'], without blanks or repeats"""
+    groups = []
+    for part in (text or '').split(','):
+        name = ' '.join(word[:1].upper() + word[1:] for word in part.split())
+        if name and name not in groups:
+            groups.append(name)
+    return groups
+
+
+def facet_values(row):
+    """{facet: [values]} for one library row"""
+    return {
+        'category': [row['category']] if row['category'] else [],
+        'equipment': [row['equipment']] if row['equipment'] else [],
+        'muscle': parse_muscle_groups(row['muscle_groups']),
+    }
+
+
+def _bits(exercise_ids):
+    bits = 0
+    for exercise_id in exercise_ids:
+        bits |= 1 << exercise_id
+    return bits
+
+
+class FacetIndex:
+    """Facet value -> bitset of exercise IDs, for one library version. Treat as immutable once published."""
+
+    def __init__(self, version):
+        self.version = version
+        self.rows = {}
+        self.postings = {facet: {} for facet in FACETS}
+        self.all = 0
+        self._order = None
+
+    @classmethod
+    def build(cls, version, rows):
+        index = cls(version)
+        for row in rows:
+            index._add(row)
+        return index
+
+    def updated(self, version, exercise_ids, rows):
+        """Copy of this index at version, with exercise_ids replaced by rows (IDs without a row were deleted)"""
+        index = FacetIndex(version)
+        index.rows = dict(self.rows)
+        index.postings = {facet: dict(values) for facet, values in self.postings.items()}
+        index.all = self.all
+        for exercise_id in exercise_ids:
+            index._remove(exercise_id)
+        for row in rows:
+            index._add(row)
+        return index
+
+    def select(self, filters, search='', skip=None):
+        """Bitset of exercises matching every filter (facet -> value, empty means any) except skip's"""
+        bits = self.all
+        for facet, value in filters.items():
+            if value and facet != skip:
+                bits &= self.postings[facet].get(value, 0)
+        if search and bits:
+            needle = search.casefold()
+            bits &= _bits(exercise_id for exercise_id, row in self.rows.items()
+                          if needle in row['name'].casefold())
+        return bits
+
+    def counts(self, filters, search=''):
+        """{facet: {value: count}}: how many exercises each value would leave, keeping the other facets' filters"""
+        counts = {}
+        for facet in FACETS:
+            base = self.select(filters, search, skip=facet)
+            counts[facet] = {value: (bits & base).bit_count()
+                             for value, bits in sorted(self.postings[facet].items())}
+        return counts
+
+    def matching(self, filters, search=''):
+        """Rows matching the filters, ordered by category then name"""
+        bits = self.select(filters, search)
+        return [self.rows[exercise_id] for exercise_id in self._ordered() if bits >> exercise_id & 1]
+
+    def _ordered(self):
+        if self._order is None:
+            self._order = sorted(self.rows, key=lambda i: (self.rows[i]['category'] or '', self.rows[i]['name']))
+        return self._order
+
+    def _add(self, row):
+        row = dict(row)
+        exercise_id = row['id']
+        row['facets'] = facet_values(row)
+        self.rows[exercise_id] = row
+        bit = 1 << exercise_id
+        self.all |= bit
+        for facet, values in row['facets'].items():
+            postings = self.postings[facet]
+            for value in values:
+                postings[value] = postings.get(value, 0) | bit
+        self._order = None
+
+    def _remove(self, exercise_id):
+        row = self.rows.pop(exercise_id, None)
+        if row is None:
+            return
+        bit = 1 << exercise_id
+        self.all &= ~bit
+        for facet, values in row['facets'].items():
+            postings = self.postings[facet]
+            for value in values:
+                remaining = postings[value] & ~bit
+                if remaining:
+                    postings[value] = remaining
+                else:
+                    del postings[value]
+        self._order = None
+
+
+class LibraryFacets:
+    """Per-shard FacetIndex, refreshed on read when the library version moves"""
+
+    def __init__(self):
+        self.reset()
+
+    def get(self, shard, version, fetch):
+        """The index for shard at version; fetch(query, params) runs a read on that shard"""
+        index = self._indexes.get(shard)
+        if index is not None and index.version == version:
+            return index
+        with self._lock:
+            index = self._indexes.get(shard)
+            if index is not None and index.version == version:
+                return index
+            changed = self._changed.pop(shard, [])
+            if index is None or not changed or version != index.version + len(changed):
+                index = FacetIndex.build(version, fetch(ROWS_SQL, ()))
+            else:
+                changed = sorted(set(changed))
+                placeholders = ', '.join('?' for _ in changed)
+                index = index.updated(version, changed, fetch(f'{ROWS_SQL} WHERE id IN ({placeholders})', changed))
+            self._indexes[shard] = index
+        return index
+
+    def invalidate(self, exercise_id=None):
+        """Invalidation handler: reload exercise_id on next use, or rebuild everything if None"""
+        with self._lock:
+            if exercise_id is None:
+                self._indexes = {}
+                self._changed = {}
+                return
+            # Library IDs are the same on every shard (see shards.py)
+            for shard in self._indexes:
+                self._changed.setdefault(shard, []).append(exercise_id)
+
+    def reset(self):
+        """Drop indexes inherited from a parent process (call after fork)"""
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._changed = {}
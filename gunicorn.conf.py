@@ -0,0 +1,52 @@
+"""
+Gunicorn production profile.
+
+gunicorn loads this file automatically from the working directory, so the
+start command is just `gunicorn`. Every setting can be overridden with the
+environment variables below or on the command line.
+
+- The app is built once in the master (preload_app) and workers share its
+  imported modules, compiled templates and caches copy-on-write.
+- post_fork gives each worker its own logging thread, async event loop,
+  connection pools and empty caches.
+- Workers are recycled after max_requests (+ jitter, so they do not all
+  restart at once) to bound memory growth.
+"""
+
+import os
+
+
+def _cpu_count():
+    # CPUs this process may actually run on (respects container CPU sets)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+wsgi_app = 'app:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = True
+
+# Requests mostly wait on the database, so each worker runs a few threads. An open /events stream
+# holds a thread for up to SSE_MAX_SECONDS, so each worker gets one more thread per stream it admits
+# (the app's 'events' admission class); streams then never take threads from ordinary requests.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', _cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) + int(os.environ.get('SSE_STREAMS', 16))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# app.py logs JSON itself; gunicorn's own access log would duplicate it
+accesslog = None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker()
@@ -0,0 +1,138 @@
+"""
+Cross-worker cache invalidation.
+
+In-process caches register a handler per topic (e.g. 'owned_clients'), and
+writes broadcast (topic, key) inside their transaction. Every worker then
+drops the affected entries:
+- PostgreSQL: pg_notify() on CHANNEL, delivered on commit to a LISTEN
+  thread in each worker (one connection per database). A listener that
+  loses its connection flushes every cache once it is listening again.
+- SQLite: a row in cache_invalidations. Before each request (at most every
+  poll_interval seconds) a worker reads PRAGMA data_version on its own
+  connection to each database file. The value only changes when some other
+  connection has committed, so the invalidation table is read only then.
+
+The worker that made the write applies its invalidations itself right after
+the commit, so its next request never sees stale data. Other workers catch
+up within one poll interval (SQLite) or one notification round trip
+(PostgreSQL); TTLs remain as a backstop.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from events import start_listeners
+
+CHANNEL = 'cache_invalidation'
+# cache_invalidations rows kept for workers that fall behind; older gaps flush every cache
+SQLITE_BACKLOG = 1000
+
+logger = logging.getLogger('app.invalidation')
+
+
+class InvalidationBus:
+    """Routes (topic, key) invalidations to registered handlers in every worker"""
+
+    def __init__(self, postgres, targets, poll_interval=0.5):
+        self.postgres = postgres
+        self.targets = list(targets)
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self.reset()
+
+    def on(self, topic, handler):
+        """Call handler(key) when topic is invalidated; key None means everything"""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def apply(self, topic, key=None):
+        for handler in self._handlers.get(topic, ()):
+            handler(key)
+
+    def flush(self):
+        """Invalidate every topic (e.g. after missing some invalidations)"""
+        for topic in self._handlers:
+            self.apply(topic)
+
+    def statements(self, topic, key=None):
+        """(query, params) pairs that broadcast an invalidation when run in a write transaction"""
+        if self.postgres:
+            return [('SELECT pg_notify(?, ?)', (CHANNEL, json.dumps([topic, key])))]
+        return [('INSERT INTO cache_invalidations (topic, cache_key) VALUES (?, ?)', (topic, key)),
+                ('DELETE FROM cache_invalidations WHERE id <= (SELECT MAX(id) FROM cache_invalidations) - ?',
+                 (SQLITE_BACKLOG,))]
+
+    def broadcast(self, db, topic, key=None):
+        """Queue an invalidation for every worker inside db's transaction"""
+        for query, params in self.statements(topic, key):
+            db.execute(query, params)
+
+    def poll(self):
+        """Pick up other workers' invalidations; cheap enough to call on every request"""
+        if self.postgres:
+            if not self._listeners:
+                with self._lock:
+                    if not self._listeners:
+                        # Invalidations sent while a listener was reconnecting are lost: clear everything
+                        self._listeners = start_listeners(self.targets, CHANNEL, self._receive, self._stopped,
+                                                          'invalidation-listener', on_reconnect=self.flush)
+            return
+
+        now = time.monotonic()
+        if now < self._next_poll or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_poll = now + self.poll_interval
+            for path in self.targets:
+                self._poll_sqlite(path)
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """Drop connections and threads inherited from a parent process (call after fork)"""
+        if getattr(self, '_stopped', None) is not None:
+            self._stopped.set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._listeners = []
+        self._connections = {}
+        self._data_versions = {}
+        self._last_seen = {}
+        self._next_poll = 0
+
+    def _receive(self, payload):
+        topic, key = json.loads(payload)
+        self.apply(topic, key)
+
+    def _poll_sqlite(self, path):
+        try:
+            conn = self._connections.get(path)
+            if conn is None:
+                conn = sqlite3.connect(path, check_same_thread=False)
+                self._last_seen[path] = conn.execute('SELECT MAX(id) FROM cache_invalidations').fetchone()[0] or 0
+                self._connections[path] = conn
+                # Anything cached before we started watching may already be stale
+                self.flush()
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_versions.get(path):
+                return
+            self._data_versions[path] = data_version
+
+            last_seen = self._last_seen[path]
+            rows = conn.execute('SELECT id, topic, cache_key FROM cache_invalidations WHERE id > ? ORDER BY id',
+                                (last_seen,)).fetchall()
+        except sqlite3.Error:
+            # Not migrated yet, or the file is busy: try again next time
+            self._connections.pop(path, None)
+            return
+        if not rows:
+            return
+        if rows[0][0] > last_seen + 1:
+            logger.warning("Missed cache invalidations; clearing all caches", extra={'database': path})
+            self.flush()
+        else:
+            for _, topic, key in rows:
+                self.apply(topic, key)
+        self._last_seen[path] = rows[-1][0]
@@ -0,0 +1,178 @@
+-- Phase 2 Database Migration
+-- Run this after Phase 1 to add tables for performance features
+-- Safe to run multiple times
+
+-- Recurring training sessions (expanded lazily, never materialized)
+CREATE TABLE IF NOT EXISTS session_recurrences (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trainer_id INTEGER NOT NULL,
+    client_id INTEGER NOT NULL,
+    weekdays TEXT NOT NULL,
+    interval_weeks INTEGER DEFAULT 1,
+    start_date DATE NOT NULL,
+    end_date DATE,
+    start_time TEXT NOT NULL,
+    duration INTEGER,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (trainer_id) REFERENCES users(id),
+    FOREIGN KEY (client_id) REFERENCES users(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_session_recurrences_trainer ON session_recurrences(trainer_id, start_date);
+CREATE INDEX IF NOT EXISTS idx_session_recurrences_client ON session_recurrences(client_id, start_date);
+
+-- Per-occurrence overrides for recurring sessions (e.g. a cancelled Tuesday)
+CREATE TABLE IF NOT EXISTS session_exceptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recurrence_id INTEGER NOT NULL,
+    occurrence_date DATE NOT NULL,
+    status TEXT DEFAULT 'cancelled' CHECK(status IN ('scheduled', 'completed', 'cancelled')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (recurrence_id) REFERENCES session_recurrences(id),
+    UNIQUE(recurrence_id, occurrence_date)
+);
+
+-- Cheap version stamps for conditional GET (ETag / Last-Modified)
+ALTER TABLE programs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Program templates: clones remember their source and the batch that created them
+ALTER TABLE programs ADD COLUMN IF NOT EXISTS source_program_id INTEGER;
+ALTER TABLE programs ADD COLUMN IF NOT EXISTS assignment_batch TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_programs_assignment_batch ON programs(assignment_batch);
+CREATE INDEX IF NOT EXISTS idx_exercises_program ON exercises(program_id, exercise_order);
+
+-- Keyset pagination of client history in view_client (newest first, id as tie-breaker)
+CREATE INDEX IF NOT EXISTS idx_programs_client_created ON programs(client_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_training_sessions_client_date ON training_sessions(client_id, session_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_workout_logs_client_date ON workout_logs(client_id, log_date DESC, id DESC);
+
+-- Per-client, per-exercise workout rollups, maintained on every logged workout (see archive.py)
+CREATE TABLE IF NOT EXISTS workout_log_daily (
+    client_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    log_date DATE NOT NULL,
+    log_count INTEGER NOT NULL DEFAULT 0,
+    total_sets INTEGER NOT NULL DEFAULT 0,
+    total_reps INTEGER NOT NULL DEFAULT 0,
+    total_volume REAL NOT NULL DEFAULT 0,
+    max_weight REAL,
+    PRIMARY KEY (client_id, exercise_id, log_date)
+);
+
+CREATE TABLE IF NOT EXISTS workout_log_weekly (
+    client_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    week_start DATE NOT NULL,
+    log_count INTEGER NOT NULL DEFAULT 0,
+    total_sets INTEGER NOT NULL DEFAULT 0,
+    total_reps INTEGER NOT NULL DEFAULT 0,
+    total_volume REAL NOT NULL DEFAULT 0,
+    max_weight REAL,
+    PRIMARY KEY (client_id, exercise_id, week_start)
+);
+
+-- Most recent log per client and program exercise, upserted on every logged workout
+CREATE TABLE IF NOT EXISTS latest_logs (
+    client_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    log_id INTEGER NOT NULL,
+    log_date DATE NOT NULL,
+    sets_completed INTEGER,
+    reps_completed INTEGER,
+    weight_used REAL,
+    PRIMARY KEY (client_id, exercise_id)
+);
+
+-- Covers the windowed last-N-performances query without touching the table
+CREATE INDEX IF NOT EXISTS idx_workout_logs_client_exercise_recent
+ON workout_logs(client_id, exercise_id, log_date DESC, id DESC, sets_completed, reps_completed, weight_used);
+
+-- Seed the latest-log cache from existing history (no-op for rows already present)
+INSERT INTO latest_logs (client_id, exercise_id, log_id, log_date, sets_completed, reps_completed, weight_used)
+SELECT client_id, exercise_id, id, log_date, sets_completed, reps_completed, weight_used
+FROM (
+    SELECT wl.*, ROW_NUMBER() OVER (PARTITION BY wl.client_id, wl.exercise_id ORDER BY wl.log_date DESC, wl.id DESC) as rn
+    FROM workout_logs wl
+) ranked
+WHERE rn = 1
+ON CONFLICT (client_id, exercise_id) DO NOTHING;
+
+-- Personal records, maintained on every logged workout (see records.py)
+CREATE TABLE IF NOT EXISTS personal_records (
+    client_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    max_weight REAL,
+    max_weight_date DATE,
+    best_e1rm REAL,
+    best_e1rm_date DATE,
+    PRIMARY KEY (client_id, exercise_id)
+);
+
+CREATE TABLE IF NOT EXISTS rep_records (
+    client_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    best_reps INTEGER NOT NULL,
+    log_date DATE,
+    PRIMARY KEY (client_id, exercise_id, weight)
+);
+
+-- Which shard holds each trainer's data (see shards.py), trainers without a row live on shard 0
+CREATE TABLE IF NOT EXISTS shard_directory (
+    trainer_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL DEFAULT 0,
+    moving BOOLEAN DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The trainer whose shard holds a client's data (see shards.py), set by add_client.
+-- Clients added before it existed belong to their first trainer link.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS owner_trainer_id INTEGER;
+UPDATE users SET owner_trainer_id = (
+    SELECT c.trainer_id FROM clients c WHERE c.client_id = users.id ORDER BY c.id LIMIT 1
+) WHERE role = 'client' AND owner_trainer_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_users_owner_trainer ON users(owner_trainer_id);
+
+-- Delta sync (see sync.py): row stamps and a per-audience change feed
+ALTER TABLE exercises ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+ALTER TABLE training_sessions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+ALTER TABLE exercise_library ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+ALTER TABLE programs ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+ALTER TABLE exercises ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+ALTER TABLE training_sessions ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+ALTER TABLE exercise_library ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS change_feed (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    audience INTEGER NOT NULL,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    deleted BOOLEAN DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_feed_audience ON change_feed(audience, id);
+
+-- Writing transaction of each feed entry, readers go in (tx, id) order (see sync.py)
+ALTER TABLE change_feed ADD COLUMN IF NOT EXISTS tx BIGINT NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_change_feed_position ON change_feed(audience, tx, id);
+CREATE INDEX IF NOT EXISTS idx_change_feed_changed ON change_feed(changed_at);
+
+-- Cross-worker cache invalidations in SQLite mode (see invalidation.py), PostgreSQL uses NOTIFY instead
+CREATE TABLE IF NOT EXISTS cache_invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    cache_key INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Exercise substitutions (see substitutes.py) re-read recently changed programs
+CREATE INDEX IF NOT EXISTS idx_programs_updated ON programs(updated_at);
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Personal records per client and program exercise.
+
+personal_records holds the heaviest weight and the best estimated one-rep
+max (Epley) with the date each was set; rep_records holds the most reps done
+at each weight. Both are upserted inside the log_workout transaction, so a
+PR lookup is a primary-key read.
+
+Rebuild from history (including archived logs) with: python3 records.py backfill
+"""
+
+import os
+from datetime import date
+
+from archive import ARCHIVE_COLUMNS, archived_logs_query, attach_sqlite_archive, sqlite_archive_path
+
+# The CASE guards keep an existing record unless the new value beats it
+PR_UPSERT_SQL = '''
+    INSERT INTO personal_records
+    (client_id, exercise_id, max_weight, max_weight_date, best_e1rm, best_e1rm_date)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (client_id, exercise_id) DO UPDATE SET
+        max_weight_date = CASE WHEN personal_records.max_weight IS NULL OR excluded.max_weight > personal_records.max_weight
+                               THEN excluded.max_weight_date ELSE personal_records.max_weight_date END,
+        max_weight = CASE WHEN personal_records.max_weight IS NULL OR excluded.max_weight > personal_records.max_weight
+                          THEN excluded.max_weight ELSE personal_records.max_weight END,
+        best_e1rm_date = CASE WHEN personal_records.best_e1rm IS NULL OR excluded.best_e1rm > personal_records.best_e1rm
+                              THEN excluded.best_e1rm_date ELSE personal_records.best_e1rm_date END,
+        best_e1rm = CASE WHEN personal_records.best_e1rm IS NULL OR excluded.best_e1rm > personal_records.best_e1rm
+                         THEN excluded.best_e1rm ELSE personal_records.best_e1rm END
+'''
+
+REP_RECORD_UPSERT_SQL = '''
+    INSERT INTO rep_records (client_id, exercise_id, weight, best_reps, log_date)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (client_id, exercise_id, weight) DO UPDATE SET
+        log_date = CASE WHEN excluded.best_reps > rep_records.best_reps THEN excluded.log_date ELSE rep_records.log_date END,
+        best_reps = CASE WHEN excluded.best_reps > rep_records.best_reps THEN excluded.best_reps ELSE rep_records.best_reps END
+'''
+
+CURRENT_RECORDS_SQL = '''
+    SELECT pr.max_weight, pr.best_e1rm, rr.best_reps
+    FROM (SELECT 1 as one) x
+    LEFT JOIN personal_records pr ON pr.client_id = ? AND pr.exercise_id = ?
+    LEFT JOIN rep_records rr ON rr.client_id = ? AND rr.exercise_id = ? AND rr.weight = ?
+'''
+
+
+def estimated_1rm(weight, reps):
+    """Epley estimate of a one-rep max; None without a weight and reps"""
+    if not weight or not reps:
+        return None
+    if reps == 1:
+        return float(weight)
+    return round(weight * (1 + reps / 30), 1)
+
+
+def new_records(current, weight, reps):
+    """Names of the records a log beats, given its CURRENT_RECORDS_SQL row"""
+    if not weight:
+        return []
+    broken = []
+    if current['max_weight'] is None or weight > current['max_weight']:
+        broken.append('max_weight')
+    e1rm = estimated_1rm(weight, reps)
+    if e1rm and (current['best_e1rm'] is None or e1rm > current['best_e1rm']):
+        broken.append('best_e1rm')
+    if reps and (current['best_reps'] is None or reps > current['best_reps']):
+        broken.append('reps_at_weight')
+    return broken
+
+
+def record_params(client_id, exercise_id, log_date, weight, reps):
+    """Parameters for PR_UPSERT_SQL and REP_RECORD_UPSERT_SQL (the latter None when not applicable)"""
+    day = log_date.isoformat() if isinstance(log_date, date) else str(log_date)[:10]
+    e1rm = estimated_1rm(weight, reps)
+    pr = (client_id, exercise_id, weight, day if weight else None, e1rm, day if e1rm else None)
+    reps_at_weight = (client_id, exercise_id, weight, reps, day) if weight and reps else None
+    return pr, reps_at_weight
+
+
+def backfill_records(db, postgres, database_path=None, force=False):
+    """Build PRs from all history (hot and archived logs) in one ordered pass.
+
+    Skipped when records already exist unless force is set. The caller commits.
+    Returns the number of (client, exercise) pairs written.
+    """
+    if not force and db.execute('SELECT 1 FROM personal_records LIMIT 1').fetchone():
+        return 0
+
+    # Attach before writing: SQLite refuses ATTACH inside a transaction
+    if not postgres and os.path.exists(sqlite_archive_path(database_path)):
+        attach_sqlite_archive(db, database_path)
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    source = 'workout_logs'
+    archived = archived_logs_query(db, postgres)
+    if archived:
+        source = f'(SELECT {columns} FROM workout_logs UNION ALL SELECT {columns} FROM {archived} a)'
+
+    best = {}
+    reps_at_weight = {}
+    rows = db.execute(f'''
+        SELECT client_id, exercise_id, log_date, reps_completed, weight_used
+        FROM {source} l
+        WHERE weight_used > 0
+        ORDER BY log_date, id
+    ''')
+    for row in rows:
+        key = (row['client_id'], row['exercise_id'])
+        weight, reps = row['weight_used'], row['reps_completed'] or None
+        # Older SQLite rows may hold form strings; log_metrics normalises new ones
+        if not isinstance(weight, (int, float)) or not isinstance(reps, (int, type(None))):
+            continue
+        day = str(row['log_date'])[:10]
+        record = best.setdefault(key, {'max_weight': None, 'max_weight_date': None,
+                                       'best_e1rm': None, 'best_e1rm_date': None})
+        if record['max_weight'] is None or weight > record['max_weight']:
+            record['max_weight'], record['max_weight_date'] = weight, day
+        e1rm = estimated_1rm(weight, reps)
+        if e1rm and (record['best_e1rm'] is None or e1rm > record['best_e1rm']):
+            record['best_e1rm'], record['best_e1rm_date'] = e1rm, day
+        if reps:
+            current = reps_at_weight.get(key + (weight,))
+            if current is None or reps > current[0]:
+                reps_at_weight[key + (weight,)] = (reps, day)
+
+    if force:
+        db.execute('DELETE FROM personal_records')
+        db.execute('DELETE FROM rep_records')
+    for (client_id, exercise_id), record in best.items():
+        db.execute('''
+            INSERT INTO personal_records
+            (client_id, exercise_id, max_weight, max_weight_date, best_e1rm, best_e1rm_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (client_id, exercise_id, record['max_weight'], record['max_weight_date'],
+              record['best_e1rm'], record['best_e1rm_date']))
+    for (client_id, exercise_id, weight), (reps, day) in reps_at_weight.items():
+        db.execute('INSERT INTO rep_records (client_id, exercise_id, weight, best_reps, log_date) VALUES (?, ?, ?, ?, ?)',
+                   (client_id, exercise_id, weight, reps, day))
+    return len(best)
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+
+    if sys.argv[1:] != ['backfill']:
+        print("Usage: python3 records.py backfill")
+        sys.exit(1)
+
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        from app import PostgresDB, normalize_database_url, pg_connect
+        db = PostgresDB(pg_connect(normalize_database_url(database_url)))
+        database_path = None
+    else:
+        database_path = os.environ.get('SQLITE_DATABASE', 'trainer_dashboard.db')
+        db = sqlite3.connect(database_path)
+        db.row_factory = sqlite3.Row
+
+    try:
+        written = backfill_records(db, bool(database_url), database_path, force=True)
+        db.commit()
+        print(f"Rebuilt personal records for {written} client exercises")
+    finally:
+        db.close()
@@ -0,0 +1,115 @@
+"""
+Lazy expansion of recurring training sessions.
+
+Recurrence rules live once in the session_recurrences table and are only
+turned into concrete occurrences for the date window being displayed.
+Everything here is generator based so callers can stop (e.g. with islice)
+as soon as they have enough sessions.
+"""
+
+from datetime import date, datetime, time, timedelta
+import heapq
+import logging
+
+logger = logging.getLogger('app.recurrence')
+
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def parse_date(value):
+    """Coerce a DATE column value (date, datetime or ISO string) to a date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def parse_datetime(value):
+    """Coerce a session_date column value to a datetime"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    return datetime.fromisoformat(str(value).replace(' ', 'T')[:19])
+
+
+def parse_weekdays(value):
+    """Parse a comma-separated list of ISO weekdays (1=Mon .. 7=Sun)"""
+    days = set()
+    for part in str(value or '').split(','):
+        part = part.strip()
+        if part.isdigit() and 1 <= int(part) <= 7:
+            days.add(int(part))
+    return days
+
+
+def describe_rule(rule):
+    """Human readable summary, e.g. 'Every week on Tue, Thu at 07:00'"""
+    days = ', '.join(WEEKDAY_NAMES[d - 1] for d in sorted(parse_weekdays(rule['weekdays'])))
+    try:
+        interval = int(rule['interval_weeks'] or 1)
+    except (TypeError, ValueError):
+        return f"Invalid schedule on {days}"
+    every = 'Every week' if interval == 1 else f'Every {interval} weeks'
+    return f"{every} on {days} at {rule['start_time']}"
+
+
+def expand_rule(rule, start, end, exceptions=None):
+    """Yield occurrences of one recurrence rule between start and end (inclusive).
+
+    exceptions maps (recurrence_id, occurrence_date) to an overriding status.
+    """
+    exceptions = exceptions or {}
+    weekdays = parse_weekdays(rule['weekdays'])
+    if not weekdays:
+        return
+
+    try:
+        anchor = parse_date(rule['start_date'])
+        interval = max(int(rule['interval_weeks'] or 1), 1)
+        last = end if not rule['end_date'] else min(end, parse_date(rule['end_date']))
+        hour, minute = (int(part) for part in str(rule['start_time'])[:5].split(':'))
+        time(hour, minute)
+    except (TypeError, ValueError):
+        # One bad row must not take down every dashboard that shows it
+        logger.warning("Skipping malformed recurrence rule %s", rule['id'])
+        return
+    anchor_week = anchor - timedelta(days=anchor.isoweekday() - 1)
+
+    day = max(anchor, start)
+    while day <= last:
+        week_index = (day - anchor_week).days // 7
+        if week_index % interval == 0 and day.isoweekday() in weekdays:
+            yield {
+                'id': None,
+                'recurrence_id': rule['id'],
+                'occurrence_date': day,
+                'session_date': datetime.combine(day, time(hour, minute)),
+                'duration': rule['duration'],
+                'notes': rule['notes'],
+                'status': exceptions.get((rule['id'], day), 'scheduled'),
+                'trainer_id': rule['trainer_id'],
+                'client_id': rule['client_id'],
+                'client_name': rule['client_name'] if 'client_name' in rule.keys() else None,
+                'trainer_name': rule['trainer_name'] if 'trainer_name' in rule.keys() else None,
+            }
+        day += timedelta(days=1)
+
+
+def occurs_on(rule, day):
+    """Whether the rule has an occurrence on day (its weekdays and interval, within its start/end dates)"""
+    return next(expand_rule(rule, day, day), None) is not None
+
+
+def expand_sessions(one_offs, rules, exceptions, start, end):
+    """Merge one-off training_sessions rows with expanded recurrence rules.
+
+    one_offs must already be ordered by session_date. Returns a lazy iterator
+    in chronological order; nothing is expanded beyond what the caller consumes.
+    """
+    overrides = {(row['recurrence_id'], parse_date(row['occurrence_date'])): row['status']
+                 for row in exceptions}
+    streams = [iter(one_offs)]
+    streams.extend(expand_rule(rule, start, end, overrides) for rule in rules)
+    return heapq.merge(*streams, key=lambda s: parse_datetime(s['session_date']))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Read replica selection with lag-aware fallback to the primary.
+
+Replicas are PostgreSQL standbys (DATABASE_REPLICA_URLS) or, for local
+testing, copies of the SQLite file (SQLITE_REPLICAS). A background thread
+probes replication lag every check_interval seconds, so requests only read
+the last measurement and never wait on a slow or unreachable standby.
+Replicas lagging more than max_lag seconds (or not measured yet) are
+skipped, and when none qualify the caller falls back to the primary.
+
+Refresh SQLite replica copies with: python3 replicas.py sync
+"""
+
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+PG_LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+'''
+
+
+def split_targets(value):
+    """Parse a comma-separated list of replica URLs or paths"""
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+class ReplicaSet:
+    """Round-robin over replicas whose measured lag is within max_lag seconds"""
+
+    def __init__(self, targets, lag_probe, max_lag=2.0, check_interval=5.0):
+        self.targets = list(targets)
+        self.lag_probe = lag_probe
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lag = {}
+        self._lock = threading.Lock()
+        self._cycle = itertools.cycle(self.targets) if self.targets else None
+        self._monitor = None
+        self._stopped = threading.Event()
+
+    def __bool__(self):
+        return bool(self.targets)
+
+    def lag(self, target):
+        """Last measured replication lag in seconds (inf if unreachable or not measured yet)"""
+        with self._lock:
+            return self._lag.get(target, float('inf'))
+
+    def pick(self):
+        """Return a healthy replica target, or None to use the primary"""
+        if not self.targets:
+            return None
+        with self._lock:
+            if self._monitor is None:
+                self._start_monitor()
+            candidates = [next(self._cycle) for _ in self.targets]
+        for target in candidates:
+            if self.lag(target) <= self.max_lag:
+                return target
+        return None
+
+    def refresh(self):
+        """Probe every replica once and store the results"""
+        for target in self.targets:
+            try:
+                lag = float(self.lag_probe(target))
+            except Exception:
+                lag = float('inf')
+            with self._lock:
+                self._lag[target] = lag
+
+    def reset(self):
+        """Forget lag measurements and the monitor thread (e.g. after forking)"""
+        self._stopped.set()
+        self._lag = {}
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._stopped = threading.Event()
+
+    def _start_monitor(self):
+        self._monitor = threading.Thread(target=self._monitor_lag, args=(self._stopped,),
+                                         name='replica-lag', daemon=True)
+        self._monitor.start()
+
+    def _monitor_lag(self, stopped):
+        while not stopped.is_set():
+            self.refresh()
+            stopped.wait(self.check_interval)
+
+
+def sqlite_file_lag(primary_path):
+    """Lag probe for SQLite file copies: how far the copy's mtime trails the primary's"""
+    def probe(replica_path):
+        if not os.path.exists(replica_path):
+            return float('inf')
+        return max(0.0, os.path.getmtime(primary_path) - os.path.getmtime(replica_path))
+    return probe
+
+
+def postgres_lag(connect, connect_timeout=2):
+    """Lag probe for PostgreSQL standbys; connect(url, connect_timeout=...) returns a psycopg connection"""
+    def probe(url):
+        conn = connect(url, connect_timeout=connect_timeout)
+        try:
+            row = conn.execute(PG_LAG_QUERY).fetchone()
+            return row['lag'] if isinstance(row, dict) else row[0]
+        finally:
+            conn.close()
+    return probe
+
+
+def sync_sqlite_replicas(primary_path, replica_paths):
+    """Copy the primary SQLite database onto each replica path using the backup API"""
+    source = sqlite3.connect(primary_path)
+    try:
+        for path in replica_paths:
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] != ['sync']:
+        print("Usage: python3 replicas.py sync")
+        sys.exit(1)
+    primary = os.environ.get('SQLITE_DATABASE', 'trainer_dashboard.db')
+    replicas = split_targets(os.environ.get('SQLITE_REPLICAS'))
+    if not replicas:
+        print("SQLITE_REPLICAS is not set; nothing to sync")
+        sys.exit(1)
+    sync_sqlite_replicas(primary, replicas)
+    print(f"Copied {primary} to {', '.join(replicas)}")
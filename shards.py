@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Horizontal sharding by trainer.
+
+A trainer's data lives on exactly one shard: their clients' programs and
+exercises, workout logs (archived ones too), rollups, records, and their
+sessions. Each shard is a complete database with the full schema, so every
+query a request makes stays on that one shard.
+
+Shard 0 is the primary database (DATABASE_URL, or the SQLite file). It holds
+- shard_directory: trainer_id -> shard, plus a `moving` flag used while a
+  trainer is being moved,
+- the authoritative users and clients rows. Usernames stay unique and user
+  IDs are allocated globally. Each shard keeps mirrored copies of the rows
+  for its trainers and their clients, so joins on users stay local. A
+  client's data lives with the trainer in users.owner_trainer_id, set when
+  that trainer added them, whatever other trainers they are linked to.
+- the exercise library. It is global: names stay unique and IDs are
+  allocated here, and every shard holds a full mirror with the same IDs.
+  Library writes go to shard 0 and are copied to every shard (sync_library
+  in app.py, and /migrate refreshes whole mirrors), so every trainer sees
+  every custom exercise and library IDs never change when a trainer moves.
+
+Trainers missing from the directory live on shard 0, which is where all
+data written before sharding lives. Extra shards come from SHARD_URLS
+(PostgreSQL) or SQLITE_SHARDS (files), comma-separated. Without them there
+is a single shard and nothing changes.
+
+Trainers are moved online. Reads keep working throughout, and the trainer's
+writes get 503 for a few seconds. Rows are copied with fresh IDs on the
+target shard, so program/exercise IDs in old URLs change. The source copy is
+only deleted once the target holds the same number of rows in every table.
+
+    python3 shards.py status
+    python3 shards.py move <trainer_id> <shard>
+    python3 shards.py rebalance [--dry-run]
+"""
+
+import os
+import time
+
+from archive import archive_tables, attach_sqlite_archive, insert_archived_logs, sqlite_archive_path
+from cache import TTLCache
+
+# Clients whose data belongs to a trainer (see the module docstring)
+CLIENTS_SQL = 'SELECT id FROM users WHERE owner_trainer_id = ?'
+# The trainer and their clients
+PEOPLE_SQL = f'SELECT CAST(? AS INTEGER) UNION {CLIENTS_SQL}'
+PROGRAMS_SQL = f'SELECT id FROM programs WHERE created_by IN ({PEOPLE_SQL}) OR client_id IN ({CLIENTS_SQL})'
+RECURRENCES_SQL = 'SELECT id FROM session_recurrences WHERE trainer_id = ?'
+# Version stamps of the trainer's and clients' pages: workout logs, plus the keys of cached page fragments
+STAMP_KINDS = ('clients', 'programs', 'sessions')
+STAMPS_SQL = f'''
+    SELECT * FROM data_versions
+    WHERE name IN (SELECT 'logs:' || id FROM users WHERE owner_trainer_id = ?)
+       OR name IN (SELECT kinds.kind || ':' || people.id
+                   FROM (SELECT CAST(? AS INTEGER) as id UNION SELECT id FROM users WHERE owner_trainer_id = ?) people
+                   CROSS JOIN ({' UNION '.join(f"SELECT '{kind}' as kind" for kind in STAMP_KINDS)}) kinds)
+'''
+LIBRARY_BUMP_SQL = '''
+    INSERT INTO data_versions (name, version, updated_at) VALUES ('exercise_library', 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, updated_at = excluded.updated_at
+'''
+
+DIRECTORY_UPSERT_SQL = '''
+    INSERT INTO shard_directory (trainer_id, shard, moving, updated_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (trainer_id) DO UPDATE SET
+        shard = excluded.shard, moving = excluded.moving, updated_at = excluded.updated_at
+'''
+
+# Per-client tables keyed by (client_id, exercise_id, ...): copied with exercise_id remapped
+CLIENT_EXERCISE_TABLES = ['workout_log_daily', 'workout_log_weekly', 'personal_records', 'rep_records']
+# A trainer's rows in each table, children first (the order delete_trainer removes them in)
+TRAINER_ROWS = [
+    ('session_exceptions', f'recurrence_id IN ({RECURRENCES_SQL})'),
+    ('session_recurrences', 'trainer_id = ?'),
+    ('training_sessions', 'trainer_id = ?'),
+    ('latest_logs', f'client_id IN ({CLIENTS_SQL})'),
+] + [(table, f'client_id IN ({CLIENTS_SQL})') for table in CLIENT_EXERCISE_TABLES] + [
+    ('workout_logs', f'client_id IN ({CLIENTS_SQL})'),
+    ('exercises', f'program_id IN ({PROGRAMS_SQL})'),
+    ('programs', f'id IN ({PROGRAMS_SQL})'),
+]
+
+
+class ShardRouter:
+    """Maps trainer IDs to shard targets (database URLs or SQLite paths) via shard_directory"""
+
+    def __init__(self, targets, cache_ttl=5):
+        self.targets = targets
+        self.cache_ttl = cache_ttl
+        self._cache = TTLCache(cache_ttl)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def lookup(self, trainer_id, connect_directory):
+        """(shard, moving) for a trainer; connect_directory() is only called on a cache miss"""
+        if len(self.targets) == 1 or trainer_id is None:
+            return 0, False
+        entry = self._cache.get(trainer_id)
+        if entry is None:
+            directory = connect_directory()
+            try:
+                entry = directory_entry(directory, trainer_id)
+            finally:
+                directory.close()
+            self._cache.set(trainer_id, entry)
+        return entry
+
+    def invalidate(self, trainer_id):
+        self._cache.invalidate(trainer_id)
+
+    def reset(self):
+        self._cache.clear()
+
+
+def directory_entry(directory, trainer_id):
+    row = directory.execute('SELECT shard, moving FROM shard_directory WHERE trainer_id = ?', (trainer_id,)).fetchone()
+    return (row['shard'], bool(row['moving'])) if row else (0, False)
+
+
+def owning_trainer_id(directory, user_id, role):
+    """The trainer whose shard holds a user's data (a client's owning trainer, or the trainer themselves)"""
+    if role == 'trainer':
+        return user_id
+    row = directory.execute('SELECT owner_trainer_id FROM users WHERE id = ?', (user_id,)).fetchone()
+    return row['owner_trainer_id'] if row else None
+
+
+def _rows(db, query, params=()):
+    cursor = db.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return [{column: row[column] for column in columns} for row in cursor.fetchall()]
+
+
+def _trainer_rows(db, query, trainer_id):
+    # Every placeholder in the *_SQL fragments is the trainer ID
+    return _rows(db, query, (trainer_id,) * query.count('?'))
+
+
+def _insert(db, postgres, table, row, conflict=None, update=False):
+    """Insert a row dict; returns the new id when the row has no id column"""
+    columns = list(row)
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    if conflict:
+        if update:
+            query += f" ON CONFLICT ({conflict}) DO UPDATE SET " + ', '.join(
+                f'{column} = excluded.{column}' for column in columns if column not in conflict.split(', '))
+        else:
+            query += f' ON CONFLICT ({conflict}) DO NOTHING'
+    if 'id' in row or conflict:
+        db.execute(query, tuple(row.values()))
+        return None
+    if postgres:
+        return db.execute(query + ' RETURNING id', tuple(row.values())).fetchone()['id']
+    return db.execute(query, tuple(row.values())).lastrowid
+
+
+def _reserve_exercise_id(db, postgres):
+    """Take an unused ID from the exercises sequence without keeping a row"""
+    if postgres:
+        return db.execute("SELECT nextval(pg_get_serial_sequence('exercises', 'id')) as id").fetchone()['id']
+    # AUTOINCREMENT never hands out an ID again, even once its row is deleted
+    exercise_id = db.execute("INSERT INTO exercises (program_id, name) VALUES (0, '')").lastrowid
+    db.execute('DELETE FROM exercises WHERE id = ?', (exercise_id,))
+    return exercise_id
+
+
+def _without_id(row, **changes):
+    row = {key: value for key, value in row.items() if key != 'id'}
+    row.update(changes)
+    return row
+
+
+def mirror_accounts(source, target, user_ids):
+    """Upsert users rows and their clients links from source (shard 0) into a shard's mirror"""
+    if not user_ids:
+        return
+    placeholders = ', '.join('?' for _ in user_ids)
+    for row in _rows(source, f'SELECT * FROM users WHERE id IN ({placeholders})', tuple(user_ids)):
+        target.execute('DELETE FROM users WHERE username = ? AND id != ?', (row['username'], row['id']))
+        _insert(target, False, 'users', row, conflict='id', update=True)
+    for row in _rows(source, f'SELECT * FROM clients WHERE client_id IN ({placeholders})', tuple(user_ids)):
+        _insert(target, False, 'clients', _without_id(row), conflict='trainer_id, client_id')
+
+
+def mirror_library(source, target, library_ids=None):
+    """Upsert exercise_library rows (all, or library_ids) from source (shard 0) into a shard's mirror, IDs kept"""
+    query, params = 'SELECT * FROM exercise_library', ()
+    if library_ids is not None:
+        if not library_ids:
+            return 0
+        query += f" WHERE id IN ({', '.join('?' for _ in library_ids)})"
+        params = tuple(library_ids)
+    rows = _rows(source, query, params)
+    for row in rows:
+        target.execute('DELETE FROM exercise_library WHERE name = ? AND id != ?', (row['name'], row['id']))
+        _insert(target, False, 'exercise_library', row, conflict='id', update=True)
+    return len(rows)
+
+
+def _sqlite_path(db):
+    return next(row[2] for row in db.execute('PRAGMA database_list').fetchall() if row[1] == 'main')
+
+
+def attach_archives(source, target, postgres):
+    """Attach the SQLite archive databases a move reads and writes; run before either connection writes"""
+    if postgres:
+        return
+    source_archive = os.path.exists(sqlite_archive_path(_sqlite_path(source)))
+    if source_archive:
+        attach_sqlite_archive(source, _sqlite_path(source))
+    # The target's archive is created when there are archived logs to copy into it
+    if source_archive or os.path.exists(sqlite_archive_path(_sqlite_path(target))):
+        attach_sqlite_archive(target, _sqlite_path(target))
+
+
+def trainer_counts(db, postgres, trainer_id):
+    """Rows per table that belong to a trainer, archived logs included (accounts and stamps are not counted)"""
+    counts = {}
+    for table, condition in TRAINER_ROWS:
+        query = f'SELECT COUNT(*) as count FROM {table} WHERE {condition}'
+        counts[table] = _trainer_rows(db, query, trainer_id)[0]['count']
+    counts['workout_logs_archive'] = sum(
+        _trainer_rows(db, f'SELECT COUNT(*) as count FROM {table} WHERE client_id IN ({CLIENTS_SQL})',
+                      trainer_id)[0]['count']
+        for table in archive_tables(db, postgres))
+    return counts
+
+
+def copy_trainer(source, target, postgres, trainer_id):
+    """Copy one trainer's rows from source to target with new IDs; returns rows copied per table"""
+    counts = {}
+    people = [row['id'] for row in _trainer_rows(source, f'SELECT id FROM users WHERE id IN ({PEOPLE_SQL})', trainer_id)]
+    mirror_accounts(source, target, people)
+    counts['users'] = len(people)
+
+    # Library IDs are global, so exercises keep theirs. The target's mirror normally has every entry already;
+    # refresh the ones the trainer's programs use in case it missed a write
+    library_ids = [row['exercise_library_id'] for row in _trainer_rows(source, f'''
+            SELECT DISTINCT exercise_library_id FROM exercises
+            WHERE program_id IN ({PROGRAMS_SQL}) AND exercise_library_id IS NOT NULL''', trainer_id)]
+    counts['exercise_library'] = mirror_library(source, target, library_ids)
+    if library_ids:
+        # Library pages and facet indexes on the target shard are versioned by this stamp
+        target.execute(LIBRARY_BUMP_SQL)
+
+    program_ids = {}
+    programs = _trainer_rows(source, f'SELECT * FROM programs WHERE id IN ({PROGRAMS_SQL}) ORDER BY id', trainer_id)
+    for row in programs:
+        # Template links are restored below, once every program has its new ID
+        unlinked = {'source_program_id': None} if 'source_program_id' in row else {}
+        program_ids[row['id']] = _insert(target, postgres, 'programs', _without_id(row, **unlinked))
+    for row in programs:
+        if row.get('source_program_id') in program_ids:
+            target.execute('UPDATE programs SET source_program_id = ? WHERE id = ?',
+                           (program_ids[row['source_program_id']], program_ids[row['id']]))
+    counts['programs'] = len(program_ids)
+
+    exercise_ids = {}
+    for row in _trainer_rows(source, f'SELECT * FROM exercises WHERE program_id IN ({PROGRAMS_SQL}) ORDER BY id', trainer_id):
+        exercise_ids[row['id']] = _insert(target, postgres, 'exercises', _without_id(
+            row, program_id=program_ids[row['program_id']]))
+    counts['exercises'] = len(exercise_ids)
+
+    # Logs, rollups and records can name exercises since removed from their program (edit_program replaces
+    # a program's exercises). They get an ID no target exercise will ever have, so their history moves too
+    def exercise_id(row):
+        if row['exercise_id'] not in exercise_ids:
+            exercise_ids[row['exercise_id']] = _reserve_exercise_id(target, postgres)
+        return exercise_ids[row['exercise_id']]
+
+    log_ids = {}
+    for row in _trainer_rows(source, f'SELECT * FROM workout_logs WHERE client_id IN ({CLIENTS_SQL}) ORDER BY id', trainer_id):
+        log_ids[row['id']] = _insert(target, postgres, 'workout_logs', _without_id(row, exercise_id=exercise_id(row)))
+    counts['workout_logs'] = len(log_ids)
+
+    archived = []
+    for table in archive_tables(source, postgres):
+        archived += _trainer_rows(source, f'SELECT * FROM {table} WHERE client_id IN ({CLIENTS_SQL})', trainer_id)
+    insert_archived_logs(target, postgres, [dict(row, exercise_id=exercise_id(row)) for row in archived])
+    counts['workout_logs_archive'] = len(archived)
+
+    for table in CLIENT_EXERCISE_TABLES:
+        rows = _trainer_rows(source, f'SELECT * FROM {table} WHERE client_id IN ({CLIENTS_SQL})', trainer_id)
+        for row in rows:
+            _insert(target, postgres, table, dict(row, exercise_id=exercise_id(row)))
+        counts[table] = len(rows)
+    for row in _trainer_rows(source, f'SELECT * FROM latest_logs WHERE client_id IN ({CLIENTS_SQL})', trainer_id):
+        _insert(target, postgres, 'latest_logs', dict(row, exercise_id=exercise_id(row), log_id=log_ids[row['log_id']]))
+
+    sessions = _trainer_rows(source, 'SELECT * FROM training_sessions WHERE trainer_id = ?', trainer_id)
+    for row in sessions:
+        _insert(target, postgres, 'training_sessions', _without_id(row))
+    counts['training_sessions'] = len(sessions)
+
+    recurrence_ids = {}
+    for row in _trainer_rows(source, 'SELECT * FROM session_recurrences WHERE trainer_id = ? ORDER BY id', trainer_id):
+        recurrence_ids[row['id']] = _insert(target, postgres, 'session_recurrences', _without_id(row))
+    for row in _trainer_rows(source, f'SELECT * FROM session_exceptions WHERE recurrence_id IN ({RECURRENCES_SQL})', trainer_id):
+        _insert(target, postgres, 'session_exceptions', _without_id(row, recurrence_id=recurrence_ids[row['recurrence_id']]))
+    counts['session_recurrences'] = len(recurrence_ids)
+
+    # Version stamps move one step ahead, so pages and fragments cached before the move (with old IDs) never match
+    stamps = {row['name']: row for row in _trainer_rows(source, STAMPS_SQL, trainer_id)}
+    names = set(stamps) | {f'{kind}:{person}' for kind in STAMP_KINDS for person in people}
+    for name in sorted(names):
+        row = stamps.get(name, {'name': name, 'version': 0, 'updated_at': None})
+        _insert(target, postgres, 'data_versions', dict(row, version=row['version'] + 1), conflict='name', update=True)
+    return counts
+
+
+def delete_trainer(db, postgres, trainer_id, keep_accounts=False, expected=None):
+    """Delete one trainer's rows (users/clients too unless keep_accounts, as on shard 0).
+
+    expected is trainer_counts() of the copy; if db holds rows the copy does not, nothing is deleted.
+    SQLite archives must be attached first (attach_archives).
+    """
+    if expected is not None:
+        counts = trainer_counts(db, postgres, trainer_id)
+        if counts != expected:
+            missing = {table: (count, expected.get(table)) for table, count in counts.items()
+                       if count != expected.get(table)}
+            raise RuntimeError(f"Trainer {trainer_id}: copy is incomplete, not deleting (rows here vs copied: {missing})")
+
+    deletes = [f'DELETE FROM data_versions WHERE name IN (SELECT name FROM ({STAMPS_SQL}) stamps)']
+    deletes += [f'DELETE FROM {table} WHERE client_id IN ({CLIENTS_SQL})' for table in archive_tables(db, postgres)]
+    deletes += [f'DELETE FROM {table} WHERE {condition}' for table, condition in TRAINER_ROWS]
+    if not keep_accounts:
+        deletes += [
+            f'DELETE FROM users WHERE id IN ({PEOPLE_SQL})',
+            'DELETE FROM clients WHERE trainer_id = ?',
+        ]
+    for query in deletes:
+        db.execute(query, (trainer_id,) * query.count('?'))
+
+
+def move_trainer(directory, source, target, postgres, trainer_id, from_shard, to_shard, settle=0, log=print,
+                 notify=None):
+    """Move a trainer between shards while the app keeps serving their reads.
+
+    settle is how long app workers may keep using a cached directory entry
+    (their cache TTL); each directory change waits that long to take effect.
+    notify(directory, trainer_id), if given, runs before each directory commit
+    to tell workers to drop their cached entry sooner.
+    """
+    def set_entry(shard, moving):
+        directory.execute(DIRECTORY_UPSERT_SQL, (trainer_id, shard, moving))
+        if notify:
+            notify(directory, trainer_id)
+        directory.commit()
+
+    attach_archives(source, target, postgres)
+    set_entry(from_shard, True)
+    log(f"Trainer {trainer_id}: writes paused, waiting {settle}s for workers to notice")
+    time.sleep(settle)
+
+    # Clear leftovers from an interrupted earlier attempt, then copy
+    try:
+        delete_trainer(target, postgres, trainer_id, keep_accounts=to_shard == 0)
+        counts = copy_trainer(source, target, postgres, trainer_id)
+        target.commit()
+        copied = trainer_counts(target, postgres, trainer_id)
+        if copied != trainer_counts(source, postgres, trainer_id):
+            raise RuntimeError(f"Trainer {trainer_id}: copy to shard {to_shard} is incomplete ({copied})")
+    except Exception:
+        # Everything is still on the source: resume writes there and leave the copy for the next attempt to clear
+        target.rollback()
+        set_entry(from_shard, False)
+        raise
+    log(f"Trainer {trainer_id}: copied {counts}")
+
+    set_entry(to_shard, True)
+    log(f"Trainer {trainer_id}: reads switched to shard {to_shard}, waiting {settle}s")
+    time.sleep(settle)
+
+    set_entry(to_shard, False)
+    delete_trainer(source, postgres, trainer_id, keep_accounts=from_shard == 0, expected=copied)
+    source.commit()
+    log(f"Trainer {trainer_id}: writes resumed on shard {to_shard}; removed from shard {from_shard}")
+    return counts
+
+
+def shard_loads(directory, shard_count):
+    """{trainer_id: (shard, weight)} with weight = 1 + number of clients"""
+    placement = {row['trainer_id']: row['shard'] for row in directory.execute(
+        'SELECT trainer_id, shard FROM shard_directory').fetchall()}
+    rows = directory.execute('''
+        SELECT u.id, COUNT(c.id) as clients
+        FROM users u
+        LEFT JOIN users c ON c.owner_trainer_id = u.id
+        WHERE u.role = 'trainer'
+        GROUP BY u.id
+    ''').fetchall()
+    return {row['id']: (min(placement.get(row['id'], 0), shard_count - 1), 1 + row['clients']) for row in rows}
+
+
+def plan_rebalance(trainers, shard_count):
+    """Greedy moves [(trainer_id, from, to)] that even out total weight across shards"""
+    loads = [0] * shard_count
+    placement = {}
+    for trainer_id, (shard, weight) in trainers.items():
+        loads[shard] += weight
+        placement[trainer_id] = shard
+
+    moves = []
+    while True:
+        heaviest = max(range(shard_count), key=lambda s: loads[s])
+        lightest = min(range(shard_count), key=lambda s: loads[s])
+        gap = loads[heaviest] - loads[lightest]
+        # Largest trainer whose move still narrows the gap
+        candidates = [(weight, trainer_id) for trainer_id, (_, weight) in trainers.items()
+                      if placement[trainer_id] == heaviest and weight < gap]
+        if not candidates:
+            return moves
+        weight, trainer_id = max(candidates)
+        placement[trainer_id] = lightest
+        loads[heaviest] -= weight
+        loads[lightest] += weight
+        moves.append((trainer_id, heaviest, lightest))
+
+
+if __name__ == '__main__':
+    import sys
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ('status', 'move', 'rebalance') or (args[0] == 'move' and len(args) != 3):
+        print("Usage: python3 shards.py status | move <trainer_id> <shard> | rebalance [--dry-run]")
+        sys.exit(1)
+
+    import app
+    router = app.shard_router
+    settle = router.cache_ttl + 1
+    directory = app.get_db(readonly=False, shard=0)
+
+    try:
+        trainers = shard_loads(directory, len(router))
+        if args[0] == 'status':
+            for shard in range(len(router)):
+                hosted = [t for t, (s, _) in trainers.items() if s == shard]
+                print(f"Shard {shard}: {len(hosted)} trainers, load {sum(trainers[t][1] for t in hosted)}")
+            sys.exit(0)
+
+        if args[0] == 'move':
+            trainer_id, to_shard = int(args[1]), int(args[2])
+            if trainer_id not in trainers or not 0 <= to_shard < len(router):
+                print("Unknown trainer or shard")
+                sys.exit(1)
+            moves = [(trainer_id, trainers[trainer_id][0], to_shard)]
+        else:
+            moves = plan_rebalance(trainers, len(router))
+            for trainer_id, from_shard, to_shard in moves:
+                print(f"Trainer {trainer_id}: shard {from_shard} -> {to_shard}")
+            if not moves:
+                print("Shards are balanced")
+            if '--dry-run' in args:
+                sys.exit(0)
+
+        for trainer_id, from_shard, to_shard in moves:
+            if from_shard == to_shard:
+                continue
+            source = app.get_db(readonly=False, shard=from_shard)
+            target = app.get_db(readonly=False, shard=to_shard)
+            try:
+                move_trainer(directory, source, target, app.USE_POSTGRES, trainer_id, from_shard, to_shard, settle,
+                             notify=lambda db, key: app.invalidation_bus.broadcast(db, 'shard_directory', key))
+            finally:
+                source.close()
+                target.close()
+    finally:
+        directory.close()
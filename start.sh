@@ -1,5 +1,5 @@
 #!/bin/bash
-cd /home/user/trainer-client-dashboard
+cd "$(dirname "$0")"
 echo "========================================="
 echo "Starting Trainer-Client Dashboard"
 echo "========================================="
@@ -16,4 +16,5 @@ echo ""
 echo "Press CTRL+C to stop the server"
 echo "========================================="
 echo ""
-python3 app.py
+# Production server; settings in gunicorn.conf.py (use `python3 app.py` for the Flask dev server)
+exec gunicorn
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Cold-start helpers: persistent Jinja bytecode cache, template precompilation
+and a startup-time report.
+
+Jinja compiles every template to Python the first time a process renders
+it. With a FileSystemBytecodeCache the compiled code is stored on disk, so
+later processes only unmarshal it. Fill the cache once per deploy (e.g. in
+the Render build command) with: python3 startup.py precompile
+
+Measure where startup time goes with: python3 startup.py report
+"""
+
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+DEFAULT_CACHE_DIR = '.jinja_cache'
+
+
+def enable_bytecode_cache(app, directory=None):
+    """Store compiled templates under directory (JINJA_CACHE_DIR); returns it, or None if not writable"""
+    directory = directory or os.environ.get('JINJA_CACHE_DIR') or os.path.join(app.root_path, DEFAULT_CACHE_DIR)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        # Read-only filesystem: templates are compiled in memory, as before
+        return None
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    return directory
+
+
+def template_names(app):
+    return sorted(name for name in app.jinja_env.list_templates() if name.endswith('.html'))
+
+
+def precompile_templates(app, env=None):
+    """Load every template into env (default: the app's), compiling it if not cached; returns the count"""
+    env = env or app.jinja_env
+    names = template_names(app)
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+class StartupTimer:
+    """Milliseconds spent in each startup phase, measured from a perf_counter() start"""
+
+    def __init__(self, started):
+        self.started = started
+        self.phases = {}
+        self._last = started
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self._last) * 1000, 1)
+        self._last = now
+
+    @property
+    def total_ms(self):
+        return round((self._last - self.started) * 1000, 1)
+
+
+def _timed(f):
+    started = time.perf_counter()
+    result = f()
+    return result, round((time.perf_counter() - started) * 1000, 1)
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1:]
+    if command not in (['precompile'], ['report']):
+        print("Usage: python3 startup.py precompile | report")
+        sys.exit(1)
+
+    # Keep the report readable: the app's own startup log line is JSON
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['WARMUP'] = '0'
+    started = time.perf_counter()
+    import app as appmodule
+    imported = time.perf_counter()
+
+    app = appmodule.app
+    if command == ['precompile']:
+        directory = enable_bytecode_cache(app)
+        if directory is None:
+            print("Template cache directory is not writable; nothing to do")
+            sys.exit(1)
+        count, elapsed = _timed(lambda: precompile_templates(app))
+        print(f"Compiled {count} templates into {directory} in {elapsed} ms")
+        sys.exit(0)
+
+    _, create_ms = _timed(appmodule.create_app)
+    # cache_size=0 disables the in-memory cache, so every load hits the compiler or the bytecode cache
+    count, cold_ms = _timed(lambda: precompile_templates(app, app.jinja_env.overlay(cache_size=0, bytecode_cache=None)))
+    cached_ms = None
+    if app.jinja_env.bytecode_cache is not None:
+        precompile_templates(app, app.jinja_env.overlay(cache_size=0))
+        _, cached_ms = _timed(lambda: precompile_templates(app, app.jinja_env.overlay(cache_size=0)))
+    _, numpy_ms = _timed(appmodule.adherence_engine)
+
+    rows = [('import app', round((imported - started) * 1000, 1)),
+            ('create_app()', create_ms),
+            (f'compile {count} templates', cold_ms)]
+    if cached_ms is not None:
+        rows.append((f'load {count} templates from bytecode cache', cached_ms))
+    rows.append(('first adherence use (imports numpy)', numpy_ms))
+
+    width = max(len(label) for label, _ in rows)
+    print("Startup time report")
+    for label, ms in rows:
+        print(f"  {label:<{width}}  {ms:>8.1f} ms")
+    appmodule.structured_logging.stop_listener()
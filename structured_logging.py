@@ -0,0 +1,200 @@
+"""
+Structured JSON logging that stays off the request path.
+
+Request threads only put records on an in-memory queue (QueueHandler);
+a QueueListener thread formats them as one JSON object per line and writes
+them to stdout. Every record carries the request ID of the request that
+produced it.
+
+Configuration (environment):
+- LOG_LEVEL:    root level, default INFO
+- LOG_LEVELS:   per-logger levels, e.g. "werkzeug=WARNING,app.access=INFO"
+- LOG_SAMPLING: keep only a fraction of a logger's sub-WARNING records,
+                e.g. "app.access=0.1"; sampling is per request, so a
+                request's records are kept or dropped together
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request, session
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Attributes every LogRecord has; anything else was passed via extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_listener = None
+
+
+def parse_mapping(value, cast=str):
+    """Parse "name=value,name=value" into a dict"""
+    mapping = {}
+    for part in (value or '').split(','):
+        name, sep, setting = part.partition('=')
+        if sep and name.strip():
+            mapping[name.strip()] = cast(setting.strip())
+    return mapping
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request's ID (runs in the caller's thread, before queueing)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of sub-WARNING records for the configured loggers"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1:
+            return True
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            # Same decision for every record of a request
+            return zlib.crc32(request_id.encode()) % 10000 < rate * 10000
+        return random.random() < rate
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return None
+
+
+class _LocalQueueHandler(QueueHandler):
+    """Hand records to the listener unformatted; only resolve msg % args here.
+
+    The stock prepare() formats the whole record (including tracebacks) in
+    the calling thread, which is the work we want off the request path.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start_listener():
+    """(Re)start the background writer, e.g. in each forked worker"""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+    root = logging.getLogger()
+    queue_handler = next(h for h in root.handlers if isinstance(h, _LocalQueueHandler))
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _listener = QueueListener(queue_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def restart_after_fork():
+    """Give a forked child its own queue and writer thread.
+
+    The parent's listener thread does not exist in the child, and records it
+    still had queued would otherwise be written twice.
+    """
+    global _listener
+    queue_handler = next((h for h in logging.getLogger().handlers if isinstance(h, _LocalQueueHandler)), None)
+    if queue_handler is None:
+        return
+    _listener = None
+    queue_handler.queue = queue.SimpleQueue()
+    start_listener()
+
+
+def stop_listener():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(level=None, levels=None, sampling=None):
+    """Route all logging through a queue to a JSON stdout writer"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _LocalQueueHandler):
+            root.removeHandler(handler)
+
+    queue_handler = _LocalQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(parse_mapping(
+        sampling if sampling is not None else os.environ.get('LOG_SAMPLING'), float)))
+    root.addHandler(queue_handler)
+    root.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+    for name, logger_level in parse_mapping(levels if levels is not None else os.environ.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(logger_level.upper())
+
+    start_listener()
+    atexit.register(stop_listener)
+
+
+def init_request_logging(app, access_logger='app.access'):
+    """Assign each request an ID (honouring X-Request-ID) and log one access record per request"""
+    access_log = logging.getLogger(access_logger)
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+        if access_log.isEnabledFor(logging.INFO):
+            access_log.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 1),
+                'user_id': session.get('user_id'),
+            })
+        return response
@@ -0,0 +1,280 @@
+"""
+Exercise substitutions: for every library exercise, the k most similar others.
+
+Similarity is a weighted Jaccard index over an exercise's features (its
+category, equipment, muscle groups and name words, e.g. "rdl" links
+Landmine RDL and Single Leg RDL), blended with how often two exercises
+appear in the same program (cosine over program counts). Only exercises
+sharing a category, muscle group or name word are compared, using the
+facet index's bitsets (see facets.py) to find them.
+
+The neighbour lists are precomputed, so a lookup is a dict access. They are
+refreshed incrementally:
+- when the facet index moves to a new library version, only exercises whose
+  name or facet values changed are re-ranked, and offered to the lists of
+  exercises they are now similar to;
+- every refresh_after seconds, programs stamped since the last read (see
+  sync.record_program) are re-read and the exercises whose usage changed
+  are re-ranked the same way.
+Deleted programs are only forgotten by the full rebuild every rebuild_after
+seconds.
+"""
+
+import heapq
+import math
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Feature weights: equipment counts less, since a substitute is often needed because equipment is missing
+FEATURE_WEIGHTS = {'category': 1.0, 'muscle': 1.0, 'name': 1.0, 'equipment': 0.5}
+# Share of the score from features; the rest comes from program co-occurrence
+SIMILARITY_SHARE = 0.8
+# Programs are re-read this far before the last read, to catch slow transactions committed since
+USAGE_OVERLAP = timedelta(seconds=60)
+
+# Each program's exercises, matched to the library by ID or, for typed-in exercises, by name
+PROGRAM_EXERCISES_SQL = '''
+    SELECT p.id as program_id, COALESCE(e.exercise_library_id, l.id) as exercise_id
+    FROM programs p
+    LEFT JOIN exercises e ON e.program_id = p.id
+    LEFT JOIN exercise_library l ON l.name = e.name
+'''
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def name_tokens(name):
+    """Words of an exercise name worth matching on ('Single-Leg RDL' -> {'single', 'leg', 'rdl'})"""
+    return {word for word in _WORD.findall((name or '').lower()) if len(word) > 1}
+
+
+def exercise_features(row):
+    """{feature: weight} for a FacetIndex row"""
+    features = {}
+    for facet, values in row['facets'].items():
+        for value in values:
+            features[(facet, value)] = FEATURE_WEIGHTS[facet]
+    for token in name_tokens(row['name']):
+        features[('name', token)] = FEATURE_WEIGHTS['name']
+    return features
+
+
+def weighted_jaccard(a, b):
+    shared = sum(weight for feature, weight in a.items() if feature in b)
+    if not shared:
+        return 0.0
+    return shared / (sum(a.values()) + sum(b.values()) - shared)
+
+
+def _iter_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _rank_key(entry):
+    # Highest score first, then the lower ID, so ties are stable
+    score, exercise_id = entry
+    return score, -exercise_id
+
+
+def _add(counts, key, delta):
+    # Zero counts are dropped so the dicts only hold live exercises and pairs
+    count = counts.get(key, 0) + delta
+    if count:
+        counts[key] = count
+    else:
+        del counts[key]
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ProgramUsage:
+    """Library exercises per program, with how many programs use each exercise and each pair"""
+
+    def __init__(self):
+        self.programs = {}
+        self.uses = {}
+        self.pairs = {}
+        self.read_at = _utc_now()
+
+    @classmethod
+    def load(cls, fetch):
+        usage = cls()
+        usage._apply(fetch(PROGRAM_EXERCISES_SQL, ()))
+        return usage
+
+    def refresh(self, fetch):
+        """Re-read programs stamped since the last read; returns the exercises whose usage changed"""
+        since = (self.read_at - USAGE_OVERLAP).isoformat(' ')
+        self.read_at = _utc_now()
+        return self._apply(fetch(PROGRAM_EXERCISES_SQL + ' WHERE p.updated_at >= ?', (since,)))
+
+    def cooccurrence(self, a, b):
+        together = self.pairs.get((a, b) if a < b else (b, a))
+        if not together:
+            return 0.0
+        return together / math.sqrt(self.uses[a] * self.uses[b])
+
+    def _apply(self, rows):
+        programs = {}
+        for row in rows:
+            exercises = programs.setdefault(row['program_id'], set())
+            if row['exercise_id'] is not None:
+                exercises.add(row['exercise_id'])
+        changed = set()
+        for program_id, exercise_ids in programs.items():
+            changed |= self._set_program(program_id, frozenset(exercise_ids))
+        return changed
+
+    def _set_program(self, program_id, exercise_ids):
+        old = self.programs.get(program_id, frozenset())
+        if old == exercise_ids:
+            return set()
+        self._count(old, -1)
+        self._count(exercise_ids, 1)
+        self.programs[program_id] = exercise_ids
+        # Every pair score of an exercise depends on its use count, so all of them moved
+        return set(old | exercise_ids)
+
+    def _count(self, exercise_ids, delta):
+        ordered = sorted(exercise_ids)
+        for i, a in enumerate(ordered):
+            _add(self.uses, a, delta)
+            for b in ordered[i + 1:]:
+                _add(self.pairs, (a, b), delta)
+
+
+class SubstituteTable:
+    """Top-k substitutes of every exercise in a FacetIndex"""
+
+    def __init__(self, index, usage, k):
+        self.index = index
+        self.usage = usage
+        self.k = k
+        self.features = {}
+        self.tokens = {}
+        self.neighbours = {}
+        for exercise_id, row in index.rows.items():
+            self._add_features(exercise_id, row)
+        for exercise_id in index.rows:
+            self.neighbours[exercise_id] = self._rank(exercise_id)
+        self.built_at = self.refreshed_at = time.monotonic()
+
+    def lookup(self, exercise_id):
+        """[(score, exercise ID)], best first; empty for unknown exercises"""
+        return self.neighbours.get(exercise_id, [])
+
+    def score(self, a, b):
+        similarity = weighted_jaccard(self.features[a], self.features[b])
+        if not similarity:
+            return 0.0
+        return SIMILARITY_SHARE * similarity + (1 - SIMILARITY_SHARE) * self.usage.cooccurrence(a, b)
+
+    def update(self, index, changed):
+        """Move to index and re-rank after the features or usage of the changed exercises moved"""
+        for exercise_id in changed:
+            self._remove_features(exercise_id)
+            self.neighbours.pop(exercise_id, None)
+        self.index = index
+        present = [exercise_id for exercise_id in changed if exercise_id in index.rows]
+        for exercise_id in present:
+            self._add_features(exercise_id, index.rows[exercise_id])
+
+        # Lists holding a changed exercise may need what was ranked k+1, so rank them again
+        stale = {exercise_id for exercise_id, entries in self.neighbours.items()
+                 if any(neighbour in changed for _, neighbour in entries)}
+        for exercise_id in stale | set(present):
+            self.neighbours[exercise_id] = self._rank(exercise_id)
+
+        # Everyone else only needs the changed exercises offered to their lists
+        for a in present:
+            for b in self._candidates(a) - stale - set(changed):
+                score = self.score(b, a)
+                entries = self.neighbours[b]
+                if score > 0 and (len(entries) < self.k or _rank_key((score, a)) > _rank_key(entries[-1])):
+                    self.neighbours[b] = sorted(entries + [(score, a)], key=_rank_key, reverse=True)[:self.k]
+
+    def _candidates(self, exercise_id):
+        """Exercises sharing a category, muscle group or name word"""
+        row = self.index.rows[exercise_id]
+        bits = 0
+        for facet in ('category', 'muscle'):
+            postings = self.index.postings[facet]
+            for value in row['facets'][facet]:
+                bits |= postings.get(value, 0)
+        candidates = set(_iter_bits(bits))
+        for token in name_tokens(row['name']):
+            candidates |= self.tokens.get(token, set())
+        candidates.discard(exercise_id)
+        return candidates
+
+    def _rank(self, exercise_id):
+        scored = ((self.score(exercise_id, other), other) for other in self._candidates(exercise_id))
+        return heapq.nlargest(self.k, (entry for entry in scored if entry[0] > 0), key=_rank_key)
+
+    def _add_features(self, exercise_id, row):
+        self.features[exercise_id] = exercise_features(row)
+        for token in name_tokens(row['name']):
+            self.tokens.setdefault(token, set()).add(exercise_id)
+
+    def _remove_features(self, exercise_id):
+        features = self.features.pop(exercise_id, {})
+        for kind, token in features:
+            if kind == 'name':
+                exercise_ids = self.tokens.get(token)
+                exercise_ids.discard(exercise_id)
+                if not exercise_ids:
+                    del self.tokens[token]
+
+
+def _signature(row):
+    return (row['name'], row['facets']) if row else None
+
+
+def library_changes(old, new):
+    """IDs of exercises added, removed, renamed or with different facet values between two FacetIndexes"""
+    return {exercise_id for exercise_id in old.rows.keys() | new.rows.keys()
+            if _signature(old.rows.get(exercise_id)) != _signature(new.rows.get(exercise_id))}
+
+
+class SubstitutionEngine:
+    """Per-shard SubstituteTable, kept in step with the facet index and program usage"""
+
+    def __init__(self, k=10, refresh_after=60, rebuild_after=3600):
+        self.k = k
+        self.refresh_after = refresh_after
+        self.rebuild_after = rebuild_after
+        self.reset()
+
+    def table(self, shard, index, fetch):
+        """The table for shard matching index; fetch(query, params) runs a read on that shard"""
+        table = self._tables.get(shard)
+        if table is not None and table.index is index and not self._due(table):
+            return table
+        with self._lock:
+            table = self._tables.get(shard)
+            now = time.monotonic()
+            if table is None or now - table.built_at > self.rebuild_after:
+                table = SubstituteTable(index, ProgramUsage.load(fetch), self.k)
+            elif table.index is not index or self._due(table):
+                changed = library_changes(table.index, index) if table.index is not index else set()
+                if self._due(table):
+                    changed |= table.usage.refresh(fetch)
+                    table.refreshed_at = now
+                table.update(index, changed)
+            self._tables[shard] = table
+        return table
+
+    def reset(self):
+        """Drop tables inherited from a parent process (call after fork)"""
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def _due(self, table):
+        return time.monotonic() - table.refreshed_at > self.refresh_after
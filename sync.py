@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Delta sync for mobile and offline clients.
+
+Every write to programs, exercises, training_sessions or exercise_library
+stamps the row (updated_at, version) and appends change_feed rows, one per
+audience: the client a row belongs to, their trainer, or 0 for rows every
+user sees (the exercise library). GET /api/sync?since=<cursor> reads the
+caller's feed entries after the cursor with an index range scan on
+(audience, tx, id), then returns the current version of each changed row or
+the ID of each deleted one.
+
+Feed entries are read in (tx, id) order, where tx is the writing
+transaction's ID on PostgreSQL and 0 on SQLite. PostgreSQL hands out feed IDs
+before commit, so a long transaction can commit IDs lower than ones a reader
+has already passed. A reader therefore only reads entries whose tx is below
+its snapshot's xmin: every transaction older than that has finished, and any
+transaction still to commit has a higher tx, so it sorts after every cursor
+handed out so far. SQLite runs one writer at a time, so IDs commit in order.
+
+A cursor is "<shard>:<tx>:<feed id>" ("<shard>:<feed id>" from before tx
+existed reads as tx 0). With no cursor, a cursor from another shard (the
+trainer was moved) or one older than the pruned part of the feed, the
+endpoint returns a full snapshot and a fresh cursor instead.
+
+Drop feed entries older than SYNC_RETENTION_DAYS (default 30) with: python3 sync.py prune
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+SYNC_RETENTION_DAYS = int(os.environ.get('SYNC_RETENTION_DAYS', 30))
+
+# Columns returned for each synced table
+SYNC_COLUMNS = {
+    'programs': 'id, client_id, name, description, is_template, template_name, created_at, updated_at, version',
+    'exercises': ('id, program_id, exercise_library_id, name, sets, reps, weight, notes, exercise_order, '
+                  'tempo, rest_period, updated_at, version'),
+    'training_sessions': 'id, trainer_id, client_id, session_date, duration, notes, status, updated_at, version',
+    'exercise_library': ('id, name, category, equipment, description, instructions, demo_url, muscle_groups, '
+                         'is_custom, updated_at, version'),
+}
+
+# Everything a user can see: their own rows and their clients' (both parameters are the user's ID)
+PROGRAM_SCOPE_SQL = 'client_id = ? OR client_id IN (SELECT client_id FROM clients WHERE trainer_id = ?)'
+SNAPSHOT_SQL = {
+    'programs': f"SELECT {SYNC_COLUMNS['programs']} FROM programs WHERE {PROGRAM_SCOPE_SQL}",
+    'exercises': (f"SELECT {SYNC_COLUMNS['exercises']} FROM exercises "
+                  f"WHERE program_id IN (SELECT id FROM programs WHERE {PROGRAM_SCOPE_SQL})"),
+    'training_sessions': (f"SELECT {SYNC_COLUMNS['training_sessions']} FROM training_sessions "
+                          f"WHERE client_id = ? OR trainer_id = ?"),
+    'exercise_library': f"SELECT {SYNC_COLUMNS['exercise_library']} FROM exercise_library",
+}
+
+FEED_INSERT_SQL = 'INSERT INTO change_feed (audience, table_name, row_id, deleted, changed_at) VALUES (?, ?, ?, ?, ?)'
+# Run by /migrate on PostgreSQL: feed rows record their writer's transaction ID (SQLite keeps the default 0)
+POSTGRES_FEED_TX_SQL = 'ALTER TABLE change_feed ALTER COLUMN tx SET DEFAULT pg_current_xact_id()::text::bigint'
+# Transactions below this ID have all finished (committed or rolled back)
+POSTGRES_XMIN_SQL = 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint as xmin'
+FEED_PAGE_SQL = '''
+    SELECT id, tx, table_name, row_id, deleted FROM change_feed
+    WHERE audience IN (?, 0) AND (tx > ? OR (tx = ? AND id > ?)) AND tx < ?
+    ORDER BY tx, id
+    LIMIT ?
+'''
+FEED_HEAD_SQL = 'SELECT tx, id FROM change_feed WHERE tx < ? ORDER BY tx DESC, id DESC LIMIT 1'
+# Position (tx, id) of the last feed entry removed by prune_feed; older cursors must resync
+PRUNED_SQL = "SELECT name, version FROM data_versions WHERE name IN ('change_feed_pruned', 'change_feed_pruned_tx')"
+PRUNED_UPSERT_SQL = '''
+    INSERT INTO data_versions (name, version, updated_at)
+    VALUES (?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at
+'''
+
+
+def stamp_sql(table, count):
+    """UPDATE that bumps updated_at and version of count rows of table"""
+    placeholders = ', '.join('?' for _ in range(count))
+    return f'UPDATE {table} SET updated_at = ?, version = COALESCE(version, 0) + 1 WHERE id IN ({placeholders})'
+
+
+def record_changes(db, table, row_ids, audiences, now, deleted=False):
+    """Stamp changed rows and append their change_feed entries, inside the caller's transaction"""
+    row_ids = list(row_ids)
+    if not row_ids:
+        return
+    if not deleted:
+        db.execute(stamp_sql(table, len(row_ids)), [now] + row_ids)
+    record_feed(db, table, row_ids, audiences, now, deleted)
+
+
+def record_feed(db, table, row_ids, audiences, now, deleted=False):
+    """Append change_feed entries for rows stamped elsewhere (e.g. library rows mirrored from shard 0)"""
+    for audience in sorted(set(audiences)):
+        for row_id in row_ids:
+            db.execute(FEED_INSERT_SQL, (audience, table, row_id, deleted, now))
+
+
+def program_audiences(db, owner_id):
+    """Users who see a program: its owner (a client, or the trainer for templates) and the owner's trainers"""
+    trainers = db.execute('SELECT trainer_id FROM clients WHERE client_id = ?', (owner_id,)).fetchall()
+    return {owner_id} | {row['trainer_id'] for row in trainers}
+
+
+def record_program(db, program_id, audiences, now, removed_exercise_ids=()):
+    """Record a program and all of its current exercises as changed"""
+    record_changes(db, 'programs', [program_id], audiences, now)
+    exercise_ids = [row['id'] for row in db.execute(
+        'SELECT id FROM exercises WHERE program_id = ?', (program_id,)).fetchall()]
+    record_changes(db, 'exercises', [i for i in removed_exercise_ids if i not in exercise_ids],
+                   audiences, now, deleted=True)
+    record_changes(db, 'exercises', exercise_ids, audiences, now)
+
+
+def format_cursor(shard, position):
+    tx, feed_id = position or (0, 0)
+    return f'{shard}:{tx}:{feed_id}'
+
+
+def parse_cursor(cursor):
+    """(shard, (tx, feed id)) from a cursor string; raises ValueError if malformed"""
+    parts = [int(part) for part in (cursor or '').split(':')]
+    if len(parts) == 2:
+        # From before feed entries had a tx: on PostgreSQL every later entry sorts after it, so nothing is skipped
+        parts.insert(1, 0)
+    if len(parts) != 3:
+        raise ValueError(cursor)
+    shard, tx, feed_id = parts
+    return shard, (tx, feed_id)
+
+
+def settled_tx(db, postgres):
+    """Entries with a lower tx are final: no transaction can still commit one before them"""
+    if not postgres:
+        return 1
+    return db.execute(POSTGRES_XMIN_SQL).fetchone()['xmin']
+
+
+def _plain(rows):
+    return [dict(row) for row in rows]
+
+
+def snapshot(db, user_id, horizon):
+    """Every row the user can see, with the feed position it is current as of"""
+    # Read the feed head first: changes racing the snapshot are sent again, never lost
+    head = db.execute(FEED_HEAD_SQL, (horizon,)).fetchone()
+    changes = {}
+    for table, query in SNAPSHOT_SQL.items():
+        changes[table] = _plain(db.execute(query, (user_id,) * query.count('?')).fetchall())
+    return (head['tx'], head['id']) if head else None, changes, {}
+
+
+def changes_since(db, user_id, since, horizon, limit):
+    """One page of the user's changes after feed position since: (last position, changed rows, deleted IDs, has_more)"""
+    tx, feed_id = since
+    entries = db.execute(FEED_PAGE_SQL, (user_id, tx, tx, feed_id, horizon, limit)).fetchall()
+    # Last entry per row wins
+    latest = {}
+    for entry in entries:
+        latest[(entry['table_name'], entry['row_id'])] = bool(entry['deleted'])
+
+    changes, deleted = {}, {}
+    for table in SYNC_COLUMNS:
+        removed = [row_id for (name, row_id), gone in latest.items() if name == table and gone]
+        wanted = [row_id for (name, row_id), gone in latest.items() if name == table and not gone]
+        rows = []
+        if wanted:
+            placeholders = ', '.join('?' for _ in wanted)
+            rows = _plain(db.execute(
+                f'SELECT {SYNC_COLUMNS[table]} FROM {table} WHERE id IN ({placeholders})', wanted).fetchall())
+            # Deleted again after the last entry on this page
+            found = {row['id'] for row in rows}
+            removed += [row_id for row_id in wanted if row_id not in found]
+        if rows:
+            changes[table] = rows
+        if removed:
+            deleted[table] = sorted(removed)
+
+    last = (entries[-1]['tx'], entries[-1]['id']) if entries else since
+    return last, changes, deleted, len(entries) == limit
+
+
+def pruned_through(db):
+    """Position of the last pruned feed entry, (0, 0) if none was"""
+    versions = {row['name']: row['version'] for row in db.execute(PRUNED_SQL).fetchall()}
+    return versions.get('change_feed_pruned_tx', 0), versions.get('change_feed_pruned', 0)
+
+
+def prune_feed(db, days=SYNC_RETENTION_DAYS):
+    """Delete feed entries older than days; returns how many were removed"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = (now - timedelta(days=days)).isoformat(' ')
+    last = db.execute('SELECT tx, id FROM change_feed WHERE changed_at < ? ORDER BY tx DESC, id DESC LIMIT 1',
+                      (cutoff,)).fetchone()
+    if not last:
+        return 0
+    tx, feed_id = last['tx'], last['id']
+    removed = db.execute('DELETE FROM change_feed WHERE tx < ? OR (tx = ? AND id <= ?)', (tx, tx, feed_id)).rowcount
+    db.execute(PRUNED_UPSERT_SQL, ('change_feed_pruned_tx', tx, now.isoformat(' ')))
+    db.execute(PRUNED_UPSERT_SQL, ('change_feed_pruned', feed_id, now.isoformat(' ')))
+    return removed
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+
+    args = sys.argv[1:]
+    if not args or args[0] != 'prune':
+        print("Usage: python3 sync.py prune [--days N]")
+        sys.exit(1)
+    days = int(args[args.index('--days') + 1]) if '--days' in args else SYNC_RETENTION_DAYS
+
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        from app import PostgresDB, normalize_database_url, pg_connect
+        db = PostgresDB(pg_connect(normalize_database_url(database_url)))
+    else:
+        db = sqlite3.connect(os.environ.get('SQLITE_DATABASE', 'trainer_dashboard.db'))
+        db.row_factory = sqlite3.Row
+
+    try:
+        removed = prune_feed(db, days)
+        db.commit()
+        print(f"Removed {removed} change feed entries older than {days} days")
+    finally:
+        db.close()